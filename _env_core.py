@@ -1,43 +1,176 @@
 # -*- coding: utf-8 -*-
+# Importar este módulo no debe costar nada al iniciar QGIS: Qt/QGIS, las
+# descargas (urllib, zipfile...) y subprocess se importan dentro de los
+# métodos que los usan, y las rutas de la instalación de QGIS se exploran una
+# sola vez, la primera vez que hacen falta.
 import os, platform
-from qgis.core import QgsApplication
-from qgis.PyQt.QtCore import QObject, QProcess, pyqtSignal, QTimer, QProcessEnvironment
-import hashlib, urllib.request, shutil, zipfile, socket
-
-class _SeqRunner(QObject):
-    log = pyqtSignal(str)
-    finished = pyqtSignal(int)
-    def __init__(self, parent=None, env_vars=None):
-        super().__init__(parent)
-        self._cmds=[]; self._idx=-1; self._p=None; self._env=env_vars or {}
-    def start(self, commands):
-        self._cmds=list(commands); self._idx=-1; self._next()
-    def _apply_env(self, p:QProcess):
-        if not self._env: return
-        env=QProcessEnvironment.systemEnvironment()
-        for k,v in self._env.items(): env.insert(k,v)
-        p.setProcessEnvironment(env)
-    def _next(self):
-        if self._p: self._p.deleteLater(); self._p=None
-        self._idx+=1
-        if self._idx>=len(self._cmds): self.finished.emit(0); return
-        argv=self._cmds[self._idx]; self.log.emit("\n$ "+" ".join(argv)+"\n")
-        p=QProcess(); self._apply_env(p)
-        p.setProcessChannelMode(QProcess.MergedChannels)
-        p.readyReadStandardOutput.connect(lambda: self.log.emit(
-            p.readAllStandardOutput().data().decode("utf-8","replace").rstrip("\n")
-        ))
-        p.finished.connect(lambda rc,_s: self._done(p,rc))
-        self._p=p; p.start(argv[0], argv[1:])       
-    def _done(self,p,rc):
-        self.log.emit(f"[exit code: {rc}]")
-        if rc!=0: self.finished.emit(rc)
-        else: QTimer.singleShot(10, self._next)
+import collections, itertools, json, threading
+
+class WorkerError(RuntimeError):
+    """Error devuelto por el proceso persistente del venv (o su caída)."""
+
+
+class WorkerCancelled(WorkerError):
+    """La corrida se canceló antes de terminar."""
+
+
+# Etapas con ventanas: (inicio, ancho) en la barra de un trabajo. Los pasos sin
+# ventanas (diagnóstico, AOI, postprocesamiento, productos) solo marcan dónde
+# va la corrida y son puntos de cancelación.
+_STAGE_SPANS = {"semantic": (0.0, 40.0), "instances": (40.0, 60.0)}
+_STEP_PERCENT = {"diagnostic": 0.0, "roi": 0.0, "semantic_postprocess": 40.0,
+                 "labeling": 100.0, "products": 100.0, "polygonize": 100.0}
+
+
+def stage_percent(event):
+    """Porcentaje (0-100) de un trabajo a partir de un evento de progreso del venv."""
+    stage = event.get("stage")
+    if stage in _STEP_PERCENT:
+        return _STEP_PERCENT[stage]
+    start, span = _STAGE_SPANS.get(stage, (0.0, 100.0))
+    total = event.get("total") or 0
+    return start + span * (event.get("done", 0) / total if total else 1.0)
+
+
+def stage_text(event):
+    """Texto de progreso de un evento: ventanas (o bandas) hechas, % de la poligonización o el paso."""
+    stage = event.get("stage")
+    if stage == "polygonize":
+        return f"{stage}: {event.get('done', 0)}%"
+    if stage in _STEP_PERCENT:
+        return stage
+    unit = "bandas" if stage == "bands" else "ventanas"
+    return f"{stage}: {event.get('done', 0)}/{event.get('total', 0)} {unit} ({event.get('rate', 0.0):.1f}/s)"
+
+
+class _InferenceWorker:
+    """
+    Cliente del proceso persistente palmeras_algo.worker: una petición JSON por
+    línea en stdin y su respuesta en stdout. stderr (los logs del pipeline) se
+    drena en un hilo aparte. Se usa subprocess en vez de QProcess porque el
+    proceso vive más que el hilo de Processing que lo inició.
+    """
+    def __init__(self, argv, env):
+        import subprocess
+        flags = subprocess.CREATE_NO_WINDOW if os.name == "nt" else 0
+        self._proc = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE, env=env, creationflags=flags,
+                                      encoding="utf-8", errors="replace", bufsize=1)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._cancel_requested = False
+        self._ids = itertools.count(1)
+        self._tail = collections.deque(maxlen=200)
+        self._log = None
+        threading.Thread(target=self._drain_stderr, daemon=True).start()
+
+    def alive(self):
+        return self._proc.poll() is None
+
+    def _drain_stderr(self):
+        for line in self._proc.stderr:
+            line = line.rstrip("\n")
+            self._tail.append(line)
+            log = self._log
+            if log:
+                try:
+                    log(line)
+                except Exception:
+                    pass
+
+    def _send(self, message):
+        with self._write_lock:
+            self._proc.stdin.write(json.dumps(message) + "\n")
+            self._proc.stdin.flush()
+
+    def _watch_cancel(self, req_id, is_cancelled, finished, kill_timeout):
+        """Pide cancelar cuando el usuario cancela; si el venv no responde, lo mata."""
+        while not finished.wait(0.2):
+            if is_cancelled():
+                self._cancel_requested = True
+                try:
+                    self._send({"method": "cancel", "params": {"id": req_id}})
+                except OSError:
+                    pass
+                if not finished.wait(kill_timeout):
+                    self._proc.kill()
+                return
+
+    def call(self, method, params=None, log=None, on_event=None, is_cancelled=None, kill_timeout=30):
+        """
+        Ejecuta 'method' en el venv y devuelve su resultado (una corrida a la vez).
+        'on_event' recibe los eventos de progreso; 'is_cancelled' se consulta
+        periódicamente y, si devuelve True, el venv se detiene en el siguiente
+        lote de ventanas (o se mata tras 'kill_timeout' segundos).
+        """
+        import subprocess
+        with self._lock:
+            self._log = log
+            self._cancel_requested = False
+            finished = threading.Event()
+            try:
+                req_id = next(self._ids)
+                try:
+                    self._send({"id": req_id, "method": method, "params": params or {}})
+                except OSError as e:
+                    raise WorkerError(f"No se pudo enviar la petición al entorno aislado: {e}")
+                if is_cancelled:
+                    threading.Thread(target=self._watch_cancel, daemon=True,
+                                     args=(req_id, is_cancelled, finished, kill_timeout)).start()
+                for line in self._proc.stdout:
+                    try:
+                        msg = json.loads(line)
+                    except ValueError:
+                        continue
+                    if "event" in msg:
+                        if on_event:
+                            on_event(msg)
+                        continue
+                    if msg.get("id") != req_id:
+                        continue
+                    if msg.get("cancelled"):
+                        raise WorkerCancelled(msg["error"])
+                    if "error" in msg:
+                        raise WorkerError(msg["error"] + "\n" + msg.get("traceback", ""))
+                    return msg.get("result")
+                try:
+                    self._proc.wait(5)  # stdout cerrado: el proceso terminó o está terminando
+                except subprocess.TimeoutExpired:
+                    self._proc.kill()
+                if self._cancel_requested:
+                    raise WorkerCancelled("Corrida cancelada: el proceso aislado fue detenido")
+                raise WorkerError("El proceso aislado terminó inesperadamente:\n" + "\n".join(self._tail))
+            finally:
+                finished.set()
+                self._log = None
+
+    def close(self, timeout=5):
+        if not self.alive():
+            return
+        try:
+            self._send({"id": 0, "method": "shutdown"})
+            self._proc.wait(timeout)
+        except Exception:
+            self._proc.kill()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+_qgis_paths_cache = None
+
+
+def shutdown_worker():
+    """Apaga el proceso persistente del venv, si está corriendo."""
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _worker.close()
+            _worker = None
+
 
 class EnvCore:
     def __init__(self, plugin_name):
         self.plugin_name=plugin_name
-        self.profile_root=QgsApplication.qgisSettingsDirPath()
         #self.venv_path=os.path.join(self.profile_root,"python","venvs",plugin_name)
         plugin_dir = os.path.dirname(__file__)
         self.venv_path=os.path.join(plugin_dir, "trained_models")
@@ -45,7 +178,11 @@ class EnvCore:
             self.venv_python=os.path.join(self.venv_path,"Scripts","python.exe")
         else:
             self.venv_python=os.path.join(self.venv_path,"bin","python")
-        os.makedirs(os.path.dirname(self.venv_path), exist_ok=True)
+
+    @property
+    def profile_root(self):
+        from qgis.core import QgsApplication
+        return QgsApplication.qgisSettingsDirPath()
 
     def venv_exists(self): return os.path.exists(self.venv_python)
 
@@ -74,6 +211,7 @@ class EnvCore:
         ]
 
     def find_embedded_python(self):
+        from qgis.core import QgsApplication
         base=QgsApplication.prefixPath()
         apps_dir=os.path.abspath(os.path.join(base,".."))
         if os.path.isdir(apps_dir):
@@ -84,6 +222,10 @@ class EnvCore:
         return os.path.join(apps_dir,"Python39","python.exe")
 
     def _qgis_paths(self):
+        global _qgis_paths_cache
+        if _qgis_paths_cache is not None:
+            return _qgis_paths_cache
+        from qgis.core import QgsApplication
         apps_dir=os.path.abspath(os.path.join(QgsApplication.prefixPath(),".."))
         bin_dir=os.path.abspath(os.path.join(apps_dir,"..","bin"))
         py_dir=None
@@ -91,13 +233,16 @@ class EnvCore:
             if n.lower().startswith("python3"): py_dir=os.path.join(apps_dir,n); break
         if not py_dir: py_dir=os.path.join(apps_dir,"Python39")
         dlls_dir=os.path.join(py_dir,"DLLs"); qt_bin=os.path.join(apps_dir,"Qt5","bin")
-        return bin_dir, py_dir, dlls_dir, qt_bin
+        _qgis_paths_cache = (bin_dir, py_dir, dlls_dir, qt_bin)
+        return _qgis_paths_cache
 
     def build_env(self):
         bin_dir, py_dir, dlls_dir, qt_bin = self._qgis_paths()
         env = dict(os.environ)
         sep = ";" if os.name == "nt" else ":"
         env["QGIS_PY_SITE"] = os.path.join(py_dir, "Lib", "site-packages")
+        # Para los procesos hijos del venv (ver palmeras_algo/__init__.py)
+        env["PALMERAS_DLL_DIRS"] = os.pathsep.join([bin_dir, dlls_dir])
         # SOLO DLLs necesarias para SSL/Qt. NO metemos ...\apps\Python39 en PATH:
         prepend = [p for p in (bin_dir, dlls_dir, qt_bin) if os.path.isdir(p)]
         env["PATH"] = sep.join(prepend) + sep + env.get("PATH", "")
@@ -122,6 +267,7 @@ class EnvCore:
         Verifica/descarga los modelos ONNX después de crear el venv e instalar librerías.
         Si 'log_cb' se pasa (p. ej., self._append del diálogo), lo usa para loguear; si no, usa print.
         """
+        import hashlib, urllib.request, shutil, zipfile, socket
         log = log_cb or (lambda m: print(m))
         plugin_dir = os.path.dirname(__file__)
         trained_dir = os.path.join(plugin_dir, "trained_models")
@@ -242,7 +388,28 @@ class EnvCore:
                  "runpy.run_module('pip', run_name='__main__')"],
         ]+self.bridge_osgeo_commands()
 
+    def worker(self, python_path=None):
+        """
+        Devuelve el proceso persistente del venv (palmeras_algo.worker), que
+        mantiene los modelos ONNX cargados entre corridas. Se inicia la primera
+        vez que se pide y se vuelve a iniciar si terminó; se apaga con
+        shutdown_worker() al descargar el plugin.
+        'python_path' se antepone como PYTHONPATH (carpeta del plugin).
+        """
+        global _worker
+        with _worker_lock:
+            if _worker is None or not _worker.alive():
+                env = self.build_env()
+                if python_path:
+                    env["PYTHONPATH"] = python_path
+                argv = [self.venv_python, "-u", "-c",
+                        self.dll_snippet() + "; import runpy; "
+                        "runpy.run_module('palmeras_algo.worker', run_name='__main__')"]
+                _worker = _InferenceWorker(argv, env)
+            return _worker
+
     def make_seq_runner(self, parent, log_slot):
+        from ._seq_runner import _SeqRunner
         r=_SeqRunner(parent=parent, env_vars=self.build_env())
         r.log.connect(log_slot); return r
 
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Parámetros de productos (capas, tablas, métricas, densidad e índice) que
+# comparten los algoritmos de detección de un ráster y por lotes: se definen
+# una sola vez y se leen como las opciones de palmeras_algo.products.
+from qgis.core import (QgsProcessingParameterBoolean,
+                       QgsProcessingParameterDefinition,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterNumber)
+
+VECTOR_FORMAT = 'VECTOR_FORMAT'
+TABLE_FORMAT = 'TABLE_FORMAT'
+METRICS = 'METRICS'
+DENSITY_CELL = 'DENSITY_CELL'
+SPATIAL_INDEX = 'SPATIAL_INDEX'
+
+# (valor para el venv, etiqueta) en el orden de las opciones de cada enum
+VECTOR_FORMATS = [('SHP', 'ESRI Shapefile'),                        # palmeras_algo.vectorize.FORMATS
+                  ('GPKG', 'GeoPackage (single package)'),
+                  ('FGB', 'FlatGeobuf')]
+TABLE_FORMATS = [(None, 'None'), ('parquet', 'Parquet'), ('csv', 'CSV')]  # palmeras_algo.tables.TABLE_FORMATS
+METRIC_NAMES = [('diameter', 'Equivalent diameter'),                 # palmeras_algo.instances.METRICS
+                ('perimeter', 'Perimeter'),
+                ('compactness', 'Compactness'),
+                ('bbox', 'Bounding box')]
+
+
+def _advanced(parameter):
+    parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+    return parameter
+
+
+def add_product_parameters(algorithm):
+    """Agrega a 'algorithm' los parámetros de productos, en el orden de siempre."""
+    tr = algorithm.tr
+    # Capas de copas y centroides; GeoPackage las junta con la tabla de atributos
+    algorithm.addParameter(
+        QgsProcessingParameterEnum(
+            VECTOR_FORMAT,
+            tr('Vector format'),
+            options=[label for _, label in VECTOR_FORMATS],
+            defaultValue=0
+        )
+    )
+
+    # Tabla de palmeras con flight_id para pandas/DuckDB (Parquet requiere pyarrow en el venv; si no, CSV)
+    algorithm.addParameter(_advanced(
+        QgsProcessingParameterEnum(
+            TABLE_FORMAT,
+            tr('Palm table export'),
+            options=[label for _, label in TABLE_FORMATS],
+            defaultValue=0
+        )
+    ))
+
+    # Métricas de forma por copa en capas y tablas; las no elegidas no se calculan
+    algorithm.addParameter(_advanced(
+        QgsProcessingParameterEnum(
+            METRICS,
+            tr('Crown metrics'),
+            options=[label for _, label in METRIC_NAMES],
+            allowMultiple=True,
+            defaultValue=[],
+            optional=True
+        )
+    ))
+
+    # Grilla de palmeras/ha por especie (0 = no se escribe)
+    algorithm.addParameter(_advanced(
+        QgsProcessingParameterNumber(
+            DENSITY_CELL,
+            tr('Density grid cell size (m, 0 = none)'),
+            type=QgsProcessingParameterNumber.Double,
+            defaultValue=0,
+            minValue=0
+        )
+    ))
+
+    # Índice de centroides para el algoritmo de conteo por polígonos
+    algorithm.addParameter(_advanced(
+        QgsProcessingParameterBoolean(
+            SPATIAL_INDEX,
+            tr('Write spatial index for polygon counts'),
+            defaultValue=False
+        )
+    ))
+
+
+def product_options(algorithm, parameters, context):
+    """Opciones de productos para el worker del venv (ver palmeras_algo.products.write_products)."""
+    return {
+        'vector_format': VECTOR_FORMATS[algorithm.parameterAsEnum(parameters, VECTOR_FORMAT, context)][0],
+        'table_format': TABLE_FORMATS[algorithm.parameterAsEnum(parameters, TABLE_FORMAT, context)][0],
+        'metrics': [METRIC_NAMES[i][0] for i in algorithm.parameterAsEnums(parameters, METRICS, context)],
+        'density_cell': algorithm.parameterAsDouble(parameters, DENSITY_CELL, context) or None,
+        'spatial_index': algorithm.parameterAsBoolean(parameters, SPATIAL_INDEX, context),
+    }
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from qgis.PyQt.QtCore import QObject, QProcess, pyqtSignal, QTimer, QProcessEnvironment
+
+class _SeqRunner(QObject):
+    log = pyqtSignal(str)
+    finished = pyqtSignal(int)
+    def __init__(self, parent=None, env_vars=None):
+        super().__init__(parent)
+        self._cmds=[]; self._idx=-1; self._p=None; self._env=env_vars or {}
+    def start(self, commands):
+        self._cmds=list(commands); self._idx=-1; self._next()
+    def _apply_env(self, p:QProcess):
+        if not self._env: return
+        env=QProcessEnvironment.systemEnvironment()
+        for k,v in self._env.items(): env.insert(k,v)
+        p.setProcessEnvironment(env)
+    def _next(self):
+        if self._p: self._p.deleteLater(); self._p=None
+        self._idx+=1
+        if self._idx>=len(self._cmds): self.finished.emit(0); return
+        argv=self._cmds[self._idx]; self.log.emit("\n$ "+" ".join(argv)+"\n")
+        p=QProcess(); self._apply_env(p)
+        p.setProcessChannelMode(QProcess.MergedChannels)
+        p.readyReadStandardOutput.connect(lambda: self.log.emit(
+            p.readAllStandardOutput().data().decode("utf-8","replace").rstrip("\n")
+        ))
+        p.finished.connect(lambda rc,_s: self._done(p,rc))
+        self._p=p; p.start(argv[0], argv[1:])       
+    def _done(self,p,rc):
+        self.log.emit(f"[exit code: {rc}]")
+        if rc!=0: self.finished.emit(rc)
+        else: QTimer.singleShot(10, self._next)
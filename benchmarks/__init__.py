@@ -0,0 +1,2 @@
+# Benchmarks del pipeline de palmeras_algo con rásteres y modelos sintéticos
+# (python -m benchmarks.run). No forman parte del plugin empaquetado.
@@ -0,0 +1,111 @@
+##### Modelos ONNX pequeños con las mismas entradas/salidas que los reales ####
+#
+# Semántico: input [N, H, W, 3] float32 -> [N, H, W, 4] (logits por clase, NHWC)
+# Instancias: image [N, H, W, 4] float32 + ss [N, H, W] float32 -> [N, H, W]
+#             (niveles de "profundidad" que umbraliza watershed_cut)
+# Los pesos salen de una semilla fija, así dos corridas del benchmark usan
+# exactamente los mismos modelos. 'depth' capas conv 3x3 de 'width' canales
+# simulan el costo de cómputo; no pretenden detectar palmeras.
+
+import os
+
+import numpy as np
+
+SEMANTIC_NAME = "model_deeplabv3_segmentation_v1.onnx"
+INSTANCES_NAME = "model_dwt_instance_segmenetation_v1.onnx"
+OPSET = 13
+# IR 7 (opset 13) lo carga cualquier onnxruntime >= 1.8
+IR_VERSION = 7
+
+
+def _onnx():
+    try:
+        import onnx
+        from onnx import helper
+    except ImportError:
+        raise ImportError("Los benchmarks necesitan el paquete 'onnx' para crear los modelos "
+                          "(pip install onnx)") from None
+    return onnx, helper
+
+
+def _conv_stack(helper, nodes, inits, rng, x, in_ch, width, depth, prefix):
+    """Capas conv 3x3 + Relu sobre un tensor NCHW; devuelve (nombre, canales)."""
+    from onnx import numpy_helper
+    for i in range(depth):
+        w = numpy_helper.from_array((rng.standard_normal((width, in_ch, 3, 3)) * 0.1).astype(np.float32),
+                                    f'{prefix}_w{i}')
+        b = numpy_helper.from_array(np.zeros(width, dtype=np.float32), f'{prefix}_b{i}')
+        inits += [w, b]
+        nodes.append(helper.make_node('Conv', [x, w.name, b.name], [f'{prefix}_c{i}'], pads=[1, 1, 1, 1]))
+        nodes.append(helper.make_node('Relu', [f'{prefix}_c{i}'], [f'{prefix}_r{i}']))
+        x, in_ch = f'{prefix}_r{i}', width
+    return x, in_ch
+
+
+def semantic_model(path, depth=2, width=8, seed=0):
+    onnx, helper = _onnx()
+    from onnx import TensorProto, numpy_helper
+    rng = np.random.default_rng(seed)
+    nodes, inits = [], []
+    nodes.append(helper.make_node('Transpose', ['input'], ['nchw'], perm=[0, 3, 1, 2]))
+    x, ch = _conv_stack(helper, nodes, inits, rng, 'nchw', 3, width, depth, 'sem')
+    # Cabeza 1x1: el color decide la clase (fondo, mauritia, euterpe, oenocarpus)
+    head = numpy_helper.from_array((rng.standard_normal((4, ch, 1, 1))).astype(np.float32), 'head_w')
+    inits.append(head)
+    nodes.append(helper.make_node('Conv', [x, 'head_w'], ['logits_nchw']))
+    nodes.append(helper.make_node('Transpose', ['logits_nchw'], ['logits'], perm=[0, 2, 3, 1]))
+    graph = helper.make_graph(
+        nodes, 'semantic_stand_in',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, ['N', 'H', 'W', 3])],
+        [helper.make_tensor_value_info('logits', TensorProto.FLOAT, ['N', 'H', 'W', 4])],
+        initializer=inits)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', OPSET)], ir_version=IR_VERSION)
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+
+def instance_model(path, depth=2, width=8, seed=1):
+    onnx, helper = _onnx()
+    from onnx import TensorProto, numpy_helper
+    rng = np.random.default_rng(seed)
+    nodes, inits = [], []
+    nodes.append(helper.make_node('Transpose', ['image'], ['nchw'], perm=[0, 3, 1, 2]))
+    x, ch = _conv_stack(helper, nodes, inits, rng, 'nchw', 4, width, depth, 'ins')
+    # Profundidad = brillo RGB medio (0-255) escalado a [0, 6], solo dentro de la
+    # máscara semántica; las capas conv aportan cómputo y un término pequeño
+    rgb_w = numpy_helper.from_array(np.array([1, 1, 1, 0], dtype=np.float32).reshape(1, 4, 1, 1) / 96,
+                                    'rgb_w')
+    mix_w = numpy_helper.from_array(np.full((1, ch, 1, 1), 1e-3, dtype=np.float32), 'mix_w')
+    lo = numpy_helper.from_array(np.array(0, dtype=np.float32), 'lo')
+    hi = numpy_helper.from_array(np.array(6, dtype=np.float32), 'hi')
+    axes = numpy_helper.from_array(np.array([1], dtype=np.int64), 'axes')
+    inits += [rgb_w, mix_w, lo, hi, axes]
+    nodes.append(helper.make_node('Conv', ['nchw', 'rgb_w'], ['bright']))
+    nodes.append(helper.make_node('Conv', [x, 'mix_w'], ['mix']))
+    nodes.append(helper.make_node('Add', ['bright', 'mix'], ['depth_n1hw']))
+    nodes.append(helper.make_node('Squeeze', ['depth_n1hw', 'axes'], ['depth_raw']))
+    nodes.append(helper.make_node('Clip', ['depth_raw', 'lo', 'hi'], ['depth_clip']))
+    nodes.append(helper.make_node('Mul', ['depth_clip', 'ss'], ['depth']))
+    graph = helper.make_graph(
+        nodes, 'instance_stand_in',
+        [helper.make_tensor_value_info('image', TensorProto.FLOAT, ['N', 'H', 'W', 4]),
+         helper.make_tensor_value_info('ss', TensorProto.FLOAT, ['N', 'H', 'W'])],
+        [helper.make_tensor_value_info('depth', TensorProto.FLOAT, ['N', 'H', 'W'])],
+        initializer=inits)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', OPSET)], ir_version=IR_VERSION)
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+
+def build_models(folder, depth=2, width=8):
+    """Crea (si faltan) los dos modelos en 'folder', con los nombres de los reales."""
+    os.makedirs(folder, exist_ok=True)
+    semantic = os.path.join(folder, SEMANTIC_NAME)
+    instances = os.path.join(folder, INSTANCES_NAME)
+    if not os.path.exists(semantic):
+        semantic_model(semantic, depth, width)
+    if not os.path.exists(instances):
+        instance_model(instances, depth, width)
+    return semantic, instances
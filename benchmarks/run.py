@@ -0,0 +1,165 @@
+##### Benchmark del pipeline completo fuera de QGIS ####
+#
+#   python -m benchmarks.run [--sizes 2048,4096] [--dtypes Byte,UInt16] [--nodata 0,0.3]
+#                            [--workdir DIR] [--output resultados.json] [--compare base.json]
+#
+# Cada caso (tamaño x tipo de dato x fracción de nodata) corre en un proceso
+# nuevo, con los modelos de benchmarks/models.py y la caché de ventanas
+# desactivada, así el pico de memoria y los tiempos son del caso y no de los
+# anteriores. El JSON de salida guarda el commit, las versiones y los tiempos
+# por etapa del reporte de palmeras_algo.perf; --compare lo contrasta con el
+# de otra corrida (otro commit, otra máquina).
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from . import models
+from . import synthetic
+
+DEFAULT_SIZES = '1024,2048'
+DEFAULT_DTYPES = 'Byte'
+DEFAULT_NODATA = '0,0.3'
+# Variación (en %) a partir de la cual --compare marca una etapa
+REGRESSION_PCT = 10.0
+
+
+def _run_case(case):
+    """Corre apply_palmeras sobre el ráster del caso (en un proceso hijo)."""
+    from palmeras_algo import palmeras_deteccion, perf
+    from palmeras_algo.log import configure_logging
+    configure_logging('WARNING')
+
+    t0 = time.perf_counter()
+    sessions = palmeras_deteccion.load_sessions(intra_op_num_threads=case['threads'])
+    load_s = time.perf_counter() - t0
+    output = os.path.join(case['workdir'], case['id'] + '_out.tif')
+    _, _, mau, eut, oeno = palmeras_deteccion.apply_palmeras(
+        case['input'], output, sessions=sessions, resume=False, cache_max_mb=0,
+        batch_size=case['batch_size'])
+    report = perf.read_report(perf.report_path(output))
+    report['load_models_s'] = round(load_s, 3)
+    # Un proceso por caso: su pico de toda la vida es el del caso, también entre muestras
+    report['peak_rss_mb'] = report['process_peak_rss_mb']
+    report['counts'] = [mau, eut, oeno]
+    return report
+
+
+def _versions():
+    import numpy
+    import onnxruntime
+    from osgeo import gdal
+    return {'python': platform.python_version(), 'numpy': numpy.__version__,
+            'onnxruntime': onnxruntime.__version__, 'gdal': gdal.__version__}
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(sizes, dtypes, nodata_fractions, workdir, threads=0, batch_size=None, repeat=1):
+    from palmeras_algo import tile_cache
+    models_dir = os.path.join(workdir, 'models')
+    semantic, instances = models.build_models(models_dir)
+    # Los procesos hijos heredan el entorno: palmeras_deteccion toma de aquí los modelos
+    os.environ['PALMERAS_MODELS_DIR'] = models_dir
+
+    results = {
+        'commit': _git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'versions': _versions(),
+        'models': {'semantic': tile_cache.model_sha256(semantic)[:12],
+                   'instances': tile_cache.model_sha256(instances)[:12]},
+        'settings': {'threads': threads, 'batch_size': batch_size, 'repeat': repeat},
+        'cases': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    for size in sizes:
+        for dtype in dtypes:
+            for fraction in nodata_fractions:
+                case_id = os.path.splitext(synthetic.raster_name(size, size, dtype, fraction))[0]
+                case = {'id': case_id, 'workdir': workdir, 'threads': threads, 'batch_size': batch_size,
+                        'input': synthetic.ensure_raster(os.path.join(workdir, 'rasters'), size, size,
+                                                         dtype, fraction)}
+                runs = []
+                for _ in range(repeat):
+                    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                        runs.append(pool.submit(_run_case, case).result())
+                # La corrida más rápida es la menos afectada por ruido del sistema
+                best = min(runs, key=lambda r: r['wall_s'])
+                best['pixels'] = size * size
+                best['megapixels_per_s'] = round(size * size / 1e6 / best['wall_s'], 3)
+                results['cases'][case_id] = best
+                print(f"{case_id}: {best['wall_s']:.2f} s, {best['megapixels_per_s']:.2f} Mpx/s, "
+                      f"pico {best['peak_rss_mb']} MB")
+    return results
+
+
+def compare(current, baseline, threshold=REGRESSION_PCT):
+    """Líneas con la variación de tiempo total y por etapa respecto a 'baseline'."""
+    lines = [f"Comparando {current.get('commit')} con {baseline.get('commit')} "
+             f"(+ = más lento; '!' si supera {threshold:.0f}%)"]
+    for case_id, cur in current['cases'].items():
+        base = baseline['cases'].get(case_id)
+        if not base:
+            continue
+        rows = [('total', cur['wall_s'], base['wall_s']), ('peak_rss_mb', cur['peak_rss_mb'], base['peak_rss_mb'])]
+        rows += [(name, st['wall_s'], base['stages'][name]['wall_s'])
+                 for name, st in cur['stages'].items() if name in base['stages']]
+        lines.append(case_id)
+        for name, now, before in rows:
+            if not before or now is None:
+                continue
+            delta = 100.0 * (now - before) / before
+            flag = '!' if delta > threshold else ' '
+            lines.append(f" {flag} {name:<22} {before:>10.3f} -> {now:>10.3f} ({delta:+.1f}%)")
+    return lines
+
+
+def _csv(value, cast):
+    return [cast(v) for v in value.split(',') if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run',
+                                     description='Benchmark del pipeline con rásteres y modelos sintéticos')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='lados en píxeles, separados por comas')
+    parser.add_argument('--dtypes', default=DEFAULT_DTYPES, help=f"de {', '.join(synthetic.DTYPES)}")
+    parser.add_argument('--nodata', default=DEFAULT_NODATA, help='fracciones de nodata, separadas por comas')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'palmscnn-bench'),
+                        help='rásteres, modelos y salidas (se reutilizan entre corridas)')
+    parser.add_argument('--threads', type=int, default=0, help='hilos de ONNX Runtime (0 = todos)')
+    parser.add_argument('--batch-size', type=int, help='ventanas por llamada al modelo semántico')
+    parser.add_argument('--repeat', type=int, default=1, help='repeticiones por caso (se guarda la más rápida)')
+    parser.add_argument('--output', help='archivo JSON de resultados')
+    parser.add_argument('--compare', help='JSON de una corrida anterior para comparar')
+    args = parser.parse_args(argv)
+
+    results = run(_csv(args.sizes, int), _csv(args.dtypes, str), _csv(args.nodata, float),
+                  os.path.abspath(args.workdir), threads=args.threads, batch_size=args.batch_size,
+                  repeat=max(1, args.repeat))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            json.dump(results, fh, indent=1)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fh:
+            baseline = json.load(fh)
+        print('\n'.join(compare(results, baseline)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
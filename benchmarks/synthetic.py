@@ -0,0 +1,83 @@
+##### Ortomosaicos sintéticos para benchmarks ####
+#
+# Fondo de vegetación con ruido y copas circulares de tres colores (uno por
+# especie), escritos por bloques de filas para no necesitar el ráster completo
+# en memoria. Misma semilla -> mismo ráster, así las corridas son comparables.
+
+import os
+
+import numpy as np
+from osgeo import gdal, osr
+
+DTYPES = {
+    # tipo GDAL, tipo numpy, valor máximo de la escala
+    'Byte': (gdal.GDT_Byte, np.uint8, 255),
+    'UInt16': (gdal.GDT_UInt16, np.uint16, 4095),
+    'Float32': (gdal.GDT_Float32, np.float32, 1.0),
+}
+PIXEL_SIZE = 0.05      # m, típico de un vuelo RPA
+EPSG = 32718           # WGS 84 / UTM 18S
+NODATA = 0
+BLOCK_ROWS = 1024
+# Color medio (R, G, B en [0, 1]) del fondo y de cada tipo de copa
+BACKGROUND = (0.18, 0.32, 0.15)
+CROWNS = ((0.35, 0.45, 0.20), (0.25, 0.55, 0.25), (0.45, 0.40, 0.30))
+
+
+def raster_name(width, height, dtype, nodata_fraction):
+    return f"synth_{width}x{height}_{dtype}_nd{int(round(nodata_fraction * 100)):02d}.tif"
+
+
+def make_raster(path, width, height, dtype='Byte', nodata_fraction=0.0, crowns_per_mpx=60, seed=0):
+    """
+    Escribe un GeoTIFF RGB de width x height. Las primeras
+    'nodata_fraction' columnas quedan en nodata (borde típico de un mosaico).
+    """
+    gdal_type, np_type, scale = DTYPES[dtype]
+    rng = np.random.default_rng(seed)
+    n_crowns = int(crowns_per_mpx * width * height / 1e6)
+    cx = rng.uniform(0, width, n_crowns)
+    cy = rng.uniform(0, height, n_crowns)
+    cr = rng.uniform(12, 40, n_crowns)
+    kind = rng.integers(0, len(CROWNS), n_crowns)
+    nodata_cols = int(round(width * nodata_fraction))
+
+    driver = gdal.GetDriverByName('GTiff')
+    ds = driver.Create(path, width, height, 3, gdal_type,
+                       options=['TILED=YES', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'])
+    ds.SetGeoTransform((500000.0, PIXEL_SIZE, 0.0, 9000000.0, 0.0, -PIXEL_SIZE))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(EPSG)
+    ds.SetProjection(srs.ExportToWkt())
+    for b in range(3):
+        ds.GetRasterBand(b + 1).SetNoDataValue(NODATA)
+
+    xx = np.arange(width, dtype=np.float32)
+    for y0 in range(0, height, BLOCK_ROWS):
+        rows = min(BLOCK_ROWS, height - y0)
+        yy = np.arange(y0, y0 + rows, dtype=np.float32)[:, None]
+        block = np.empty((3, rows, width), dtype=np.float32)
+        for b in range(3):
+            block[b] = BACKGROUND[b] + rng.normal(0, 0.04, (rows, width))
+        near = np.flatnonzero((cy + cr >= y0) & (cy - cr < y0 + rows))
+        for i in near:
+            x0, x1 = int(max(0, cx[i] - cr[i])), int(min(width, cx[i] + cr[i] + 1))
+            inside = (xx[None, x0:x1] - cx[i]) ** 2 + (yy - cy[i]) ** 2 <= cr[i] ** 2
+            for b in range(3):
+                block[b, :, x0:x1][inside] = CROWNS[kind[i]][b] + rng.normal(0, 0.03, int(inside.sum()))
+        block = np.clip(block, 1.0 / scale if scale > 1 else 1e-3, 1.0) * scale
+        block[:, :, :nodata_cols] = NODATA
+        for b in range(3):
+            ds.GetRasterBand(b + 1).WriteArray(block[b].astype(np_type), 0, y0)
+    ds.FlushCache()
+    ds = None
+    return path
+
+
+def ensure_raster(folder, width, height, dtype='Byte', nodata_fraction=0.0, seed=0):
+    """Crea el ráster del caso si no existe todavía en 'folder'."""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, raster_name(width, height, dtype, nodata_fraction))
+    if not os.path.exists(path):
+        make_raster(path, width, height, dtype, nodata_fraction, seed=seed)
+    return path
@@ -36,7 +36,6 @@ import inspect
 
 from qgis.PyQt.QtWidgets import QAction#icon
 from qgis.PyQt.QtGui import QIcon#icon
-import processing #icon
 from qgis.core import QgsProcessingAlgorithm, QgsApplication
 from .deteccion_de_palmeras_provider import DeteccionDePalmerasProvider
 
@@ -83,6 +82,12 @@ class DeteccionDePalmerasPlugin(object):
         except Exception:
             pass
         '''
+        # Apagar el proceso persistente del venv (modelos cargados en memoria)
+        try:
+            from ._env_core import shutdown_worker
+            shutdown_worker()
+        except Exception:
+            pass
         QgsApplication.processingRegistry().removeProvider(self.provider)
         self.iface.removePluginMenu(u"&Palmeras", self.action)#icon
         self.iface.removeToolBarIcon(self.action)#icon
@@ -91,6 +96,7 @@ class DeteccionDePalmerasPlugin(object):
     def run(self):#icon
         # Verificar dependencias antes de ejecutar el algoritmo
         try:
+            import processing
             from .palmeras_dependency import ensure_dependencies
             deps_ok = ensure_dependencies(self.iface)
             if deps_ok:
@@ -38,7 +38,10 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterFeatureSink,
                        QgsProcessingParameterRasterLayer,
                        QgsProcessingParameterRasterDestination,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterDefinition,
                        QgsProcessingOutputVectorLayer,
+                       QgsProcessingOutputRasterLayer,
                        QgsProcessingOutputNumber,
                        QgsProcessingOutputFile)
 
@@ -46,6 +49,8 @@ import os
 import inspect
 from qgis.PyQt.QtGui import QIcon #icon
 
+from ._product_parameters import add_product_parameters, product_options
+
 cmd_folder = os.path.split(inspect.getfile(inspect.currentframe()))[0]
 class DeteccionDePalmerasAlgorithm(QgsProcessingAlgorithm):
     """
@@ -69,10 +74,15 @@ class DeteccionDePalmerasAlgorithm(QgsProcessingAlgorithm):
     #INPUT = 'INPUT'
     
     INPUT_RASTER = 'INPUT_RASTER'
+    INPUT_ROI = 'INPUT_ROI'
+    PROCESSES = 'PROCESSES'
+    MAX_MEMORY_MB = 'MAX_MEMORY_MB'
     OUTPUT_RASTER = 'OUTPUT_RASTER'
     OUTPUT_VECTOR = 'OUTPUT_VECTOR'
     OUTPUT_CENTROIDES = 'OUTPUT_CENTROIDES'
     ATRIBUTOS_CSV = 'ATRIBUTOS_CSV'
+    TABLA_INSTANCIAS = 'TABLA_INSTANCIAS'
+    DENSIDAD = 'DENSIDAD'
     REPORTE_CSV = 'REPORTE_CSV'
     NMAURITIA = 'CANTIDAD_DE_MAURITIA_FLEXUOSA'
     NEUTERPE = 'CANTIDAD_DE_EUTERPE_PRECAUTORIA'
@@ -94,6 +104,39 @@ class DeteccionDePalmerasAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_ROI,
+                self.tr('Area of interest'),
+                [QgsProcessing.TypeVectorPolygon],
+                optional=True
+            )
+        )
+
+        # Rásteres muy grandes: bandas horizontales en procesos paralelos
+        processes = QgsProcessingParameterNumber(
+            self.PROCESSES,
+            self.tr('Parallel processes (row bands)'),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=1,
+            minValue=1
+        )
+        processes.setFlags(processes.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(processes)
+
+        # Presupuesto de memoria: ajusta lotes, bandas y procesos (0 = sin límite)
+        max_memory = QgsProcessingParameterNumber(
+            self.MAX_MEMORY_MB,
+            self.tr('Maximum memory (MB, 0 = no limit)'),
+            type=QgsProcessingParameterNumber.Integer,
+            defaultValue=0,
+            minValue=0
+        )
+        max_memory.setFlags(max_memory.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(max_memory)
+
+        add_product_parameters(self)
+
 
         # output
         self.addParameter(
@@ -127,6 +170,20 @@ class DeteccionDePalmerasAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.TABLA_INSTANCIAS,
+                self.tr('Tabla de palmeras')
+            )
+        )
+
+        self.addOutput(
+            QgsProcessingOutputRasterLayer(
+                self.DENSIDAD,
+                self.tr('Densidad (palmeras/ha)')
+            )
+        )
+
         self.addOutput(
             QgsProcessingOutputFile(
                 self.REPORTE_CSV,
@@ -197,8 +254,6 @@ class DeteccionDePalmerasAlgorithm(QgsProcessingAlgorithm):
         Here is where the processing itself takes place.
         Dependencies were already checked in initAlgorithm.
         """
-        from .palmerasqgis_algo import palmeras_qgis_count
-        from .palmerasqgis_algo import palmeras_qgis_clas
         # Return the results of the algorithm. In this case our only result is
         # the feature sink which contains the processed features, but some
         # algorithms may return multiple feature sinks, calculated numeric
@@ -211,6 +266,17 @@ class DeteccionDePalmerasAlgorithm(QgsProcessingAlgorithm):
         INPUT_RASTER = self.parameterAsRasterLayer(
             parameters, self.INPUT_RASTER, context)
 
+        INPUT_ROI = self.parameterAsSource(
+            parameters, self.INPUT_ROI, context)
+
+        PROCESSES = self.parameterAsInt(
+            parameters, self.PROCESSES, context)
+
+        MAX_MEMORY_MB = self.parameterAsInt(
+            parameters, self.MAX_MEMORY_MB, context)
+
+        PRODUCTS = product_options(self, parameters, context)
+
         
         OUTPUT_RASTER = self.parameterAsOutputLayer(
             parameters, self.OUTPUT_RASTER, context)
@@ -230,90 +296,67 @@ class DeteccionDePalmerasAlgorithm(QgsProcessingAlgorithm):
         if feedback.isCanceled():
             return {}
         
-        # Ejecutar apply_palmeras dentro del venv aislado mediante QProcess
-        from ._env_core import EnvCore
-        from qgis.PyQt.QtCore import QProcess, QProcessEnvironment
+        # Ejecutar apply_palmeras dentro del venv aislado
+        from ._env_core import EnvCore, WorkerError, WorkerCancelled, stage_percent, stage_text
 
         _env = EnvCore(plugin_name="deteccion_de_palmeras_env")
         if not _env.venv_exists():
             raise RuntimeError("El entorno aislado no está preparado. Abre 'Dependencias' y créalo primero.")
 
-        # --- Preparar script a ejecutar en el venv ---
-        import tempfile, json
-
-        # Normaliza rutas en el lado QGIS (evitar backslashes en f-strings)
         _plugin_dir = os.path.dirname(__file__)
-        _plugin_dir_norm = _plugin_dir.replace("\\", "/")
         _in_raster = INPUT_RASTER.source()
         _out_raster = OUTPUT_RASTER
 
-        script_prolog = _env.dll_snippet() + "; import sys, os, json\n"
-
-        # Intento robusto: primero paquete 'palmeras_algo', luego módulo suelto 'palmeras_deteccion'
-        script_body = (
-            "import sys, json, importlib\n"
-            f"sys.path.insert(0, r'{_plugin_dir_norm}')\n"
-            "try:\n"
-            "    from palmeras_algo import palmeras_deteccion as _mod\n"
-            "except Exception:\n"
-            "    try:\n"
-            "        _mod = importlib.import_module('palmeras_deteccion')\n"
-            "    except Exception as e:\n"
-            "        import traceback; traceback.print_exc()\n"
-            "        raise\n"
-            f"_out_raster, _out_raster_clas, _mau, _eut, _oeno = _mod.apply_palmeras(r'{_in_raster}', r'{_out_raster}')\n"
-            "print(json.dumps({'out': [_out_raster, _out_raster_clas], 'counts': [_mau, _eut, _oeno]}))\n"
-        )
-
-        _script = tempfile.NamedTemporaryFile("w", suffix=".py", delete=False, encoding="utf-8")
-        _script.write(script_prolog + script_body)
-        _script.close()
-
-        # --- Ejecutar proceso en el venv ---
-        _proc = QProcess()
-        _envvars = _env.build_env()
-        _qenv = QProcessEnvironment.systemEnvironment()
-        for k, v in _envvars.items():
-            _qenv.insert(k, v)
-
-        # Refuerza PYTHONPATH con la carpeta del plugin (donde viven palmeras_algo/ o palmeras_deteccion.py)
-        _qenv.insert("PYTHONPATH", _plugin_dir)
-        _proc.setProcessEnvironment(_qenv)
-        _proc.setProcessChannelMode(QProcess.MergedChannels)
-
-        _buf = []
-        _proc.readyReadStandardOutput.connect(lambda: _buf.append(_proc.readAllStandardOutput().data().decode("utf-8", "replace")))
-        _proc.start(_env.venv_python, [_script.name])
-        _proc.waitForFinished(-1)
-        _rc = _proc.exitCode()
-
-        try:
-            os.unlink(_script.name)
-        except Exception:
-            pass
-
-        if _rc != 0:
-            raise RuntimeError("Fallo ejecutando apply_palmeras en el entorno aislado:\n" + "".join(_buf))
+        # AOI opcional: reproyectado al SRC del ráster para rasterizarlo en el venv
+        _roi = None
+        if INPUT_ROI is not None:
+            from qgis import processing
+            from qgis.core import QgsProcessingUtils
+            _roi = QgsProcessingUtils.generateTempFilename('roi.gpkg')
+            processing.run("native:reprojectlayer",
+                {'INPUT': parameters[self.INPUT_ROI],
+                'TARGET_CRS': INPUT_RASTER.crs(),
+                'OUTPUT': _roi},
+                context=context, feedback=feedback, is_child_algorithm=True)
+
+        # --- Ejecutar en el proceso persistente del venv (modelos ya cargados) ---
+        # PYTHONPATH con la carpeta del plugin (donde vive palmeras_algo/)
+        # La inferencia ocupa el 90% de la barra; el resto, el postprocesamiento en QGIS
+        def _on_event(ev):
+            feedback.setProgress(0.9 * stage_percent(ev))
+            feedback.setProgressText(stage_text(ev))
 
-        # --- Leer salida JSON ---
-        _stdout = "".join(_buf).strip().splitlines()
-        _last = _stdout[-1] if _stdout else "{}"
         try:
-            _j = json.loads(_last)
-            OUTPUT_RASTER, OUTPUT_RASTER_CLAS = _j["out"]
-            mau, eut, oeno = _j["counts"]
-        except Exception as _e:
-            raise RuntimeError("No se pudo interpretar la salida del proceso aislado: " + str(_e))
+            _params = dict(PRODUCTS, INPUT_RASTER=_in_raster, OUTPUT_RASTER=_out_raster, INPUT_ROI=_roi)
+            if PROCESSES > 1 or MAX_MEMORY_MB > 0:
+                _method = 'apply_palmeras_sharded'
+                if PROCESSES > 1:
+                    _params.update(n_bands=PROCESSES, max_workers=PROCESSES)
+                if MAX_MEMORY_MB > 0:
+                    _params.update(max_memory_mb=MAX_MEMORY_MB)
+            else:
+                _method = 'apply_palmeras'
+            _j = _env.worker(python_path=_plugin_dir).call(
+                _method, _params,
+                log=feedback.pushConsoleInfo, on_event=_on_event, is_cancelled=feedback.isCanceled)
+        except WorkerCancelled as _e:
+            feedback.reportError(str(_e))
+            return {}
+        except WorkerError as _e:
+            raise RuntimeError("Fallo ejecutando apply_palmeras en el entorno aislado:\n" + str(_e))
+        OUTPUT_RASTER, OUTPUT_RASTER_CLAS = _j["out"]
+        c1, c2, c3 = _j["counts"]
+        # Capas, tablas y reporte por especie se escriben en el venv
+        OUTPUT_VECTOR = _j["vector"]["polygons"]
+        OUTPUT_CENTROIDES = _j["vector"]["centroids"]
+        ATRIBUTOS_CSV = _j["attributes"]
+        TABLA_INSTANCIAS = _j.get("table")
+        DENSIDAD = _j.get("density")
+        ca1, ca2, ca3 = _j["area_ha"]
+        REPORTE_CSV = _j["report"]
         ##Fin Ejecutar
 
-        
-        if feedback.isCanceled():
-            return {}
-        c1, c2, c3, OUTPUT_VECTOR, OUTPUT_CENTROIDES,ATRIBUTOS_CSV = palmeras_qgis_count.apply_toolsqgis(OUTPUT_RASTER,OUTPUT_RASTER_CLAS,mau,eut,oeno)
-        if feedback.isCanceled():
-            return {}
-        
-        ca1, ca2, ca3,REPORTE_CSV = palmeras_qgis_clas.apply_toolsqgis(OUTPUT_RASTER,OUTPUT_RASTER_CLAS,mau,eut,oeno)
+        feedback.setProgress(95)
         if feedback.isCanceled():
             return {}
         
@@ -328,6 +371,15 @@ class DeteccionDePalmerasAlgorithm(QgsProcessingAlgorithm):
         feedback.pushInfo(f"TOTAL DETECTADO: {c1 + c2 + c3} palmeras")
         feedback.pushInfo("═" * 50)
 
+        from .palmeras_algo import perf
+        _perf_path = perf.report_path(OUTPUT_RASTER)
+        if os.path.exists(_perf_path):
+            _report = perf.read_report(_perf_path)
+            feedback.pushInfo("TIEMPOS POR ETAPA")
+            for _line in perf.summary_lines(_report):
+                feedback.pushInfo(_line)
+            feedback.pushInfo(f"Reporte: {_perf_path}")
+
         return {self.OUTPUT_RASTER: OUTPUT_RASTER,
                 self.NMAURITIA: c1,
                 self.AMAURITIA: ca1,
@@ -338,6 +390,8 @@ class DeteccionDePalmerasAlgorithm(QgsProcessingAlgorithm):
                 self.OUTPUT_VECTOR: OUTPUT_VECTOR, 
                 self.OUTPUT_CENTROIDES:OUTPUT_CENTROIDES,
                 self.ATRIBUTOS_CSV:ATRIBUTOS_CSV,
+                self.TABLA_INSTANCIAS:TABLA_INSTANCIAS,
+                self.DENSIDAD:DENSIDAD,
                 self.REPORTE_CSV:REPORTE_CSV}
         """return {self.OUTPUT: dest_id}"""
 
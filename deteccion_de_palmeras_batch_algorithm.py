@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ DeteccionDePalmeras
+                                 A QGIS plugin
+ Este plug-in permite detectar automáticamente 3 especies de palmeras en imágenes RGB adquiridas con RPAs:aguaje (Mauritia flexuosa), huasai (Euterpe precautoria) y ungurahui (Oenocarpus bataua).
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2021-10-06
+        copyright            : (C) 2021 by Susan Palacios, Rodolfo Cardenas, Ximena Tagle
+        email                : spalacios.salcedo@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'Susan Palacios, Rodolfo Cardenas, Ximena Tagle'
+__date__ = '2021-10-06'
+__copyright__ = '(C) 2021 by Susan Palacios, Rodolfo Cardenas, Ximena Tagle'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterMultipleLayers,
+                       QgsProcessingParameterFolderDestination,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingOutputFile)
+
+import os
+import inspect
+from qgis.PyQt.QtGui import QIcon #icon
+
+from ._product_parameters import add_product_parameters, product_options
+
+
+class DeteccionDePalmerasLoteAlgorithm(QgsProcessingAlgorithm):
+    """
+    Runs the palm detection over many rasters in a single isolated
+    process, so the interpreter, libraries and both ONNX models are
+    loaded once for the whole batch instead of once per raster.
+    """
+
+    INPUT_RASTERS = 'INPUT_RASTERS'
+    OUTPUT_FOLDER = 'OUTPUT_FOLDER'
+    MAX_WORKERS = 'MAX_WORKERS'
+    RESUMEN_CSV = 'RESUMEN_CSV'
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.INPUT_RASTERS,
+                self.tr('Input rasters'),
+                QgsProcessing.TypeRaster
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAX_WORKERS,
+                self.tr('Rasters processed in parallel'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=1,
+                minValue=1
+            )
+        )
+
+        add_product_parameters(self)
+
+        self.addParameter(
+            QgsProcessingParameterFolderDestination(
+                self.OUTPUT_FOLDER,
+                self.tr('Output folder')
+            )
+        )
+
+        self.addOutput(
+            QgsProcessingOutputFile(
+                self.RESUMEN_CSV,
+                self.tr('Resumen del lote')
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        from ._env_core import EnvCore, WorkerError, WorkerCancelled, stage_percent, stage_text
+        from .palmeras_algo import perf
+
+        INPUT_RASTERS = self.parameterAsLayerList(
+            parameters, self.INPUT_RASTERS, context)
+
+        MAX_WORKERS = self.parameterAsInt(
+            parameters, self.MAX_WORKERS, context)
+
+        PRODUCTS = product_options(self, parameters, context)
+
+        OUTPUT_FOLDER = self.parameterAsString(
+            parameters, self.OUTPUT_FOLDER, context)
+
+        _env = EnvCore(plugin_name="deteccion_de_palmeras_env")
+        if not _env.venv_exists():
+            raise RuntimeError("El entorno aislado no está preparado. Abre 'Dependencias' y créalo primero.")
+
+        # Una subcarpeta por ráster: evita colisiones de los archivos intermedios
+        # (<nombre>_argmax.tif, <nombre>_predicted.tif) entre rásteres homónimos
+        _jobs = []
+        _used = set()
+        for layer in INPUT_RASTERS:
+            stem = os.path.splitext(os.path.basename(layer.source()))[0]
+            name, i = stem, 1
+            while name in _used:
+                i += 1
+                name = f"{stem}_{i}"
+            _used.add(name)
+            folder = os.path.join(OUTPUT_FOLDER, name)
+            os.makedirs(folder, exist_ok=True)
+            _jobs.append({'input': layer.source(), 'output': os.path.join(folder, name + '.tif')})
+
+        if feedback.isCanceled() or not _jobs:
+            return {}
+
+        _plugin_dir = os.path.dirname(__file__)
+        feedback.pushInfo(f"Procesando {len(_jobs)} rásteres en el entorno aislado...")
+        # Progreso del lote = promedio del progreso de cada ráster (90% de la barra)
+        _job_percent = [0.0] * len(_jobs)
+
+        def _on_event(ev):
+            _job_percent[ev.get('job', 0)] = stage_percent(ev)
+            feedback.setProgress(0.9 * sum(_job_percent) / len(_jobs))
+            feedback.setProgressText(f"{os.path.basename(_jobs[ev.get('job', 0)]['input'])} - {stage_text(ev)}")
+
+        try:
+            _results = _env.worker(python_path=_plugin_dir).call(
+                'apply_palmeras_batch', dict(PRODUCTS, jobs=_jobs, max_workers=MAX_WORKERS),
+                log=feedback.pushConsoleInfo, on_event=_on_event, is_cancelled=feedback.isCanceled)
+        except WorkerCancelled as _e:
+            feedback.reportError(str(_e))
+            return {}
+        except WorkerError as _e:
+            raise RuntimeError("Fallo ejecutando el lote en el entorno aislado:\n" + str(_e))
+
+        RESUMEN_CSV = os.path.join(OUTPUT_FOLDER, 'resumen_lote.csv')
+        labelnames = ['RASTER', 'ESTADO', 'MAURITIA', 'EUTERPE', 'OENOCARPUS',
+                      'AREA MAURITIA(ha)', 'AREA EUTERPE(ha)', 'AREA OENOCARPUS(ha)']
+        with open(RESUMEN_CSV, 'w') as output_file:
+            output_file.write(','.join(labelnames) + '\n')
+            for current, res in enumerate(_results):
+                if feedback.isCanceled():
+                    break
+                feedback.setProgress(90.0 + 10.0 * current / len(_results))
+                name = os.path.basename(res['input'])
+                if res['error']:
+                    feedback.reportError(f"{name}: {res['error']}")
+                    output_file.write(','.join([name, 'ERROR'] + [''] * 6) + '\n')
+                    continue
+
+                out_raster, out_raster_clas = res['out']
+                c1, c2, c3 = res['counts']
+                ca1, ca2, ca3 = res['area_ha']
+
+                feedback.pushInfo(f"{name}: Mauritia {c1} ({ca1:.2f} ha), "
+                                  f"Euterpe {c2} ({ca2:.2f} ha), Oenocarpus {c3} ({ca3:.2f} ha)")
+                _perf_path = perf.report_path(out_raster)
+                if os.path.exists(_perf_path):
+                    _report = perf.read_report(_perf_path)
+                    feedback.pushInfo(f"{name}: {perf.summary_lines(_report)[0]}")
+                output_file.write(','.join(str(v) for v in [name, 'OK', c1, c2, c3, ca1, ca2, ca3]) + '\n')
+
+        return {self.OUTPUT_FOLDER: OUTPUT_FOLDER,
+                self.RESUMEN_CSV: RESUMEN_CSV}
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        """
+        return 'Detección de Palmeras (lote)'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr(self.name())
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to.
+        """
+        return ''
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def icon(self):#icon
+        cmd_folder = os.path.split(inspect.getfile(inspect.currentframe()))[0]#icon
+        icon = QIcon(os.path.join(os.path.join(cmd_folder, 'logo.png')))#icon
+        return icon#icon
+
+    def createInstance(self):
+        return DeteccionDePalmerasLoteAlgorithm()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ DeteccionDePalmeras
+                                 A QGIS plugin
+ Este plug-in permite detectar automáticamente 3 especies de palmeras en imágenes RGB adquiridas con RPAs:aguaje (Mauritia flexuosa), huasai (Euterpe precautoria) y ungurahui (Oenocarpus bataua).
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 2021-10-06
+        copyright            : (C) 2021 by Susan Palacios, Rodolfo Cardenas, Ximena Tagle
+        email                : spalacios.salcedo@gmail.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+__author__ = 'Susan Palacios, Rodolfo Cardenas, Ximena Tagle'
+__date__ = '2021-10-06'
+__copyright__ = '(C) 2021 by Susan Palacios, Rodolfo Cardenas, Ximena Tagle'
+
+# This will get replaced with a git SHA1 when you do a git archive
+
+__revision__ = '$Format:%H$'
+
+
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingException,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterFeatureSink,
+                       QgsFeature,
+                       QgsFeatureSink,
+                       QgsField,
+                       QgsFields,
+                       QgsVectorLayer)
+
+import os
+import inspect
+from qgis.PyQt.QtGui import QIcon #icon
+
+
+class DeteccionDePalmerasPoligonosAlgorithm(QgsProcessingAlgorithm):
+    """
+    Counts the palms of each species and their crown area inside every
+    polygon of a layer (plots, concessions, buffers), using the spatial
+    index written by a previous detection run: no imagery is processed.
+    """
+
+    INPUT_RASTER = 'INPUT_RASTER'
+    INPUT_POLYGONS = 'INPUT_POLYGONS'
+    OUTPUT = 'OUTPUT'
+    # Campos agregados (máximo 10 caracteres por el shapefile), en el orden
+    # de las especies del índice: Mauritia, Euterpe, Oenocarpus
+    COUNT_FIELDS = ['N_MAURITIA', 'N_EUTERPE', 'N_OENOCARP']
+    AREA_FIELDS = ['A_MAURITIA', 'A_EUTERPE', 'A_OENOCARP']
+    TOTAL_FIELD = 'N_TOTAL'
+    # palmeras_algo.spatial_index.INDEX_SUFFIX (ese módulo necesita el venv)
+    INDEX_SUFFIX = '_indice.npz'
+
+    def initAlgorithm(self, config):
+        """
+        Here we define the inputs and output of the algorithm, along
+        with some other properties.
+        """
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.INPUT_RASTER,
+                self.tr('Detection raster (run with spatial index)')
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT_POLYGONS,
+                self.tr('Polygons'),
+                [QgsProcessing.TypeVectorPolygon]
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Palm counts per polygon'),
+                QgsProcessing.TypeVectorPolygon
+            )
+        )
+
+    def processAlgorithm(self, parameters, context, feedback):
+        """
+        Here is where the processing itself takes place.
+        """
+        from qgis import processing
+        from qgis.core import QgsProcessingUtils
+        from ._env_core import EnvCore, WorkerError, WorkerCancelled
+
+        INPUT_RASTER = self.parameterAsRasterLayer(
+            parameters, self.INPUT_RASTER, context)
+
+        INPUT_POLYGONS = self.parameterAsSource(
+            parameters, self.INPUT_POLYGONS, context)
+
+        _raster = INPUT_RASTER.source()
+        _index = os.path.splitext(_raster)[0] + self.INDEX_SUFFIX
+        if not os.path.exists(_index):
+            raise QgsProcessingException(
+                f"No existe {_index}. Corre la detección con "
+                "'Write spatial index for polygon counts' activado.")
+
+        _env = EnvCore(plugin_name="deteccion_de_palmeras_env")
+        if not _env.venv_exists():
+            raise RuntimeError("El entorno aislado no está preparado. Abre 'Dependencias' y créalo primero.")
+
+        # Polígonos en el SRC del ráster, que es el del índice
+        _polygons = QgsProcessingUtils.generateTempFilename('polygons.gpkg')
+        processing.run("native:reprojectlayer",
+            {'INPUT': parameters[self.INPUT_POLYGONS],
+            'TARGET_CRS': INPUT_RASTER.crs(),
+            'OUTPUT': _polygons},
+            context=context, feedback=feedback, is_child_algorithm=True)
+        if feedback.isCanceled():
+            return {}
+
+        try:
+            _results = _env.worker(python_path=os.path.dirname(__file__)).call(
+                'query_index', {'OUTPUT_RASTER': _raster, 'polygons': _polygons},
+                log=feedback.pushConsoleInfo, is_cancelled=feedback.isCanceled)
+        except WorkerCancelled as _e:
+            feedback.reportError(str(_e))
+            return {}
+        except WorkerError as _e:
+            raise RuntimeError("Fallo consultando el índice en el entorno aislado:\n" + str(_e))
+        _by_fid = {r['fid']: r for r in _results}
+
+        fields = QgsFields(INPUT_POLYGONS.fields())
+        for name in self.COUNT_FIELDS:
+            fields.append(QgsField(name, QVariant.Int))
+        fields.append(QgsField(self.TOTAL_FIELD, QVariant.Int))
+        for name in self.AREA_FIELDS:
+            fields.append(QgsField(name, QVariant.Double, 'double', 20, 2))
+        (sink, dest_id) = self.parameterAsSink(
+            parameters, self.OUTPUT, context, fields,
+            INPUT_POLYGONS.wkbType(), INPUT_RASTER.crs())
+
+        # Los fid de la capa reproyectada son los que leyó el venv
+        _layer = QgsVectorLayer(_polygons, 'polygons', 'ogr')
+        _names = INPUT_POLYGONS.fields().names()
+        total = max(_layer.featureCount(), 1)
+        for current, f in enumerate(_layer.getFeatures()):
+            if feedback.isCanceled():
+                break
+            res = _by_fid.get(f.id(), {'counts': [0, 0, 0], 'area_m2': [0.0, 0.0, 0.0]})
+            feature = QgsFeature(fields)
+            feature.setGeometry(f.geometry())
+            feature.setAttributes([f[name] for name in _names] + res['counts'] + [sum(res['counts'])]
+                                  + res['area_m2'])
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
+            feedback.setProgress(100.0 * (current + 1) / total)
+        del _layer
+
+        return {self.OUTPUT: dest_id}
+
+    def name(self):
+        """
+        Returns the algorithm name, used for identifying the algorithm. This
+        string should be fixed for the algorithm, and must not be localised.
+        """
+        return 'Conteo de Palmeras por Polígono'
+
+    def displayName(self):
+        """
+        Returns the translated algorithm name, which should be used for any
+        user-visible display of the algorithm name.
+        """
+        return self.tr(self.name())
+
+    def group(self):
+        """
+        Returns the name of the group this algorithm belongs to. This string
+        should be localised.
+        """
+        return self.tr(self.groupId())
+
+    def groupId(self):
+        """
+        Returns the unique ID of the group this algorithm belongs to.
+        """
+        return ''
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def icon(self):#icon
+        cmd_folder = os.path.split(inspect.getfile(inspect.currentframe()))[0]#icon
+        icon = QIcon(os.path.join(os.path.join(cmd_folder, 'logo.png')))#icon
+        return icon#icon
+
+    def createInstance(self):
+        return DeteccionDePalmerasPoligonosAlgorithm()
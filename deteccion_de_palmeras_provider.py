@@ -37,6 +37,8 @@ from qgis.PyQt.QtGui import QIcon #icon
 
 from qgis.core import QgsProcessingProvider
 from .deteccion_de_palmeras_algorithm import DeteccionDePalmerasAlgorithm
+from .deteccion_de_palmeras_batch_algorithm import DeteccionDePalmerasLoteAlgorithm
+from .deteccion_de_palmeras_poligonos_algorithm import DeteccionDePalmerasPoligonosAlgorithm
 
 
 class DeteccionDePalmerasProvider(QgsProcessingProvider):
@@ -60,6 +62,8 @@ class DeteccionDePalmerasProvider(QgsProcessingProvider):
         Dependencies will be checked when the algorithm is actually run.
         """
         self.addAlgorithm(DeteccionDePalmerasAlgorithm())
+        self.addAlgorithm(DeteccionDePalmerasLoteAlgorithm())
+        self.addAlgorithm(DeteccionDePalmerasPoligonosAlgorithm())
         # add additional algorithms here
         # self.addAlgorithm(MyOtherAlgorithm())
 
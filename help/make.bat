@@ -81,8 +81,11 @@ REM --- 1) Archivos esenciales en la raiz del plugin ---
 for %%F in (
   "__init__.py"
   "_env_core.py"
+  "_seq_runner.py"
   "deteccion_de_palmeras.py"
   "deteccion_de_palmeras_algorithm.py"
+  "deteccion_de_palmeras_batch_algorithm.py"
+  "deteccion_de_palmeras_poligonos_algorithm.py"
   "deteccion_de_palmeras_provider.py"
   "palmeras_dependency.py"
   "resources_rc.py"
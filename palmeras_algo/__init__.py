@@ -0,0 +1,9 @@
+import os as _os
+
+# En Windows el GDAL de QGIS necesita sus carpetas de DLL. El proceso del venv
+# las agrega con os.add_dll_directory, pero los procesos hijos (modo
+# particionado) no lo heredan: se las pasa EnvCore en PALMERAS_DLL_DIRS.
+if hasattr(_os, 'add_dll_directory'):
+    for _d in _os.environ.get('PALMERAS_DLL_DIRS', '').split(_os.pathsep):
+        if _d and _os.path.isdir(_d):
+            _os.add_dll_directory(_d)
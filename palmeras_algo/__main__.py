@@ -0,0 +1,231 @@
+##### Línea de comandos: detección sin QGIS (servidores, scripts) ####
+#
+#   python -m palmeras_algo detect <ortomosaico.tif> <salida.tif> [--roi AOI] [--stats stats.json]
+#   python -m palmeras_algo batch <a.tif> <b.tif> ... --output-dir <dir> [--workers N]
+#   python -m palmeras_algo tiles plan|run-tile|merge|run-local|status ...
+#
+# Sólo necesita el venv del plugin (numpy, scikit-image, onnxruntime, GDAL);
+# no importa ningún módulo de qgis.
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from . import batch
+from . import distributed
+from . import gdal_io
+from . import instances
+from . import palmeras_deteccion
+from . import perf
+from . import products
+from . import spatial_index
+from . import tables
+from . import tiling
+from . import vectorize
+from .log import configure_logging
+
+OUTPUT_FORMATS = ('GTiff', 'COG')
+SPECIES = ('Mauritia flexuosa', 'Euterpe precatoria', 'Oenocarpus bataua')
+
+logger = logging.getLogger(__name__)
+
+
+def to_cog(path):
+    """Reescribe un GeoTIFF como Cloud Optimized GeoTIFF en el mismo lugar."""
+    from osgeo import gdal
+    gdal_io.release_dataset(path)
+    tmp = os.path.splitext(path)[0] + '.cog.tmp.tif'
+    gdal.Translate(tmp, path, format='COG', creationOptions=['COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'])
+    os.replace(tmp, path)
+
+
+def build_stats(input_raster, outputs, counts, elapsed, written):
+    """'written' es el resultado de products.write_products."""
+    mau, eut, oeno = counts
+    return {
+        'input': input_raster,
+        'outputs': list(outputs),
+        'report': written['report'],
+        'vectors': written.get('vector'),
+        'attributes': written.get('attributes'),
+        'table': written.get('table'),
+        'density': written.get('density'),
+        'index': written.get('index'),
+        'counts': {SPECIES[0]: mau, SPECIES[1]: eut, SPECIES[2]: oeno},
+        'area_ha': {name: round(area, 4) for name, area in zip(SPECIES, written['area_ha'])},
+        'elapsed_s': round(elapsed, 1),
+        'perf_report': perf.report_path(outputs[0]),
+    }
+
+
+def write_stats(stats, path):
+    text = json.dumps(stats, indent=1, ensure_ascii=False)
+    if path == '-':
+        sys.stdout.write(text + '\n')
+        sys.stdout.flush()
+    else:
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write(text + '\n')
+
+
+def _products_options(args):
+    return {'vector_format': args.vector, 'polygons': not args.no_polygons, 'table_format': args.table,
+            'metrics': args.metrics, 'density_cell': args.density_cell, 'index': args.index}
+
+
+def _pipeline_options(args):
+    return {
+        'window_radius': args.window_radius,
+        'window_radius_instances': args.instance_window_radius,
+        'gdal_threads': args.gdal_threads,
+        'batch_size': args.batch_size,
+        'cache_dir': args.cache_dir,
+        'cache_max_mb': args.cache_max_mb,
+        'max_memory_mb': args.max_memory_mb,
+    }
+
+
+def _finish(input_raster, outputs, counts, args, t0, written):
+    if args.format == 'COG':
+        for path in outputs:
+            to_cog(path)
+    logger.info("%s: %s %d, %s %d, %s %d", input_raster, SPECIES[0], counts[0], SPECIES[1], counts[1],
+                SPECIES[2], counts[2])
+    return build_stats(input_raster, outputs, counts, time.perf_counter() - t0, written)
+
+
+def detect(args):
+    t0 = time.perf_counter()
+    options = _pipeline_options(args)
+    if args.processes > 1 or args.max_memory_mb:
+        # Con --max-memory-mb y sin --processes el presupuesto decide bandas y procesos
+        processes = args.processes if args.processes > 1 else None
+        result = tiling.apply_palmeras_sharded(args.input, args.output, INPUT_ROI=args.roi,
+                                               n_bands=processes, max_workers=processes,
+                                               resume=not args.no_resume, threads=args.threads, **options)
+    else:
+        result = palmeras_deteccion.apply_palmeras(args.input, args.output, INPUT_ROI=args.roi,
+                                                   resume=not args.no_resume, threads=args.threads,
+                                                   **options)
+    written = products.write_products(result[0], result[1], result[2:], flight=products.flight_id(args.input),
+                                      **_products_options(args))
+    return _finish(args.input, result[:2], result[2:], args, t0, written)
+
+
+def run_batch(args):
+    t0 = time.perf_counter()
+    os.makedirs(args.output_dir, exist_ok=True)
+    jobs = [{'input': path, 'roi': args.roi,
+             'output': os.path.join(args.output_dir,
+                                    os.path.splitext(os.path.basename(path))[0] + '_palmeras.tif')}
+            for path in args.inputs]
+    results = batch.apply_palmeras_batch(jobs, max_workers=args.workers, threads=args.threads,
+                                         products_options=_products_options(args),
+                                         **_pipeline_options(args))
+    stats = []
+    for result in results:
+        if result['error']:
+            stats.append({'input': result['input'], 'error': result['error']})
+            continue
+        stats.append(_finish(result['input'], result['out'], result['counts'], args, t0, result))
+    return {'jobs': stats, 'elapsed_s': round(time.perf_counter() - t0, 1)}
+
+
+def query(args):
+    """Conteos y áreas por especie en cada polígono, desde el índice de una corrida."""
+    t0 = time.perf_counter()
+    results = spatial_index.query_layer(args.raster, args.polygons)
+    return {'raster': args.raster, 'polygons': args.polygons,
+            'features': [{'fid': r['fid'],
+                          'counts': dict(zip(SPECIES, r['counts'])),
+                          'area_m2': {name: round(area, 2) for name, area in zip(SPECIES, r['area_m2'])}}
+                         for r in results],
+            'elapsed_s': round(time.perf_counter() - t0, 3)}
+
+
+def _add_common(p):
+    p.add_argument('--roi', help='AOI (shapefile/GeoPackage) que limita la detección')
+    p.add_argument('--window-radius', type=int, default=256,
+                   help='radio de ventana de la segmentación semántica (px)')
+    p.add_argument('--instance-window-radius', type=int, default=350,
+                   help='radio de ventana de la segmentación de instancias (px)')
+    p.add_argument('--threads', type=int, default=0,
+                   help='hilos de ONNX Runtime por proceso o trabajo en paralelo (0 = los núcleos repartidos)')
+    p.add_argument('--gdal-threads', help='GDAL_NUM_THREADS (por defecto ALL_CPUS)')
+    p.add_argument('--batch-size', type=int,
+                   help='ventanas por llamada al modelo semántico (por defecto una columna)')
+    p.add_argument('--format', choices=OUTPUT_FORMATS, default='GTiff', help='formato de los rásteres de salida')
+    p.add_argument('--vector', choices=sorted(vectorize.FORMATS),
+                   help='escribe también las capas de copas y centroides (GPKG: un solo paquete)')
+    p.add_argument('--no-polygons', action='store_true', help='con --vector, solo los centroides')
+    p.add_argument('--metrics', nargs='+', choices=list(instances.METRICS), default=(),
+                   help='métricas de forma por copa en las capas y tablas')
+    p.add_argument('--density-cell', type=float, metavar='METROS',
+                   help='escribe la grilla de palmeras/ha por especie con celdas de este tamaño (p. ej. 50 o 100)')
+    p.add_argument('--index', action='store_true',
+                   help='escribe el índice espacial para consultas por polígono (comando query)')
+    p.add_argument('--table', choices=tables.TABLE_FORMATS,
+                   help='exporta la tabla de palmeras (_instancias; parquet requiere pyarrow, si no, CSV)')
+    p.add_argument('--stats', help="escribe conteos, áreas y tiempos en JSON ('-' = stdout)")
+    p.add_argument('--cache-dir', help='directorio de la caché de teselas')
+    p.add_argument('--cache-max-mb', type=int, help='tamaño máximo de la caché; la activa (por defecto 0 = desactivada)')
+    p.add_argument('--max-memory-mb', type=int,
+                   help='memoria máxima (MB): ajusta lotes, bandas y procesos para no superarla')
+
+
+def check_args(parser, args):
+    """Rechaza opciones que no tendrían efecto con las demás."""
+    if args.command not in ('detect', 'batch'):
+        return
+    if args.no_polygons and not args.vector:
+        parser.error("--no-polygons solo tiene efecto con --vector")
+    if args.metrics and not (args.vector or args.table):
+        parser.error("--metrics solo tiene efecto con --vector o --table")
+    if args.threads < 0:
+        parser.error("--threads debe ser 0 (automático) o positivo")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m palmeras_algo',
+                                     description='Detección de palmeras sin QGIS')
+    parser.add_argument('--log-level', help='DEBUG, INFO, WARNING... (por defecto PALMERAS_LOG_LEVEL o INFO)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('detect', help='detecta palmeras en un ortomosaico')
+    p.add_argument('input')
+    p.add_argument('output')
+    _add_common(p)
+    p.add_argument('--processes', type=int, default=1, help='bandas en paralelo (modo particionado)')
+    p.add_argument('--no-resume', action='store_true', help='ignora el diario de una corrida anterior')
+    p = sub.add_parser('batch', help='detecta palmeras en varios ortomosaicos')
+    p.add_argument('inputs', nargs='+')
+    p.add_argument('--output-dir', required=True)
+    p.add_argument('--workers', type=int, default=1, help='ortomosaicos en paralelo')
+    _add_common(p)
+    p = sub.add_parser('query', help='cuenta palmeras por polígono con el índice de una corrida (--index)')
+    p.add_argument('raster', help='ráster de salida de la corrida')
+    p.add_argument('polygons', help='capa de polígonos en el mismo SRC que el ráster')
+    p.add_argument('--stats', default='-', help="JSON con los resultados ('-' = stdout)")
+    sub.add_parser('tiles', help='varias máquinas (ver python -m palmeras_algo.distributed -h)',
+                   add_help=False)
+    args, rest = parser.parse_known_args(argv)
+
+    if args.command == 'tiles':
+        return distributed.main((['--log-level', args.log_level] if args.log_level else []) + rest)
+    if rest:
+        parser.error(f"argumentos no reconocidos: {' '.join(rest)}")
+    # Los logs van a stderr: stdout queda para el JSON de --stats -
+    configure_logging(args.log_level)
+    check_args(parser, args)
+    commands = {'detect': detect, 'batch': run_batch, 'query': query}
+    stats = commands[args.command](args)
+    if args.stats:
+        write_stats(stats, args.stats)
+    failed = args.command == 'batch' and any('error' in job for job in stats['jobs'])
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
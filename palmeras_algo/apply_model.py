@@ -1,9 +1,24 @@
+import logging
+import math
 import numpy as np
 import os
 from osgeo import gdal
 import onnxruntime as rt
 from skimage import morphology
 
+from . import gdal_io
+from . import roi as roi_mod
+from . import checkpoint
+from . import perf
+from . import progress as progress_mod
+from .log import ProgressLog, debug_enabled
+
+logger = logging.getLogger(__name__)
+
+# Píxeles como máximo para calcular los percentiles de normalización: los
+# recortes más grandes se leen submuestreados (GDAL usa las overviews si hay)
+STATS_MAX_PIXELS = 8 * 1024 * 1024
+
 ### Helper Functions ###
 
 def rint(num):
@@ -21,31 +36,63 @@ def scale_image_mean_std(image, nodata_value=0):
                 image[nodata_mask, b] = image[nodata_mask, b] - mean
     return image
 
-def normalize_image_improved(image, nodata_value=0):
+def band_stats(image, nodata_value=0):
+    """
+    Percentiles 1 y 99 y máximo de cada banda ([[p1, p99, max], ...]) sobre
+    los píxeles válidos (no todas las bandas en nodata_value), o None si no
+    hay ninguno. Son los parámetros de normalize_image_improved.
+    """
+    nodata_mask = np.logical_not(np.all(image == nodata_value, axis=2))
+    if not np.any(nodata_mask):
+        return None
+    stats = []
+    for b in range(image.shape[2]):
+        valid_pixels = image[nodata_mask, b].astype(np.float32)
+        p1, p99 = np.percentile(valid_pixels, [1, 99])
+        stats.append([float(p1), float(p99), float(np.max(valid_pixels))])
+    return stats
+
+def normalization_stats(img_path, window=None, max_pixels=STATS_MAX_PIXELS):
+    """
+    band_stats del ráster (o del recorte 'window') con el mismo
+    preprocesamiento que load_and_preprocess_tiff_improved. Hasta max_pixels
+    se usan todos los píxeles, así coincide con normalizar el recorte
+    completo; más grande se lee submuestreado. El modo particionado y el
+    distribuido los calculan una vez y los pasan a cada banda o tesela.
+    """
+    dataset = gdal_io.open_dataset(img_path)
+    width, height = (window[2], window[3]) if window else (dataset.RasterXSize, dataset.RasterYSize)
+    factor = max(1, math.ceil(math.sqrt(width * height / max_pixels)))
+    buf_size = (-(-width // factor), -(-height // factor)) if factor > 1 else None
+    img = load_and_preprocess_tiff_improved(img_path, window=window, buf_size=buf_size)[0]
+    return band_stats(img)
+
+def normalize_image_improved(image, nodata_value=0, stats=None):
     """
-    Normalización mejorada basada en percentiles
+    Normalización mejorada basada en percentiles. 'stats' (ver band_stats)
+    permite usar los de todo el ráster en vez de los de 'image'.
     """
     nodata_mask = np.logical_not(np.all(image == nodata_value, axis=2))
     image_float = image.astype(np.float32)
+    if stats is None:
+        stats = band_stats(image_float, nodata_value)
+    if stats is None or not np.any(nodata_mask):
+        return image_float
     
-    for b in range(image_float.shape[2]):
-        if np.any(nodata_mask):
-            valid_pixels = image_float[nodata_mask, b]
-            if len(valid_pixels) > 0:
-                # Usar percentiles para evitar outliers
-                p1, p99 = np.percentile(valid_pixels, [1, 99])
-                if p99 > p1:
-                    # Escalar a [0, 1] usando percentiles
-                    image_float[nodata_mask, b] = np.clip((valid_pixels - p1) / (p99 - p1), 0, 1)
-                    # Aplicar ajuste gamma para mejor contraste
-                    image_float[nodata_mask, b] = np.power(image_float[nodata_mask, b], 0.8)
-                    # Escalar a [-1, 1] para el modelo
-                    image_float[nodata_mask, b] = image_float[nodata_mask, b] * 2 - 1
-                else:
-                    # Fallback a normalización simple
-                    max_val = np.max(valid_pixels)
-                    if max_val != 0:
-                        image_float[nodata_mask, b] = valid_pixels / max_val * 2 - 1
+    for b, (p1, p99, max_val) in enumerate(stats[:image_float.shape[2]]):
+        valid_pixels = image_float[nodata_mask, b]
+        # Usar percentiles para evitar outliers
+        if p99 > p1:
+            # Escalar a [0, 1] usando percentiles
+            image_float[nodata_mask, b] = np.clip((valid_pixels - p1) / (p99 - p1), 0, 1)
+            # Aplicar ajuste gamma para mejor contraste
+            image_float[nodata_mask, b] = np.power(image_float[nodata_mask, b], 0.8)
+            # Escalar a [-1, 1] para el modelo
+            image_float[nodata_mask, b] = image_float[nodata_mask, b] * 2 - 1
+        else:
+            # Fallback a normalización simple
+            if max_val != 0:
+                image_float[nodata_mask, b] = valid_pixels / max_val * 2 - 1
     return image_float
 
 def save_window_tiff(window, output_path):
@@ -60,28 +107,32 @@ def save_window_tiff(window, output_path):
     out_dataset.FlushCache()
     out_dataset = None
 
-def load_and_preprocess_tiff_improved(img_path, bands=3):
+def load_and_preprocess_tiff_improved(img_path, bands=3, window=None, buf_size=None):
     """
-    Carga y preprocesamiento mejorado de imágenes TIFF
+    Carga y preprocesamiento mejorado de imágenes TIFF.
+    'window' = (xoff, yoff, xsize, ysize) limita la lectura a ese recorte y
+    'buf_size' = (ancho, alto) lo lee submuestreado a ese tamaño.
     """
-    dataset = gdal.Open(img_path)
+    dataset = gdal_io.open_dataset(img_path)
     if dataset is None:
         raise ValueError(f"No se pudo abrir la imagen TIFF: {img_path}")
     
     # Detectar tipo de datos
     data_type = dataset.GetRasterBand(1).DataType
     data_type_name = gdal.GetDataTypeName(data_type)
-    print(f"Tipo de datos de la imagen: {data_type} ({data_type_name})")
+    logger.debug("Tipo de datos de la imagen: %s (%s)", data_type, data_type_name)
     
-    height, width = dataset.RasterYSize, dataset.RasterXSize
-    img = np.zeros((height, width, bands), dtype=np.float32)
+    xoff, yoff, width, height = window or (0, 0, dataset.RasterXSize, dataset.RasterYSize)
+    buf_width, buf_height = buf_size or (width, height)
+    img = np.zeros((buf_height, buf_width, bands), dtype=np.float32)
     
     for i in range(min(bands, dataset.RasterCount)):
         band = dataset.GetRasterBand(i + 1)
-        img_data = band.ReadAsArray()
+        img_data = band.ReadAsArray(xoff, yoff, width, height, buf_xsize=buf_width, buf_ysize=buf_height)
         img[..., i] = img_data
     
-    print(f"Valores de la imagen (min, max, mean): {img.min():.2f}, {img.max():.2f}, {img.mean():.2f}")
+    if debug_enabled():
+        logger.debug("Valores de la imagen (min, max, mean): %.2f, %.2f, %.2f", img.min(), img.max(), img.mean())
     
     # Manejo de valores no válidos
     nodata_count = 0
@@ -91,8 +142,7 @@ def load_and_preprocess_tiff_improved(img_path, bands=3):
         # Reemplazar nodata con 0
         for i in range(bands):
             img[img[..., i] == nodata_val, i] = 0
-        print(f"Valor nodata original: {nodata_val}")
-        print(f"Pixeles con valor nodata: {nodata_count}")
+        logger.debug("Valor nodata original: %s, píxeles con nodata: %d", nodata_val, nodata_count)
     
     img[np.isnan(img)] = 0
     img[np.isinf(img)] = 0
@@ -104,6 +154,7 @@ def save_tiff_mask(mask, output_path, reference_dataset):
     MODIFICACIÓN: Guarda la máscara asegurando bordes consistentes en QGIS
     """
     driver = gdal.GetDriverByName('GTiff')
+    gdal_io.release_dataset(output_path)
     
     # Obtener toda la información geográfica del dataset de referencia
     geotransform = reference_dataset.GetGeoTransform()
@@ -127,8 +178,8 @@ def save_tiff_mask(mask, output_path, reference_dataset):
     out_dataset.FlushCache()
     out_dataset = None
     
-    print(f"✓ Máscara guardada: {mask.shape[1]}x{mask.shape[0]} pixels")
-    print(f"✓ Geotransform aplicado: {geotransform}")
+    logger.info("Máscara guardada: %dx%d píxeles", mask.shape[1], mask.shape[0])
+    logger.debug("Geotransform aplicado: %s", geotransform)
 
 def postprocess_segmentation_mask(mask, min_region_size=20):
     """
@@ -151,103 +202,201 @@ def postprocess_segmentation_mask(mask, min_region_size=20):
                     
         return cleaned_mask
     except ImportError:
-        print("ADVERTENCIA: skimage no disponible, saltando postprocesamiento")
+        logger.warning("skimage no disponible, saltando postprocesamiento")
         return mask
 
-# Semantic segmentation with ONNX
-def apply_semantic_segmentation_onnx(input_file_list, output_folder, model_path, window_radius, internal_window_radius, make_tif=True, scaling='normalize'):
-    os.makedirs(output_folder, exist_ok=True)
-    
+def create_session(model_path, intra_op_num_threads=0):
+    """
+    Crea la sesión ONNX del modelo de segmentación semántica.
+    intra_op_num_threads=0 deja que ONNX Runtime use todos los núcleos.
+    """
     # Configurar ONNX Runtime con optimizaciones
     providers = ['CPUExecutionProvider']
     session_options = rt.SessionOptions()
     session_options.graph_optimization_level = rt.GraphOptimizationLevel.ORT_ENABLE_ALL
     session_options.execution_mode = rt.ExecutionMode.ORT_SEQUENTIAL
+    session_options.intra_op_num_threads = intra_op_num_threads
     
-    session = rt.InferenceSession(model_path, providers=providers, sess_options=session_options)
+    return rt.InferenceSession(model_path, providers=providers, sess_options=session_options)
+
+# Semantic segmentation with ONNX
+def apply_semantic_segmentation_onnx(input_file_list, output_folder, model_path, window_radius, internal_window_radius, make_tif=True, scaling='normalize', roi=None, session=None, resume=False, cache=None, progress=None, batch_size=None, memory_guard=None, norm_stats=None):
+    os.makedirs(output_folder, exist_ok=True)
+    
+    # Reutilizar la sesión si ya viene creada (modo lote)
+    if session is None:
+        session = create_session(model_path)
     input_name = session.get_inputs()[0].name
     output_name = session.get_outputs()[0].name
 
     # Verificación del modelo
-    print("=== VERIFICACIÓN MODELO ONNX ===")
-    print(f"Input name: {input_name}")
-    print(f"Input shape: {session.get_inputs()[0].shape}")
-    print(f"Output name: {output_name}")
-    print(f"Output shape: {session.get_outputs()[0].shape}")
+    logger.debug("Modelo ONNX: entrada %s %s, salida %s %s", input_name, session.get_inputs()[0].shape,
+                 output_name, session.get_outputs()[0].shape)
 
     name_saved = None
     for img_path in input_file_list:
-        # Cargar con preprocesamiento mejorado
-        img, dataset, original_nodata = load_and_preprocess_tiff_improved(img_path)
-        height, width = img.shape[:2]
-        print(f"Tamaño de la imagen TIFF: {height}x{width}")
-
-        # Aplicar preprocesamiento según el tipo de escalado
-        if scaling == 'mean_std':
-            img = scale_image_mean_std(img)
-        elif scaling == 'normalize':
-            img = normalize_image_improved(img)
-
-        output_mask = np.zeros((height, width), dtype=np.uint8)
-
-        collist = list(range(window_radius, width - window_radius + 1, internal_window_radius * 2))
-        if collist and collist[-1] < width - window_radius:
-            collist.append(width - window_radius)
-        rowlist = list(range(window_radius, height - window_radius + 1, internal_window_radius * 2))
-        if rowlist and rowlist[-1] < height - window_radius:
-            rowlist.append(height - window_radius)
-        print(f"Número de ventanas: {len(rowlist)} filas x {len(collist)} columnas")
-
-        window_count = 0
-        for col in collist:
-            windows = []
-            rows_for_col = []
-            for row in rowlist:
-                window = img[row - window_radius:row + window_radius, col - window_radius:col + window_radius].copy()
-                if window.shape[0] == window_radius * 2 and window.shape[1] == window_radius * 2:
-                    windows.append(window)
-                    rows_for_col.append(row)
-                    window_count += 1
+        base_name = os.path.basename(img_path).split('.')[0]
+        name_saved = f"{base_name}_argmax.tif"
+        tif_output_path = os.path.join(output_folder, name_saved)
+
+        # Con AOI solo se lee su bounding box (más el margen de la ventana)
+        read_window = roi_mod.roi_window(roi, window_radius) if roi else None
+        xoff, yoff = read_window[:2] if read_window else (0, 0)
+
+        # Diario de ventanas terminadas para poder reanudar una corrida interrumpida
+        journal = None
+        if resume:
+            ref = gdal_io.open_dataset(img_path)
+            shape = (read_window[3], read_window[2]) if read_window else (ref.RasterYSize, ref.RasterXSize)
+            signature = checkpoint.job_signature('semantic', [img_path], model_path, roi=roi,
+                                                 window_radius=window_radius,
+                                                 internal_window_radius=internal_window_radius,
+                                                 scaling=scaling, norm_stats=norm_stats)
+            journal = checkpoint.TileCheckpoint(os.path.join(output_folder, base_name + '_argmax'), signature,
+                                                shape, gdal.GDT_Byte, 0, output_path=tif_output_path)
+            if journal.completed is not None:
+                logger.info("Segmentación ya completada en una corrida anterior: %s", tif_output_path)
+                journal.close()
+                continue
+
+        try:
+            # Cargar con preprocesamiento mejorado
+            with perf.stage('read'):
+                img, dataset, original_nodata = load_and_preprocess_tiff_improved(img_path, window=read_window)
+            height, width = img.shape[:2]
+            perf.count('read', pixels=height * width)
+            logger.info("Tamaño de la imagen TIFF: %dx%d", height, width)
+
+            # Aplicar preprocesamiento según el tipo de escalado
+            with perf.stage('normalize', pixels=height * width):
+                if scaling == 'mean_std':
+                    img = scale_image_mean_std(img)
+                elif scaling == 'normalize':
+                    # Percentiles dados (modo particionado) o los del recorte, con el
+                    # mismo submuestreo que normalization_stats si es muy grande
+                    stats = norm_stats
+                    if stats is None and height * width > STATS_MAX_PIXELS:
+                        stats = normalization_stats(img_path, window=read_window)
+                    img = normalize_image_improved(img, stats=stats)
+
+            output_mask = np.zeros((height, width), dtype=np.uint8)
+            if journal:
+                journal.restore(output_mask)
+
+            collist = list(range(window_radius, width - window_radius + 1, internal_window_radius * 2))
+            if collist and collist[-1] < width - window_radius:
+                collist.append(width - window_radius)
+            rowlist = list(range(window_radius, height - window_radius + 1, internal_window_radius * 2))
+            if rowlist and rowlist[-1] < height - window_radius:
+                rowlist.append(height - window_radius)
+            logger.info("Número de ventanas: %d filas x %d columnas", len(rowlist), len(collist))
+
+            # Total de ventanas dentro del AOI (las ya anotadas en el diario cuentan como hechas)
+            total = sum(1 for col in collist for row in rowlist
+                        if roi_mod.window_intersects(roi, row + yoff, col + xoff, internal_window_radius))
+            done = len(journal.done) if journal else 0
+            if progress:
+                progress('semantic', done, total)
+            summary = ProgressLog('Segmentación', total, done)
+            check_range = debug_enabled()
+
+            window_count = 0
+            for col in collist:
+                windows = []
+                rows_for_col = []
+                for row in rowlist:
+                    if not roi_mod.window_intersects(roi, row + yoff, col + xoff, internal_window_radius):
+                        continue
+                    if journal and journal.is_done((row, col)):
+                        continue
+                    window = img[row - window_radius:row + window_radius, col - window_radius:col + window_radius].copy()
+                    if window.shape[0] == window_radius * 2 and window.shape[1] == window_radius * 2:
+                        windows.append(window)
+                        rows_for_col.append(row)
+                        window_count += 1
             
-            if windows:
-                windows = np.stack(windows).astype(np.float32)
-                print(f"Procesando {len(windows)} ventanas en columna {col}")
+                if windows:
+                    windows = np.stack(windows).astype(np.float32)
+                    logger.debug("Procesando %d ventanas en columna %d", len(windows), col)
                 
-                # Verificar rango de datos antes de predicción
-                if np.abs(windows.min() - (-1.0)) > 0.1 or np.abs(windows.max() - 1.0) > 0.1:
-                    print(f"ADVERTENCIA: Rango de ventana inusual - Min: {windows.min():.3f}, Max: {windows.max():.3f}")
+                    # Verificar rango de datos antes de predicción (recorre todas las ventanas: solo en DEBUG)
+                    if check_range:
+                        w_min, w_max = windows.min(), windows.max()
+                        if np.abs(w_min - (-1.0)) > 0.1 or np.abs(w_max - 1.0) > 0.1:
+                            logger.debug("Rango de ventana inusual - Min: %.3f, Max: %.3f", w_min, w_max)
                 
-                pred = session.run([output_name], {input_name: windows})[0]
-                for i, row in enumerate(rows_for_col):
-                    pred_mask = np.argmax(pred[i], axis=-1).astype(np.uint8)
-                    if internal_window_radius < window_radius:
-                        mm = rint(window_radius - internal_window_radius)
-                        pred_mask = pred_mask[mm:-mm, mm:-mm]
-                    output_mask[row - internal_window_radius:row + internal_window_radius,
-                                col - internal_window_radius:col + internal_window_radius] = pred_mask
-
-        print(f"Total de ventanas procesadas: {window_count}")
+                    # Caché de predicciones: solo las ventanas no vistas pasan por el modelo
+                    pred_masks = [None] * len(windows)
+                    keys = [cache.key(w) for w in windows] if cache else None
+                    if cache:
+                        pred_masks = [cache.get(k) for k in keys]
+                    missing = [i for i, m in enumerate(pred_masks) if m is None]
+                    # batch_size limita las ventanas por llamada al modelo (None = columna completa);
+                    # memory_guard lo reduce si el proceso se acerca a su presupuesto de memoria
+                    start = 0
+                    while start < len(missing):
+                        step = batch_size or len(missing)
+                        if memory_guard:
+                            step = memory_guard.batch(step)
+                        chunk = missing[start:start + step]
+                        start += len(chunk)
+                        with perf.stage('semantic_inference', pixels=len(chunk) * (2 * window_radius) ** 2,
+                                        windows=len(chunk)):
+                            pred = session.run([output_name], {input_name: windows[chunk]})[0]
+                        for k, i in enumerate(chunk):
+                            pred_masks[i] = np.argmax(pred[k], axis=-1).astype(np.uint8)
+                            if cache:
+                                cache.put(keys[i], pred_masks[i])
+                    done_windows = []
+                    for i, row in enumerate(rows_for_col):
+                        pred_mask = pred_masks[i]
+                        if internal_window_radius < window_radius:
+                            mm = rint(window_radius - internal_window_radius)
+                            pred_mask = pred_mask[mm:-mm, mm:-mm]
+                        output_mask[row - internal_window_radius:row + internal_window_radius,
+                                    col - internal_window_radius:col + internal_window_radius] = pred_mask
+                        done_windows.append(((row, col), (row - internal_window_radius, row + internal_window_radius,
+                                                          col - internal_window_radius, col + internal_window_radius)))
+                    if journal:
+                        journal.commit(output_mask, done_windows)
+                    done += len(done_windows)
+                if progress:
+                    progress('semantic', done, total)
+                summary.update(done)
+
+            logger.info("Total de ventanas procesadas: %d", window_count)
         
-        # Aplicar máscara de píxeles válidos
-        output_mask[img[..., 0] == 0] = 0
+            # Aplicar máscara de píxeles válidos
+            output_mask[img[..., 0] == 0] = 0
         
-        # APLICAR POSTPROCESAMIENTO MEJORADO
-        print("Aplicando postprocesamiento...")
-        original_stats = np.unique(output_mask, return_counts=True)
-        print(f"Antes postprocesamiento - Clases: {original_stats}")
+            # APLICAR POSTPROCESAMIENTO MEJORADO
+            progress_mod.step(progress, 'semantic_postprocess')
+            logger.info("Aplicando postprocesamiento...")
+            if debug_enabled():
+                logger.debug("Antes postprocesamiento - Clases: %s", np.bincount(output_mask.ravel(), minlength=4))
         
-        output_mask_processed = postprocess_segmentation_mask(output_mask, min_region_size=20)
+            with perf.stage('semantic_postprocess', pixels=output_mask.size):
+                output_mask_processed = postprocess_segmentation_mask(output_mask, min_region_size=20)
         
-        final_stats = np.unique(output_mask_processed, return_counts=True)
-        print(f"Despues postprocesamiento - Clases: {final_stats}")
+            if debug_enabled():
+                logger.debug("Despues postprocesamiento - Clases: %s", np.bincount(output_mask_processed.ravel(), minlength=4))
 
-        base_name = os.path.basename(img_path).split('.')[0]
-        name_saved = f"{base_name}_argmax.tif"
-        if make_tif:
-            tif_output_path = os.path.join(output_folder, name_saved)
-            save_tiff_mask(output_mask_processed, tif_output_path, dataset)
+            if read_window:
+                full_mask = np.zeros((dataset.RasterYSize, dataset.RasterXSize), dtype=np.uint8)
+                full_mask[yoff:yoff + height, xoff:xoff + width] = output_mask_processed
+                output_mask_processed = full_mask
+
+            if make_tif:
+                with perf.stage('semantic_write', pixels=output_mask_processed.size):
+                    save_tiff_mask(output_mask_processed, tif_output_path, dataset)
+            if journal:
+                journal.finish({'output': name_saved})
+        finally:
+            # También al cancelar: Windows bloquea el diario y el ráster parcial abiertos
+            if journal:
+                journal.close()
 
-        print(f"Predicción completada para {img_path}")
+        logger.info("Predicción completada para %s", img_path)
         dataset = None
 
     return name_saved
\ No newline at end of file
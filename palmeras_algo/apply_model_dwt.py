@@ -1,3 +1,4 @@
+import logging
 from scipy.ndimage import binary_erosion
 import skimage.morphology
 import numpy as np
@@ -5,6 +6,15 @@ import os
 import onnxruntime as ort
 from osgeo import gdal
 
+from . import gdal_io
+from . import roi as roi_mod
+from . import checkpoint
+from . import perf
+from . import progress as progress_mod
+from .log import ProgressLog
+
+logger = logging.getLogger(__name__)
+
 # CONSTANTES MEJORADAS basadas en el aplicativo que funciona
 CLASS_TO_SS = {"mauritia": -128, "euterpe": -96, "oenocarpus": -64}
 CLASS_TO_CITYSCAPES = {"mauritia": 15, "euterpe": 25, "oenocarpus": 35}
@@ -58,6 +68,7 @@ def save_tiff_mask_final(mask, output_path, reference_dataset):
     MODIFICACIÓN: Guarda el raster final con geotransform corregida para bordes uniformes
     """
     driver = gdal.GetDriverByName('GTiff')
+    gdal_io.release_dataset(output_path)
     
     # Obtener la geotransform original
     original_gt = reference_dataset.GetGeoTransform()
@@ -92,161 +103,251 @@ def save_tiff_mask_final(mask, output_path, reference_dataset):
     out_dataset.FlushCache()
     out_dataset = None
     
-    print(f"✓ Raster final guardado: {mask.shape[1]}x{mask.shape[0]}")
-    print(f"✓ Geotransform aplicada: {new_gt}")
-
-def apply_instance_onnx(feature_file_list, mask, roi, output_folder, model_path2, window_radius, internal_window_radius, make_tif=True, make_png=False):
-    
-    image_path = feature_file_list[0]
-    mask_path = mask[0]
+    logger.info("Raster final guardado: %dx%d", mask.shape[1], mask.shape[0])
+    logger.debug("Geotransform aplicada: %s", new_gt)
 
+def create_session(model_path2, intra_op_num_threads=0):
+    """
+    Crea la sesión ONNX del modelo de instancias (DWT).
+    intra_op_num_threads=0 deja que ONNX Runtime use todos los núcleos.
+    """
     # Configurar ONNX Runtime con optimizaciones
     providers = ['CPUExecutionProvider']
     session_options = ort.SessionOptions()
     session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session_options.intra_op_num_threads = intra_op_num_threads
     
-    session = ort.InferenceSession(model_path2, providers=providers, sess_options=session_options)
-    input_names = [inp.name for inp in session.get_inputs()]
-    
-    print("=== CONFIGURACIÓN INSTANCIAS ONNX ===")
-    print(f"Inputs del modelo: {input_names}")
-    print(f"Window radius: {window_radius}")
-    print(f"Internal window radius: {internal_window_radius}")
-
-    dataset = gdal.Open(image_path, gdal.GA_ReadOnly)
-    datasetresponse = gdal.Open(mask_path, gdal.GA_ReadOnly)
+    return ort.InferenceSession(model_path2, providers=providers, sess_options=session_options)
 
-    bandas = min(dataset.RasterCount, 3)
+def apply_instance_onnx(feature_file_list, mask, roi, output_folder, model_path2, window_radius, internal_window_radius, make_tif=True, make_png=False, session=None, resume=False, cache=None, progress=None):
+    
+    image_path = feature_file_list[0]
+    mask_path = mask[0]
 
-    output = np.zeros((dataset.RasterYSize, dataset.RasterXSize), dtype=np.float32) + nodata_value
+    # Reutilizar la sesión si ya viene creada (modo lote)
+    if session is None:
+        session = create_session(model_path2)
+    input_names = [inp.name for inp in session.get_inputs()]
+    
+    logger.debug("Instancias ONNX: entradas %s, window radius %d, internal %d",
+                 input_names, window_radius, internal_window_radius)
 
-    cr = [0, dataset.RasterXSize]
-    rr = [0, dataset.RasterYSize]
+    name_saved_final = os.path.splitext(os.path.basename(image_path))[0] + '_predicted.tif'
+    out_path = os.path.join(output_folder, name_saved_final)
 
-    collist = [x for x in range(cr[0] + window_radius, cr[1] - window_radius, internal_window_radius * 2)]
-    if collist and collist[-1] < cr[1] - window_radius:
-        collist.append(cr[1] - window_radius)
+    dataset = gdal_io.open_dataset(image_path)
+
+    # Diario de ventanas terminadas para poder reanudar una corrida interrumpida
+    journal = None
+    if resume:
+        signature = checkpoint.job_signature('instances', [image_path, mask_path], model_path2, roi=roi,
+                                             window_radius=window_radius,
+                                             internal_window_radius=internal_window_radius)
+        journal = checkpoint.TileCheckpoint(os.path.splitext(out_path)[0], signature,
+                                            (dataset.RasterYSize, dataset.RasterXSize),
+                                            gdal.GDT_Float32, nodata_value, output_path=out_path)
+        if journal.completed is not None:
+            logger.info("Instancias ya completadas en una corrida anterior: %s", out_path)
+            journal.close()
+            done = journal.completed
+            return name_saved_final, done['mauritia'], done['euterpe'], done['oenocarpus']
+
+    try:
+        datasetresponse = gdal_io.open_dataset(mask_path)
+
+        bandas = min(dataset.RasterCount, 3)
+
+        output = np.zeros((dataset.RasterYSize, dataset.RasterXSize), dtype=np.float32) + nodata_value
+        if journal:
+            journal.restore(output)
+
+        # roi: AOI preparado con roi.rasterize_roi (vacío/None = todo el ráster)
+        if roi:
+            xoff, yoff, xsize, ysize = roi_mod.roi_window(roi, window_radius)
+            cr = [xoff, xoff + xsize]
+            rr = [yoff, yoff + ysize]
+        else:
+            cr = [0, dataset.RasterXSize]
+            rr = [0, dataset.RasterYSize]
+
+        collist = [x for x in range(cr[0] + window_radius, cr[1] - window_radius, internal_window_radius * 2)]
+        if collist and collist[-1] < cr[1] - window_radius:
+            collist.append(cr[1] - window_radius)
         
-    rowlist = [x for x in range(rr[0] + window_radius, rr[1] - window_radius, internal_window_radius * 2)]
-    if rowlist and rowlist[-1] < rr[1] - window_radius:
-        rowlist.append(rr[1] - window_radius)
-
-    win_size = window_radius * 2
-
-    print(f"Procesando {len(rowlist)} filas x {len(collist)} columnas")
-    print(f"Tamaño de ventana: {win_size}x{win_size}")
-
-    for col_idx, col in enumerate(collist):
-        imageBatch = []
-        responses = []
-        valid_rows = []
+        rowlist = [x for x in range(rr[0] + window_radius, rr[1] - window_radius, internal_window_radius * 2)]
+        if rowlist and rowlist[-1] < rr[1] - window_radius:
+            rowlist.append(rr[1] - window_radius)
+
+        win_size = window_radius * 2
+
+        logger.info("Procesando %d filas x %d columnas (ventana %dx%d)", len(rowlist), len(collist), win_size, win_size)
+
+        total = sum(1 for col in collist for n in rowlist
+                    if roi_mod.window_intersects(roi, n, col, internal_window_radius))
+        done = len(journal.done) if journal else 0
+        if progress:
+            progress('instances', done, total)
+        summary = ProgressLog('Instancias', total, done)
+        failures = 0
+
+        for col_idx, col in enumerate(collist):
+            imageBatch = []
+            responses = []
+            valid_rows = []
         
-        for row_idx, n in enumerate(rowlist):
-            d = np.zeros((win_size, win_size, bandas))
-            for b in range(bandas):
-                band_data = dataset.GetRasterBand(b + 1).ReadAsArray(col - window_radius, n - window_radius, win_size, win_size)
-                if band_data is not None:
-                    d[:, :, b] = band_data
-                else:
-                    d[:, :, b] = nodata_value
+            with perf.stage('instance_read'):
+                for row_idx, n in enumerate(rowlist):
+                    if not roi_mod.window_intersects(roi, n, col, internal_window_radius):
+                        continue
+                    if journal and journal.is_done((n, col)):
+                        continue
+                    d = np.zeros((win_size, win_size, bandas))
+                    for b in range(bandas):
+                        band_data = dataset.GetRasterBand(b + 1).ReadAsArray(col - window_radius, n - window_radius, win_size, win_size)
+                        if band_data is not None:
+                            d[:, :, b] = band_data
+                        else:
+                            d[:, :, b] = nodata_value
                 
-            d[np.isnan(d)] = nodata_value
-            d[np.isinf(d)] = nodata_value
-            d[d == -9999] = nodata_value
+                    d[np.isnan(d)] = nodata_value
+                    d[np.isinf(d)] = nodata_value
+                    d[d == -9999] = nodata_value
             
-            r = datasetresponse.GetRasterBand(1).ReadAsArray(col - window_radius, n - window_radius, win_size, win_size)
-            if r is None:
-                r = np.zeros((win_size, win_size)) + nodata_value
-            else:
-                r = r.astype(float)
-
-            if d.shape[0] == win_size and d.shape[1] == win_size:
-                d = scale_image(d)
-                imageBatch.append(d)
-                responses.append(r)
-                valid_rows.append(n)
-
-        if not imageBatch:
-            continue
-
-        imageBatch = np.stack(imageBatch)
-        responses = np.stack(responses)
-
-        ssBatch = (responses > 0).astype(np.float32)
-        ssMaskBatch = np.zeros_like(responses, dtype=np.float32)
-        for i in range(responses.shape[0]):
-            r_i = responses[i]
-            ssMaskBatch[i][r_i == 1] = CLASS_TO_SS["mauritia"]
-            ssMaskBatch[i][r_i == 2] = CLASS_TO_SS["euterpe"]
-            ssMaskBatch[i][r_i == 3] = CLASS_TO_SS["oenocarpus"]
-
-        imageBatch = imageBatch.reshape((imageBatch.shape[0], win_size, win_size, bandas))
-        outputBatch = np.zeros((len(valid_rows), win_size, win_size), dtype=np.uint8)
-
-        for j in range(len(valid_rows)):
-            try:
-                img_j = imageBatch[j] * ssBatch[j][..., np.newaxis]
-                input_j = np.concatenate([img_j, ssMaskBatch[j][..., np.newaxis]], axis=-1).astype(np.float32)
-                ss_batch_input = ssBatch[j].astype(np.float32)
-
-                # Verificar dimensiones antes de enviar al modelo
-                if input_j.shape != (win_size, win_size, 4):
-                    print(f"Advertencia: Formato de entrada inesperado: {input_j.shape}")
-                    continue
+                    r = datasetresponse.GetRasterBand(1).ReadAsArray(col - window_radius, n - window_radius, win_size, win_size)
+                    if r is None:
+                        r = np.zeros((win_size, win_size)) + nodata_value
+                    else:
+                        r = r.astype(float)
+
+                    if d.shape[0] == win_size and d.shape[1] == win_size:
+                        d = scale_image(d)
+                        imageBatch.append(d)
+                        responses.append(r)
+                        valid_rows.append(n)
+            perf.count('instance_read', pixels=len(valid_rows) * win_size * win_size, windows=len(valid_rows))
+
+            if not imageBatch:
+                continue
 
-                outputs = session.run(None, {
-                    input_names[0]: input_j[np.newaxis, ...],
-                    input_names[1]: ss_batch_input[np.newaxis, ...]
-                })
-                tmp_output = outputs[0][0]
-                outputBatch[j] = tmp_output.astype(np.uint8)
-                print(f"Ventana {j} procesada exitosamente")
+            imageBatch = np.stack(imageBatch)
+            responses = np.stack(responses)
+
+            ssBatch = (responses > 0).astype(np.float32)
+            ssMaskBatch = np.zeros_like(responses, dtype=np.float32)
+            for i in range(responses.shape[0]):
+                r_i = responses[i]
+                ssMaskBatch[i][r_i == 1] = CLASS_TO_SS["mauritia"]
+                ssMaskBatch[i][r_i == 2] = CLASS_TO_SS["euterpe"]
+                ssMaskBatch[i][r_i == 3] = CLASS_TO_SS["oenocarpus"]
+
+            imageBatch = imageBatch.reshape((imageBatch.shape[0], win_size, win_size, bandas))
+            outputBatch = np.zeros((len(valid_rows), win_size, win_size), dtype=np.uint8)
+            # Ventanas cuya inferencia o watershed falló: no se anotan en el diario
+            # para que una corrida reanudada las vuelva a calcular
+            failed = set()
+
+            for j in range(len(valid_rows)):
+                try:
+                    img_j = imageBatch[j] * ssBatch[j][..., np.newaxis]
+                    input_j = np.concatenate([img_j, ssMaskBatch[j][..., np.newaxis]], axis=-1).astype(np.float32)
+                    ss_batch_input = ssBatch[j].astype(np.float32)
+
+                    # Verificar dimensiones antes de enviar al modelo
+                    if input_j.shape != (win_size, win_size, 4):
+                        logger.warning("Formato de entrada inesperado: %s", input_j.shape)
+                        failed.add(j)
+                        continue
+
+                    # La salida cruda del modelo se guarda antes del watershed, así los
+                    # cambios de postprocesamiento no obligan a repetir la inferencia
+                    key = cache.key(input_j, ss_batch_input) if cache else None
+                    cached = cache.get(key) if cache else None
+                    if cached is not None:
+                        outputBatch[j] = cached
+                        continue
+
+                    with perf.stage('instance_inference', pixels=win_size * win_size, windows=1):
+                        outputs = session.run(None, {
+                            input_names[0]: input_j[np.newaxis, ...],
+                            input_names[1]: ss_batch_input[np.newaxis, ...]
+                        })
+                    tmp_output = outputs[0][0]
+                    outputBatch[j] = tmp_output.astype(np.uint8)
+                    if cache:
+                        cache.put(key, outputBatch[j])
                 
-            except Exception as e:
-                print(f"Error procesando ventana {j}: {e}")
-                continue
+                except Exception as e:
+                    logger.error("Error procesando ventana (%d, %d): %s", valid_rows[j], col, e)
+                    failed.add(j)
+                    continue
 
-        outputdwt = []
-        for j in range(len(outputBatch)):
-            try:
-                outputImage = watershed_cut(outputBatch[j], ssMaskBatch[j])
-                outputdwt.append(outputImage)
-            except Exception as e:
-                print(f"Error en watershed cut {j}: {e}")
-                outputdwt.append(np.zeros((win_size, win_size), dtype=np.float32))
-
-        if outputdwt:
-            outputdwt = np.stack(outputdwt)
-
-            for j, n in enumerate(valid_rows):
-                p = outputdwt[j]
-                if internal_window_radius < window_radius:
-                    mm = int(np.rint(window_radius - internal_window_radius))
-                    p = p[mm:-mm, mm:-mm]
+            outputdwt = []
+            with perf.stage('watershed', pixels=len(outputBatch) * win_size * win_size, windows=len(outputBatch)):
+                for j in range(len(outputBatch)):
+                    try:
+                        outputImage = watershed_cut(outputBatch[j], ssMaskBatch[j])
+                        outputdwt.append(outputImage)
+                    except Exception as e:
+                        logger.error("Error en watershed cut (%d, %d): %s", valid_rows[j], col, e)
+                        failed.add(j)
+                        outputdwt.append(np.zeros((win_size, win_size), dtype=np.float32))
+
+            if outputdwt:
+                outputdwt = np.stack(outputdwt)
+                done_windows = []
+
+                for j, n in enumerate(valid_rows):
+                    p = outputdwt[j]
+                    if internal_window_radius < window_radius:
+                        mm = int(np.rint(window_radius - internal_window_radius))
+                        p = p[mm:-mm, mm:-mm]
                 
-                start_row = n - internal_window_radius
-                end_row = n + internal_window_radius
-                start_col = col - internal_window_radius
-                end_col = col + internal_window_radius
+                    start_row = n - internal_window_radius
+                    end_row = n + internal_window_radius
+                    start_col = col - internal_window_radius
+                    end_col = col + internal_window_radius
                 
-                # Asegurar que no nos salimos de los límites
-                if (start_row >= 0 and end_row <= output.shape[0] and 
-                    start_col >= 0 and end_col <= output.shape[1]):
-                    output[start_row:end_row, start_col:end_col] = p
-
-    output, quantification = process_instances_raster(output)
-
-    # Guardar TIFF CON LA NUEVA FUNCIÓN
-    name_saved_final = os.path.basename(image_path).replace('.tif', '_predicted.tif')
-    out_path = os.path.join(output_folder, name_saved_final)
-    
-    if make_tif:
-        # USAR LA NUEVA FUNCIÓN DE GUARDADO
-        save_tiff_mask_final(output, out_path, dataset)
-        print(f"Archivo TIFF guardado: {out_path}")
-
-    mau = quantification['mauritia']
-    eut = quantification['euterpe']
-    oeno = quantification['oenocarpus']
+                    # Asegurar que no nos salimos de los límites
+                    if (start_row >= 0 and end_row <= output.shape[0] and 
+                        start_col >= 0 and end_col <= output.shape[1]):
+                        output[start_row:end_row, start_col:end_col] = p
+                        bounds = (start_row, end_row, start_col, end_col)
+                    else:
+                        bounds = (0, 0, 0, 0)
+                    if j not in failed:
+                        done_windows.append(((n, col), bounds))
+
+                if journal:
+                    journal.commit(output, done_windows)
+                failures += len(failed)
+                done += len(valid_rows)
+            if progress:
+                progress('instances', done, total)
+            summary.update(done)
+
+        progress_mod.step(progress, 'labeling')
+        with perf.stage('labeling', pixels=output.size):
+            output, quantification = process_instances_raster(output)
+
+        # Guardar TIFF CON LA NUEVA FUNCIÓN
+        if make_tif:
+            # USAR LA NUEVA FUNCIÓN DE GUARDADO
+            with perf.stage('instance_write', pixels=output.size):
+                save_tiff_mask_final(output, out_path, dataset)
+            logger.info("Archivo TIFF guardado: %s", out_path)
+
+        mau = quantification['mauritia']
+        eut = quantification['euterpe']
+        oeno = quantification['oenocarpus']
+
+        if journal and failures:
+            # La etapa no se marca terminada: al reanudar se reintentan las ventanas fallidas
+            logger.warning("%d ventanas de instancias fallaron; se reintentarán al reanudar", failures)
+        elif journal:
+            journal.finish(quantification)
+    finally:
+        # También al cancelar: Windows bloquea el diario y el ráster parcial abiertos
+        if journal:
+            journal.close()
 
     return name_saved_final, mau, eut, oeno
\ No newline at end of file
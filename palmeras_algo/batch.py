@@ -0,0 +1,89 @@
+##### Modo lote: varios rásteres en un solo proceso con los modelos cargados una vez ####
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from . import gdal_io
+from . import memory
+from . import palmeras_deteccion
+from . import perf
+from . import products
+from .progress import JobCancelled
+
+logger = logging.getLogger(__name__)
+
+
+def _run_job(job, sessions, progress=None, options=None, products_options=None, concurrent_jobs=1):
+    result = {'input': job['input'], 'output': job['output'],
+              'out': None, 'counts': None, 'report': None, 'area_ha': None, 'error': None}
+    try:
+        # Los reportes de tiempos dicen cuántos trabajos comparten el proceso
+        with perf.concurrent(concurrent_jobs):
+            out_raster, out_raster_clas, mau, eut, oeno = palmeras_deteccion.apply_palmeras(
+                job['input'], job['output'],
+                INPUT_ROI=job.get('roi'),
+                sessions=sessions,
+                progress=progress,
+                **(options or {})
+            )
+            result['out'] = [out_raster, out_raster_clas]
+            result['counts'] = [mau, eut, oeno]
+            result.update(products.write_products(out_raster, out_raster_clas, result['counts'],
+                                                  flight=products.flight_id(job['input']),
+                                                  progress=progress, **(products_options or {})))
+    except JobCancelled:
+        raise
+    except Exception as e:
+        logger.exception("Error procesando %s", job['input'])
+        result['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        # Los handles son por hilo: cada hilo del pool cierra los suyos al terminar
+        # el trabajo, nadie más puede hacerlo (ni to_cog con release_dataset)
+        gdal_io.close_datasets()
+    logger.info("=== LOTE: %s -> %s ===", os.path.basename(job['input']),
+                'ERROR ' + result['error'] if result['error'] else result['counts'])
+    return result
+
+
+def apply_palmeras_batch(jobs, max_workers=1, sessions=None, progress=None, products_options=None, threads=0,
+                         **options):
+    """
+    Procesa una lista de trabajos {'input': ..., 'output': ..., 'roi': ...}
+    reutilizando las mismas sesiones ONNX. Con max_workers > 1 los rásteres se
+    procesan en paralelo (ONNX Runtime admite run() concurrente) y los hilos de
+    cada sesión se reparten entre los trabajos, salvo que 'threads' (hilos de
+    ONNX Runtime por sesión, 0 = automático) los fije.
+
+    Devuelve un resultado por trabajo, en el mismo orden; un ráster que falla
+    no detiene el lote, su error queda en result['error']. Cada resultado trae
+    el reporte por especie ('report', 'area_ha') y los productos que pida
+    'products_options' (ver products.write_products). 'progress' recibe
+    además job=<índice del trabajo>; una cancelación detiene todo el lote.
+    'options' se pasan tal cual a apply_palmeras (radios de ventana, batch_size...);
+    con max_memory_mb los trabajos en paralelo se reparten el presupuesto
+    (memory.plan_budget con jobs) y comparten un MemoryGuard del proceso.
+    """
+    jobs = list(jobs)
+    max_workers = max(1, min(int(max_workers), len(jobs) or 1))
+    if sessions is None:
+        threads = threads or (0 if max_workers == 1 else max(1, (os.cpu_count() or 1) // max_workers))
+        sessions = palmeras_deteccion.load_sessions(intra_op_num_threads=threads)
+
+    def job_progress(i):
+        if progress is None:
+            return None
+        return lambda stage, done, total: progress(stage, done, total, job=i)
+
+    if options.get('max_memory_mb') and max_workers > 1:
+        # El RSS es de todo el proceso: un solo MemoryGuard con el presupuesto completo
+        options['memory_guard'] = memory.MemoryGuard(options['max_memory_mb'])
+        options['concurrent_jobs'] = max_workers
+    logger.info("=== LOTE: %d rásteres, %d en paralelo ===", len(jobs), max_workers)
+    if max_workers == 1:
+        return [_run_job(job, sessions, job_progress(i), options, products_options)
+                for i, job in enumerate(jobs)]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(lambda ij: _run_job(ij[1], sessions, job_progress(ij[0]), options, products_options,
+                                                 concurrent_jobs=max_workers),
+                             enumerate(jobs)))
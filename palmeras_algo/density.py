@@ -0,0 +1,88 @@
+##### Grilla de densidad de palmeras por especie (_densidad.tif) ####
+#
+# Se cuentan los centroides de la tabla de instancias en celdas regulares
+# (por ejemplo 50 o 100 m) con un solo np.bincount por especie sobre el
+# índice de celda: sale casi gratis de lo que ya se calculó para los conteos
+# y evita exportar centroides y agregarlos después en QGIS.
+# Bandas: una por especie (orden de instances.SPECIES) y el total, en
+# palmeras por hectárea. La grilla arranca en la esquina superior izquierda
+# del ortomosaico; las celdas del borde se cubren solo en parte, pero se
+# dividen por el área completa de la celda.
+
+import logging
+import math
+import os
+
+import numpy as np
+from osgeo import gdal, osr
+
+from . import gdal_io
+from . import instances
+
+logger = logging.getLogger(__name__)
+
+DENSITY_SUFFIX = '_densidad.tif'
+TOTAL_BAND = 'Total'
+
+
+def density_path(output_raster):
+    return os.path.splitext(output_raster)[0] + DENSITY_SUFFIX
+
+
+def density_grid(table, geotransform, width, height, cell_size, projection=None):
+    """
+    Palmeras por hectárea en celdas de 'cell_size' unidades del mapa (metros)
+    sobre la extensión de un ráster de width x height píxeles (norte arriba).
+    'projection' (WKT) debe ser un SRC proyectado: en grados ni las celdas
+    ni las hectáreas tendrían sentido.
+    Devuelve (arreglo float32 de bandas x filas x columnas, geotransform de la grilla).
+    """
+    if cell_size <= 0:
+        raise ValueError(f"Tamaño de celda inválido: {cell_size}")
+    gt = geotransform
+    if gt[2] or gt[4]:
+        raise ValueError("La grilla de densidad requiere un ráster sin rotación (norte arriba)")
+    if projection and osr.SpatialReference(wkt=projection).IsGeographic():
+        raise ValueError("La grilla de densidad requiere un SRC proyectado en metros (p. ej. UTM), "
+                         "no coordenadas geográficas")
+    n_cols = max(1, math.ceil(width * abs(gt[1]) / cell_size))
+    n_rows = max(1, math.ceil(height * abs(gt[5]) / cell_size))
+    # Índice de celda de cada centroide (x crece hacia el este, y hacia el sur)
+    col = np.floor((table['x'] - gt[0]) / cell_size * np.sign(gt[1])).astype(np.int64)
+    row = np.floor((table['y'] - gt[3]) / cell_size * np.sign(gt[5])).astype(np.int64)
+    inside = (col >= 0) & (col < n_cols) & (row >= 0) & (row < n_rows)
+    cells = (row * n_cols + col)[inside]
+    classes = table['clase'][inside]
+
+    codes = list(instances.SPECIES)
+    grid = np.zeros((len(codes) + 1, n_rows * n_cols), dtype=np.float32)
+    for band, code in enumerate(codes):
+        grid[band] = np.bincount(cells[classes == code], minlength=n_rows * n_cols)
+    grid[-1] = grid[:-1].sum(axis=0)
+    grid /= cell_size * cell_size / 10000
+    grid_gt = (gt[0], math.copysign(cell_size, gt[1]), 0.0, gt[3], 0.0, math.copysign(cell_size, gt[5]))
+    return grid.reshape(len(codes) + 1, n_rows, n_cols), grid_gt
+
+
+def write_density(table, output_raster, reference, cell_size):
+    """
+    Escribe junto a 'output_raster' el GeoTIFF multibanda de densidad (ver
+    density_grid) con la proyección de 'reference'. Devuelve la ruta.
+    """
+    grid, grid_gt = density_grid(table, reference.GetGeoTransform(), reference.RasterXSize,
+                                 reference.RasterYSize, cell_size, projection=reference.GetProjection())
+    path = density_path(output_raster)
+    gdal_io.release_dataset(path)
+    dataset = gdal.GetDriverByName('GTiff').Create(path, grid.shape[2], grid.shape[1], grid.shape[0],
+                                                   gdal.GDT_Float32, options=['COMPRESS=DEFLATE'])
+    dataset.SetGeoTransform(grid_gt)
+    dataset.SetProjection(reference.GetProjection())
+    for i, name in enumerate(list(instances.SPECIES.values()) + [TOTAL_BAND]):
+        band = dataset.GetRasterBand(i + 1)
+        band.SetDescription(name)
+        band.SetMetadataItem('UNITS', 'palmeras/ha')
+        band.WriteArray(grid[i])
+    dataset.FlushCache()
+    dataset = None
+    logger.info("Densidad (%g m): %s", cell_size, path)
+    return path
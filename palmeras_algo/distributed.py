@@ -0,0 +1,297 @@
+##### Varias máquinas: plan de teselas, corrida por tesela y unión en un directorio compartido ####
+#
+#   python -m palmeras_algo.distributed plan <ráster> <store> [--tile-size N] [--roi AOI]
+#   python -m palmeras_algo.distributed run-tile <store> <tesela>      (en cualquier nodo)
+#   python -m palmeras_algo.distributed merge <store> <salida.tif>
+#   python -m palmeras_algo.distributed run-local <store> [--workers N]  (todas, en esta máquina)
+#
+# El ráster de entrada (y el AOI) deben verse con la misma ruta desde todos los
+# nodos; las salidas de cada tesela quedan en <store>/tiles/<tesela>/ y se marcan
+# como terminadas con done.json, así un planificador puede reintentar sin riesgo.
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+from osgeo import gdal
+from skimage.measure import label
+
+from . import apply_model
+from . import gdal_io
+from . import palmeras_deteccion
+from . import roi as roi_mod
+from . import species_report
+from . import tiling
+from .apply_model_dwt import CLASS_TO_CITYSCAPES
+from .log import configure_logging
+
+MANIFEST_NAME = 'manifest.json'
+DEFAULT_TILE_SIZE = 8192
+
+logger = logging.getLogger(__name__)
+
+_sessions = None
+
+
+def _write_json(path, data):
+    """Escritura atómica: un nodo nunca lee un JSON a medias."""
+    tmp = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(data, fh, indent=1)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def _tile_dir(store, tile_id):
+    return os.path.join(store, 'tiles', tile_id)
+
+
+def plan(input_raster, store, tile_size=DEFAULT_TILE_SIZE, halo=tiling.DEFAULT_HALO, roi_path=None):
+    """
+    Divide el ráster en teselas (núcleo + halo) y escribe el manifiesto en
+    'store'. Las teselas cuyo núcleo no toca el AOI no se incluyen. Los
+    percentiles de normalización se calculan aquí, una vez para todo el
+    ráster (o el recorte del AOI), y todas las teselas usan los mismos.
+    """
+    gdal_io.configure_gdal()
+    dataset = gdal_io.open_dataset(input_raster)
+    if dataset is None:
+        raise FileNotFoundError(f"No se pudo abrir el ráster: {input_raster}")
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    roi = roi_mod.rasterize_roi(roi_path, dataset) if roi_path else None
+    palmeras_deteccion.require_roi_windows(roi)
+    margin = palmeras_deteccion.window_margin()
+    norm_stats = apply_model.normalization_stats(input_raster, window=roi_mod.roi_window(roi, 256) if roi else None)
+
+    cols = tiling.split_axis(width, max(1, round(width / tile_size)), halo)
+    rows = tiling.split_axis(height, max(1, round(height / tile_size)), halo)
+    tiles = []
+    for i, (y0, y1, ry0, ry1) in enumerate(rows):
+        for j, (x0, x1, rx0, rx1) in enumerate(cols):
+            if roi and not roi_mod.covers(roi, margin, x0, y0, x1, y1):
+                continue
+            tiles.append({'id': f't{i:03d}_{j:03d}', 'grid': [i, j],
+                          'core': [x0, y0, x1, y1], 'read': [rx0, ry0, rx1, ry1]})
+
+    os.makedirs(os.path.join(store, 'tiles'), exist_ok=True)
+    manifest = {
+        'input': os.path.abspath(input_raster),
+        'roi': os.path.abspath(roi_path) if roi_path else None,
+        'size': [width, height],
+        'grid': [len(rows), len(cols)],
+        'halo': halo,
+        'norm_stats': norm_stats,
+        'tiles': tiles,
+    }
+    path = os.path.join(store, MANIFEST_NAME)
+    _write_json(path, manifest)
+    logger.info("Plan: %d teselas (%d x %d) en %s", len(tiles), len(rows), len(cols), path)
+    return path
+
+
+def _load_manifest(store):
+    return _read_json(os.path.join(store, MANIFEST_NAME))
+
+
+def pending_tiles(store):
+    """Identificadores de las teselas sin done.json."""
+    return [t['id'] for t in _load_manifest(store)['tiles']
+            if not os.path.exists(os.path.join(_tile_dir(store, t['id']), 'done.json'))]
+
+
+def run_tile(store, tile_id, sessions=None, resume=True):
+    """Procesa una tesela del manifiesto (idempotente: si ya terminó, no hace nada)."""
+    manifest = _load_manifest(store)
+    tile = next((t for t in manifest['tiles'] if t['id'] == tile_id), None)
+    if tile is None:
+        raise KeyError(f"La tesela {tile_id} no está en el manifiesto")
+    folder = _tile_dir(store, tile_id)
+    done_path = os.path.join(folder, 'done.json')
+    if os.path.exists(done_path):
+        logger.info("Tesela %s ya terminada", tile_id)
+        return _read_json(done_path)
+
+    os.makedirs(folder, exist_ok=True)
+    rx0, ry0, rx1, ry1 = tile['read']
+    tile_input = os.path.join(folder, tile_id + '.vrt')
+    gdal.Translate(tile_input, manifest['input'], format='VRT', srcWin=[rx0, ry0, rx1 - rx0, ry1 - ry0])
+    out_raster, out_raster_clas, mau, eut, oeno = palmeras_deteccion.apply_palmeras(
+        tile_input, os.path.join(folder, tile_id + '.tif'),
+        INPUT_ROI=manifest['roi'],
+        sessions=sessions,
+        resume=resume,
+        norm_stats=manifest.get('norm_stats')
+    )
+    done = {'out': [os.path.basename(out_raster), os.path.basename(out_raster_clas)],
+            'counts': [mau, eut, oeno], 'host': socket.gethostname()}
+    _write_json(done_path, done)
+    return done
+
+
+class TileCounter:
+    """
+    Cuenta instancias (componentes 8-conexas por clase) sobre una grilla de
+    teselas: cada núcleo se etiqueta por separado y se guardan solo sus bordes;
+    las componentes que se tocan entre teselas vecinas (lados y esquinas) se
+    unen, así una palmera en el borde se cuenta una sola vez.
+    """
+
+    def __init__(self):
+        self._n = {name: 0 for name in CLASS_TO_CITYSCAPES}
+        self._borders = {}
+
+    def add(self, grid, instances):
+        borders = {}
+        for name, code in CLASS_TO_CITYSCAPES.items():
+            labels, n = label(instances == code, connectivity=2, return_num=True)
+            self._n[name] += n
+            borders[name] = {'top': labels[0].copy(), 'bottom': labels[-1].copy(),
+                             'left': labels[:, 0].copy(), 'right': labels[:, -1].copy()}
+        self._borders[tuple(grid)] = borders
+
+    def counts(self):
+        uf = tiling.UnionFind()
+        counts = dict(self._n)
+        for (i, j), borders in self._borders.items():
+            for name in CLASS_TO_CITYSCAPES:
+                a = borders[name]
+                pairs = []
+                right = self._borders.get((i, j + 1))
+                if right:
+                    pairs += [((i, j + 1), p) for p in tiling.seam_pairs(a['right'], right[name]['left'])]
+                below = self._borders.get((i + 1, j))
+                if below:
+                    pairs += [((i + 1, j), p) for p in tiling.seam_pairs(a['bottom'], below[name]['top'])]
+                diag = self._borders.get((i + 1, j + 1))
+                if diag and a['bottom'][-1] and diag[name]['top'][0]:
+                    pairs.append(((i + 1, j + 1), (a['bottom'][-1], diag[name]['top'][0])))
+                anti = self._borders.get((i + 1, j - 1))
+                if anti and a['bottom'][0] and anti[name]['top'][-1]:
+                    pairs.append(((i + 1, j - 1), (a['bottom'][0], anti[name]['top'][-1])))
+                for other, (la, lb) in pairs:
+                    if uf.union(((i, j), name, int(la)), (other, name, int(lb))):
+                        counts[name] -= 1
+        return counts
+
+
+def merge(store, output_raster):
+    """
+    Arma los rásteres de salida con los núcleos de todas las teselas, cuenta
+    las instancias sin duplicar las de los bordes y escribe el mismo reporte
+    por especie que el plugin (<salida>_reporte.csv). Devuelve lo mismo que
+    apply_palmeras.
+    """
+    manifest = _load_manifest(store)
+    missing = pending_tiles(store)
+    if missing:
+        raise RuntimeError(f"Faltan {len(missing)} teselas por procesar: {', '.join(missing[:10])}")
+
+    gdal_io.configure_gdal()
+    reference = gdal_io.open_dataset(manifest['input'])
+    output_clas = os.path.splitext(output_raster)[0] + '_clas.tif'
+    out_ds = tiling.create_like(reference, output_raster, gdal.GDT_Float32, -9999)
+    clas_ds = tiling.create_like(reference, output_clas, gdal.GDT_Byte, 0)
+
+    counter = TileCounter()
+    pixels = np.zeros(4, dtype=np.int64)
+    for tile in manifest['tiles']:
+        folder = _tile_dir(store, tile['id'])
+        done = _read_json(os.path.join(folder, 'done.json'))
+        x0, y0, x1, y1 = tile['core']
+        rx0, ry0 = tile['read'][:2]
+        window = (x0 - rx0, y0 - ry0, x1 - x0, y1 - y0)
+        instances = gdal.Open(os.path.join(folder, done['out'][0])).GetRasterBand(1).ReadAsArray(*window)
+        clas = gdal.Open(os.path.join(folder, done['out'][1])).GetRasterBand(1).ReadAsArray(*window)
+        out_ds.GetRasterBand(1).WriteArray(instances, x0, y0)
+        clas_ds.GetRasterBand(1).WriteArray(clas, x0, y0)
+        counter.add(tile['grid'], instances)
+        pixels += np.bincount(clas.ravel(), minlength=4)[:4]
+    out_ds.GetRasterBand(1).ComputeStatistics(False)
+    out_ds = clas_ds = None
+
+    counts = counter.counts()
+    mau, eut, oeno = counts['mauritia'], counts['euterpe'], counts['oenocarpus']
+    species_report.write_csv(species_report.report_path(output_raster), [mau, eut, oeno],
+                             species_report.areas_ha(pixels, reference.GetGeoTransform()))
+    _write_json(os.path.join(store, 'counts.json'),
+                {'output': os.path.abspath(output_raster), 'counts': [mau, eut, oeno]})
+    gdal_io.close_datasets()
+
+    logger.info("=== RESULTADOS FINALES (teselas) ===")
+    logger.info("Mauritia flexuosa: %d palmeras", mau)
+    logger.info("Euterpe precatoria: %d palmeras", eut)
+    logger.info("Oenocarpus bataua: %d palmeras", oeno)
+    return output_raster, output_clas, mau, eut, oeno
+
+
+def _run_tile_in_pool(store, tile_id, threads):
+    global _sessions
+    if _sessions is None:
+        _sessions = palmeras_deteccion.load_sessions(intra_op_num_threads=threads)
+    run_tile(store, tile_id, sessions=_sessions)
+    return tile_id
+
+
+def run_local(store, max_workers=1):
+    """Procesa todas las teselas pendientes en esta máquina (sustituto local del planificador)."""
+    pending = pending_tiles(store)
+    max_workers = max(1, min(int(max_workers), len(pending) or 1))
+    threads = max(1, (os.cpu_count() or 1) // max_workers)
+    cache_mb = max(64, gdal_io.DEFAULT_CACHE_MB // max_workers)
+    logger.info("=== TESELAS: %d pendientes, %d procesos x %d hilos ===", len(pending), max_workers, threads)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=tiling.init_band_worker, initargs=(threads, cache_mb)) as pool:
+        futures = [pool.submit(_run_tile_in_pool, store, tile_id, threads) for tile_id in pending]
+        for n, future in enumerate(as_completed(futures), 1):
+            logger.info("=== TESELAS: %s lista (%d/%d) ===", future.result(), n, len(pending))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m palmeras_algo.distributed',
+                                     description='Detección de palmeras repartida en teselas.')
+    parser.add_argument('--log-level', help='DEBUG, INFO, WARNING... (por defecto PALMERAS_LOG_LEVEL o INFO)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('plan', help='divide el ráster en teselas y escribe el manifiesto')
+    p.add_argument('input')
+    p.add_argument('store')
+    p.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE)
+    p.add_argument('--halo', type=int, default=tiling.DEFAULT_HALO)
+    p.add_argument('--roi')
+    p = sub.add_parser('run-tile', help='procesa una tesela')
+    p.add_argument('store')
+    p.add_argument('tile')
+    p = sub.add_parser('merge', help='une las teselas y escribe rásteres, conteos y reporte')
+    p.add_argument('store')
+    p.add_argument('output')
+    p = sub.add_parser('run-local', help='procesa todas las teselas pendientes en esta máquina')
+    p.add_argument('store')
+    p.add_argument('--workers', type=int, default=1)
+    p = sub.add_parser('status', help='lista las teselas pendientes')
+    p.add_argument('store')
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+
+    if args.command == 'plan':
+        plan(args.input, args.store, tile_size=args.tile_size, halo=args.halo, roi_path=args.roi)
+    elif args.command == 'run-tile':
+        run_tile(args.store, args.tile)
+    elif args.command == 'merge':
+        merge(args.store, args.output)
+    elif args.command == 'run-local':
+        run_local(args.store, max_workers=args.workers)
+    elif args.command == 'status':
+        for tile_id in pending_tiles(args.store):
+            print(tile_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+##### Configuración de E/S de GDAL y registro de datasets abiertos ####
+
+import os
+import threading
+from osgeo import gdal
+
+# Valores por defecto; cualquier variable ya definida por el usuario
+# (entorno o gdal.SetConfigOption) tiene prioridad sobre estos.
+DEFAULT_CACHE_MB = 512
+DEFAULT_VSI_CACHE_MB = 64
+DEFAULT_NUM_THREADS = 'ALL_CPUS'
+
+_local = threading.local()
+
+
+def _set_option(key, default, value=None):
+    if value is not None:
+        gdal.SetConfigOption(key, str(value))
+    elif gdal.GetConfigOption(key) is None:
+        gdal.SetConfigOption(key, str(default))
+
+
+def configure_gdal(cache_mb=None, num_threads=None, vsi_cache_mb=None):
+    """
+    Aplica la configuración de E/S de GDAL para el proceso actual:
+    caché de bloques, decodificación multihilo (JPEG/ZSTD/DEFLATE),
+    sin listar el directorio al abrir y caché VSI de lectura.
+    """
+    if cache_mb is not None or gdal.GetConfigOption('GDAL_CACHEMAX') is None:
+        gdal.SetCacheMax(int(cache_mb or DEFAULT_CACHE_MB) * 1024 * 1024)
+    _set_option('GDAL_NUM_THREADS', DEFAULT_NUM_THREADS, num_threads)
+    # TRUE evita el listado del directorio (lento con miles de fotos del vuelo)
+    # pero sigue encontrando .aux.xml/.ovr/.tfw por acceso directo.
+    _set_option('GDAL_DISABLE_READDIR_ON_OPEN', 'TRUE')
+    _set_option('VSI_CACHE', 'TRUE')
+    _set_option('VSI_CACHE_SIZE', DEFAULT_VSI_CACHE_MB * 1024 * 1024,
+                int(vsi_cache_mb) * 1024 * 1024 if vsi_cache_mb else None)
+
+
+def _registry():
+    if not hasattr(_local, 'datasets'):
+        _local.datasets = {}
+    return _local.datasets
+
+
+def open_dataset(path, update=False):
+    """
+    Abre 'path' una sola vez por hilo y reutiliza el handle (y la cabecera
+    ya leída) en las siguientes llamadas. Devuelve None si GDAL no puede abrirlo.
+    """
+    key = (os.path.abspath(path), bool(update))
+    datasets = _registry()
+    dataset = datasets.get(key)
+    if dataset is None:
+        dataset = gdal.Open(path, gdal.GA_Update if update else gdal.GA_ReadOnly)
+        if dataset is not None:
+            datasets[key] = dataset
+    return dataset
+
+
+def release_dataset(path):
+    """Cierra los handles de 'path' (necesario antes de renombrarlo o sobrescribirlo)."""
+    datasets = _registry()
+    target = os.path.abspath(path)
+    for key in [k for k in datasets if k[0] == target]:
+        datasets.pop(key).FlushCache()
+
+
+def close_datasets():
+    """Cierra todos los datasets abiertos por el hilo actual."""
+    datasets = _registry()
+    for dataset in datasets.values():
+        dataset.FlushCache()
+    datasets.clear()
@@ -0,0 +1,174 @@
+##### Tabla de instancias desde el ráster de instancias ####
+#
+# Cada palmera es una componente 8-conexa de su código de clase (la misma
+# regla con la que se cuenta). Se etiquetan todas con ids globales 1..n y las
+# columnas se calculan vectorizadas con np.bincount sobre los píxeles
+# etiquetados: píxeles, área y centro de masa en coordenadas del mapa. El
+# costo es lineal en píxeles y no hace falta ninguna geometría.
+#
+# Para una región de píxeles el centro de masa coincide con el centroide de
+# su polígono y el área con la del polígono, así que los valores son los
+# mismos que daban geom.centroid() y geom.area() en QGIS.
+#
+# Métricas de forma opcionales (METRICS), también vectorizadas y solo si se
+# piden:
+#   diameter     diámetro equivalente: el del círculo de igual área
+#   perimeter    aristas de píxel en el borde de la copa: el perímetro de su
+#                polígono (geom.length() en QGIS)
+#   compactness  4·pi·área / perímetro² (1 = círculo)
+#   bbox         extensión de la copa en coordenadas del mapa
+
+import logging
+
+import numpy as np
+from skimage.measure import label
+
+from . import gdal_io
+from . import perf
+from .apply_model_dwt import CLASS_TO_CITYSCAPES
+
+logger = logging.getLogger(__name__)
+
+SPECIES = {15: 'Mauritia flexuosa', 25: 'Euterpe precautoria', 35: 'Oenocarpus bataua'}
+# métrica -> columnas que agrega a la tabla, en orden
+METRICS = {
+    'diameter': ('diameter_m',),
+    'perimeter': ('perimeter_m',),
+    'compactness': ('compactness',),
+    'bbox': ('xmin', 'ymin', 'xmax', 'ymax'),
+}
+# Nombre de cada columna de métricas en las capas y en _atributos.csv
+# (ASCII, máximo 10 caracteres por el shapefile)
+METRIC_FIELDS = {
+    'diameter_m': 'DIAM_M',
+    'perimeter_m': 'PERIM_M',
+    'compactness': 'COMPACIDAD',
+    'xmin': 'XMIN',
+    'ymin': 'YMIN',
+    'xmax': 'XMAX',
+    'ymax': 'YMAX',
+}
+
+
+def label_instances(instances):
+    """
+    Etiqueta las palmeras de un arreglo de códigos de clase. Devuelve
+    (labels int32 con ids 1..n y 0 en el resto, clase de cada id con
+    classes[0] = 0).
+    """
+    labels = np.zeros(instances.shape, dtype=np.int32)
+    classes = [0]
+    for code in CLASS_TO_CITYSCAPES.values():
+        class_labels, n = label(instances == code, connectivity=2, return_num=True)
+        inside = class_labels > 0
+        labels[inside] = class_labels[inside] + (len(classes) - 1)
+        classes += [code] * n
+    return labels, np.array(classes, dtype=np.int32)
+
+
+def pixel_to_map(geotransform, col, row):
+    """Coordenadas del mapa de posiciones (col, row) en píxeles (float, esquina superior izquierda = 0)."""
+    gt = geotransform
+    return gt[0] + col * gt[1] + row * gt[2], gt[3] + col * gt[4] + row * gt[5]
+
+
+def metric_columns(table):
+    """Columnas de métricas presentes en 'table', en el orden de METRICS."""
+    return [column for columns in METRICS.values() for column in columns if column in table]
+
+
+def edge_counts(labels, n):
+    """
+    Aristas de píxel en el borde de cada etiqueta 0..n-1, separadas en
+    (verticales, horizontales). El borde del ráster cuenta como fondo.
+    """
+    padded = np.pad(labels, 1)
+    counts = []
+    # axis=1: entre columnas vecinas (aristas verticales); axis=0: entre filas
+    for axis in (1, 0):
+        a = padded[:, :-1] if axis == 1 else padded[:-1, :]
+        b = padded[:, 1:] if axis == 1 else padded[1:, :]
+        boundary = a != b
+        counts.append(np.bincount(a[boundary], minlength=n) + np.bincount(b[boundary], minlength=n))
+        del boundary
+    return counts
+
+
+def _bbox(rows, cols, ids, n, geotransform):
+    """Extensión (xmin, ymin, xmax, ymax) de cada etiqueta en coordenadas del mapa."""
+    bounds = []
+    for index, ufunc, start in ((rows, np.minimum, np.inf), (rows, np.maximum, -np.inf),
+                                (cols, np.minimum, np.inf), (cols, np.maximum, -np.inf)):
+        # La etiqueta 0 no tiene píxeles en 'ids' y queda infinita; se descarta después
+        out = np.full(n, start)
+        ufunc.at(out, ids, index)
+        bounds.append(out)
+    row_min, row_max, col_min, col_max = bounds
+    # Esquinas exteriores de los píxeles extremos
+    with np.errstate(invalid='ignore'):
+        x0, y0 = pixel_to_map(geotransform, col_min, row_min)
+        x1, y1 = pixel_to_map(geotransform, col_max + 1, row_max + 1)
+    return np.minimum(x0, x1), np.minimum(y0, y1), np.maximum(x0, x1), np.maximum(y0, y1)
+
+
+def instance_table(labels, classes, geotransform, metrics=()):
+    """
+    Columnas por palmera (arreglos del mismo largo, ordenados por id):
+    id, clase, pixels, area_m2, x, y (centro de masa en coordenadas del mapa)
+    y las de cada métrica de 'metrics' (ver METRICS).
+    """
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Métricas desconocidas: {', '.join(sorted(unknown))} (use {', '.join(METRICS)})")
+    n = len(classes)
+    rows, cols = np.nonzero(labels)
+    ids = labels[rows, cols]
+    pixels = np.bincount(ids, minlength=n)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # +0.5: centro del píxel
+        row_mean = np.bincount(ids, weights=rows, minlength=n) / pixels + 0.5
+        col_mean = np.bincount(ids, weights=cols, minlength=n) / pixels + 0.5
+    x, y = pixel_to_map(geotransform, col_mean, row_mean)
+    pixel_area = abs(geotransform[1] * geotransform[5] - geotransform[2] * geotransform[4])
+    table = {
+        'id': np.arange(1, n, dtype=np.int64),
+        'clase': classes[1:],
+        'pixels': pixels[1:],
+        'area_m2': pixels[1:] * pixel_area,
+        'x': x[1:],
+        'y': y[1:],
+    }
+
+    if 'bbox' in metrics:
+        xmin, ymin, xmax, ymax = _bbox(rows, cols, ids, n, geotransform)
+        table.update(xmin=xmin[1:], ymin=ymin[1:], xmax=xmax[1:], ymax=ymax[1:])
+    del rows, cols, ids
+    if 'diameter' in metrics:
+        table['diameter_m'] = 2 * np.sqrt(table['area_m2'] / np.pi)
+    if 'perimeter' in metrics or 'compactness' in metrics:
+        vertical, horizontal = edge_counts(labels, n)
+        # Una arista vertical mide lo que el alto del píxel; una horizontal, el ancho
+        perimeter = (vertical * abs(geotransform[5]) + horizontal * abs(geotransform[1]))[1:]
+        if 'perimeter' in metrics:
+            table['perimeter_m'] = perimeter
+        if 'compactness' in metrics:
+            table['compactness'] = 4 * np.pi * table['area_m2'] / perimeter ** 2
+    return table
+
+
+def read_instances(output_raster, metrics=()):
+    """
+    Lee el ráster de instancias de una corrida y lo etiqueta. Devuelve
+    (labels, tabla con 'metrics', dataset). Trabaja con el ráster completo en
+    memoria, igual que la etapa de instancias de apply_palmeras.
+    """
+    dataset = gdal_io.open_dataset(output_raster)
+    if dataset is None:
+        raise IOError(f"No se pudo abrir {output_raster}")
+    data = dataset.GetRasterBand(1).ReadAsArray()
+    with perf.stage('instance_table', pixels=data.size):
+        labels, classes = label_instances(data)
+        del data
+        table = instance_table(labels, classes, dataset.GetGeoTransform(), metrics)
+    logger.info("Tabla de instancias: %d palmeras", len(table['id']))
+    return labels, table, dataset
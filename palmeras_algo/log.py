@@ -0,0 +1,62 @@
+##### Registro con niveles y resúmenes de progreso limitados en frecuencia ####
+#
+# Los módulos usan logging.getLogger(__name__); el nivel del paquete sale de
+# configure_logging(level) o de la variable PALMERAS_LOG_LEVEL (INFO por
+# defecto). Con DEBUG se activan además los chequeos de diagnóstico que
+# recorren la imagen completa (rango de ventanas, estadísticas por banda...).
+
+import logging
+import os
+import sys
+import time
+
+LOG_LEVEL_ENV = 'PALMERAS_LOG_LEVEL'
+DEFAULT_LEVEL = 'INFO'
+# Segundos mínimos entre dos resúmenes de progreso de una misma etapa
+SUMMARY_INTERVAL = 10.0
+
+logger = logging.getLogger('palmeras_algo')
+
+
+def configure_logging(level=None, stream=None):
+    """
+    Un solo handler para todo el paquete, hacia 'stream' (stderr por defecto:
+    stdout queda libre para resultados). Se puede llamar varias veces.
+    """
+    level = level or os.environ.get(LOG_LEVEL_ENV) or DEFAULT_LEVEL
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s', '%H:%M:%S'))
+    logger.handlers[:] = [handler]
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+    return logger
+
+
+def debug_enabled():
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+class ProgressLog:
+    """
+    Resumen de progreso de una etapa en INFO: como máximo uno cada
+    'interval' segundos, más el final. Reemplaza el mensaje por lote.
+    """
+
+    def __init__(self, stage, total, done=0, interval=SUMMARY_INTERVAL, log=None):
+        self.stage = stage
+        self.total = total
+        self.interval = interval
+        self._log = log or logger
+        self._t0 = self._last = time.monotonic()
+        self._done0 = done
+
+    def update(self, done):
+        now = time.monotonic()
+        if done < self.total and now - self._last < self.interval:
+            return
+        self._last = now
+        elapsed = now - self._t0
+        rate = (done - self._done0) / elapsed if elapsed > 0 else 0.0
+        percent = 100.0 * done / self.total if self.total else 100.0
+        self._log.info("%s: %d/%d ventanas (%.0f%%), %.1f ventanas/s",
+                       self.stage, done, self.total, percent, rate)
@@ -0,0 +1,186 @@
+##### Presupuesto de memoria: tamaño de lote, bandas y procesos según max_memory_mb ####
+#
+# Las estimaciones son por etapa, en bytes por píxel del ráster (lo que la
+# etapa mantiene completo en memoria) y en MB por ventana (entrada, salida y
+# activaciones de ONNX Runtime). Los valores por ventana se midieron con los
+# modelos v1 y se pueden recalibrar con benchmarks/ (pico de memoria por caso).
+# Además MemoryGuard reduce el lote en marcha si el RSS se acerca al límite.
+
+import logging
+import os
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Segmentación: imagen float32 x3 bandas leída + copia normalizada, máscara
+# de salida, máscara postprocesada y temporales de morfología (uint8/bool)
+SEMANTIC_BYTES_PER_PIXEL = 2 * 3 * 4 + 4
+# Instancias: salida float32, resultado de process_instances_raster (float32),
+# etiquetas int64 y máscaras bool de una clase
+INSTANCE_BYTES_PER_PIXEL = 4 + 4 + 8 + 2
+# MB por ventana con el radio por defecto (entrada + logits + activaciones)
+SEMANTIC_WINDOW_MB = 320      # 512 x 512
+INSTANCE_WINDOW_MB = 420      # 700 x 700, una ventana por llamada
+# Sesiones ONNX cargadas (pesos + arena inicial) y base del intérprete
+SESSIONS_MB = 600
+BASE_MB = 250
+# Fracción del presupuesto para la caché de bloques de GDAL (tope 512 MB)
+GDAL_CACHE_FRACTION = 0.1
+# MemoryGuard reduce el lote por encima de esta fracción del límite
+BACKOFF_FRACTION = 0.9
+
+MB = 1024 * 1024
+
+
+def _windows_counters():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                    ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                    ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                    ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                    ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    process = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+        return None
+    return counters
+
+
+def rss_mb():
+    """Memoria residente actual del proceso en MB (None si no se puede medir)."""
+    if sys.platform.startswith('linux'):
+        try:
+            with open('/proc/self/statm') as fh:
+                return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / MB
+        except (OSError, ValueError, IndexError):
+            return None
+    if sys.platform == 'win32':
+        try:
+            counters = _windows_counters()
+        except (AttributeError, OSError):
+            return None
+        return counters.WorkingSetSize / MB if counters else None
+    # macOS y otros: solo hay pico, sirve como cota
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """Pico de memoria residente del proceso en MB (None si no se puede medir)."""
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux lo da en KB, macOS en bytes
+        return round(peak / (MB if sys.platform == 'darwin' else 1024), 1)
+    try:
+        counters = _windows_counters()
+    except (AttributeError, OSError):
+        return None
+    return round(counters.PeakWorkingSetSize / MB, 1) if counters else None
+
+
+def window_mb(per_window_mb, window_radius, default_radius):
+    """Escala el costo por ventana con el área de la ventana."""
+    return per_window_mb * (window_radius / default_radius) ** 2
+
+
+def process_mb(width, height, batch_size, window_radius=256, window_radius_instances=350):
+    """MB que necesita un proceso para correr apply_palmeras sobre width x height."""
+    pixels = width * height
+    semantic = pixels * SEMANTIC_BYTES_PER_PIXEL / MB + batch_size * window_mb(SEMANTIC_WINDOW_MB, window_radius, 256)
+    instances = pixels * INSTANCE_BYTES_PER_PIXEL / MB + window_mb(INSTANCE_WINDOW_MB, window_radius_instances, 350)
+    # Las etapas van una después de otra: cuenta la más cara
+    return BASE_MB + SESSIONS_MB + max(semantic, instances)
+
+
+def plan_budget(width, height, max_memory_mb, window_radius=256, window_radius_instances=350,
+                halo=None, max_workers=None, max_batch=None, jobs=1):
+    """
+    Elige procesos, bandas horizontales y ventanas por lote para que la
+    corrida quepa en max_memory_mb. Prefiere más procesos (más rápido) y, con
+    cada número de procesos, el menor número de bandas y el lote más grande.
+    Devuelve {'max_workers', 'n_bands', 'batch_size', 'gdal_cache_mb', 'estimate_mb'}.
+    Sin halo se usa el de las bandas para esos radios (palmeras_deteccion.band_halo).
+    'jobs' son trabajos que corren a la vez en hilos de este proceso (batch):
+    se reparten el presupuesto, pero comparten el intérprete, las sesiones
+    ONNX y la caché de GDAL, que se cuentan una sola vez.
+    """
+    if halo is None:
+        from .palmeras_deteccion import band_halo  # importa memory: evita el ciclo al cargar
+        halo = band_halo(window_radius, window_radius_instances)
+    cpus = os.cpu_count() or 1
+    max_workers = max(1, int(max_workers or max(1, cpus // 4)))
+    max_batch = max(1, int(max_batch or height // (2 * window_radius) or 1))
+    gdal_cache_mb = int(max(16, min(512, max_memory_mb * GDAL_CACHE_FRACTION)))
+    budget = max_memory_mb - gdal_cache_mb
+    if jobs > 1:
+        # La parte de cada trabajo, más lo compartido que process_mb vuelve a descontar
+        shared = BASE_MB + SESSIONS_MB
+        budget = (budget - shared) / jobs + shared
+    max_bands = max(1, height // max(1, halo))
+
+    best = None
+    for workers in range(max_workers, 0, -1):
+        per_worker = budget / workers
+        for n_bands in range(workers if workers > 1 else 1, max_bands + 1):
+            band_rows = -(-height // n_bands) + (2 * halo if n_bands > 1 else 0)
+            band_rows = min(height, band_rows)
+            fixed = process_mb(width, band_rows, 0, window_radius, window_radius_instances)
+            room = per_worker - fixed
+            batch = int(room // window_mb(SEMANTIC_WINDOW_MB, window_radius, 256))
+            if batch >= 1:
+                batch = min(batch, max_batch)
+                best = {'max_workers': workers, 'n_bands': n_bands, 'batch_size': batch,
+                        'gdal_cache_mb': gdal_cache_mb,
+                        'estimate_mb': round(workers * (fixed + batch * window_mb(SEMANTIC_WINDOW_MB, window_radius, 256))
+                                             + gdal_cache_mb)}
+                break
+        if best:
+            break
+    if best is None:
+        # Ni con una banda mínima entra: lo más chico posible, y que MemoryGuard vigile
+        best = {'max_workers': 1, 'n_bands': max_bands, 'batch_size': 1, 'gdal_cache_mb': gdal_cache_mb,
+                'estimate_mb': round(process_mb(width, min(height, -(-height // max_bands) + 2 * halo), 1,
+                                                window_radius, window_radius_instances) + gdal_cache_mb)}
+        logger.warning("El presupuesto de %d MB es menor que el mínimo estimado (%d MB); se usa "
+                       "1 proceso, %d bandas y lotes de 1 ventana", max_memory_mb, best['estimate_mb'],
+                       best['n_bands'])
+    logger.info("Presupuesto de memoria %d MB: %d procesos, %d bandas, lotes de %d ventanas (estimado %d MB)",
+                max_memory_mb, best['max_workers'], best['n_bands'], best['batch_size'], best['estimate_mb'])
+    return best
+
+
+class MemoryGuard:
+    """
+    Vigila el RSS del proceso durante la inferencia: si pasa de
+    BACKOFF_FRACTION del límite, cada llamada a batch() devuelve la mitad del
+    lote anterior (mínimo 1 ventana). El RSS es del proceso entero, así que
+    los trabajos que corren en hilos del mismo proceso comparten un solo
+    MemoryGuard con el presupuesto completo: cada reducción achica los lotes
+    de todos.
+    """
+
+    def __init__(self, max_memory_mb, fraction=BACKOFF_FRACTION):
+        self.limit_mb = max_memory_mb * fraction
+        self._halvings = 0
+        self._lock = threading.Lock()
+
+    def batch(self, batch_size):
+        with self._lock:
+            batch_size = max(1, batch_size >> self._halvings)
+            rss = rss_mb()
+            if rss is not None and rss > self.limit_mb and batch_size > 1:
+                self._halvings += 1
+                batch_size = max(1, batch_size // 2)
+                logger.warning("Memoria en %d MB (límite %d MB): lotes de %d ventanas", rss, self.limit_mb,
+                               batch_size)
+            return batch_size
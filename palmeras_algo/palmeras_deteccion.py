@@ -1,6 +1,7 @@
 ##### Script to detect 3 palm species using Deeplabv3 with ONNX ####
 
 ### Import libraries needed
+import logging
 import numpy as np
 import os
 from osgeo import gdal
@@ -11,6 +12,16 @@ from skimage import morphology
 
 from . import apply_model
 from . import apply_model_dwt
+from . import gdal_io
+from . import roi as roi_mod
+from . import checkpoint
+from . import memory
+from . import perf
+from . import progress as progress_mod
+from . import tile_cache
+from .log import debug_enabled
+
+logger = logging.getLogger(__name__)
 
 # Suppress warnings
 warnings.filterwarnings('ignore')
@@ -18,19 +29,62 @@ warnings.filterwarnings('ignore')
 # GDAL exceptions
 gdal.UseExceptions()
 
-# Configure paths
+# Configure paths (PALMERAS_MODELS_DIR permite usar otros modelos, p. ej. en benchmarks/)
 cmd_folder = os.path.split(inspect.getfile(inspect.currentframe()))[0]
-pluginPath = os.path.abspath(
+pluginPath = os.environ.get('PALMERAS_MODELS_DIR') or os.path.abspath(
     os.path.join(
         os.path.dirname(__file__),
         os.pardir, "trained_models"
     )
 )
+MODEL_SEMANTIC = os.path.join(pluginPath, "model_deeplabv3_segmentation_v1.onnx")
+MODEL_INSTANCES = os.path.join(pluginPath, "model_dwt_instance_segmenetation_v1.onnx")
+
+def internal_radius(window_radius):
+    """Radio del núcleo de una ventana: la parte de su predicción que se conserva."""
+    return int(round(window_radius * 0.75))
+
+
+def window_margin(window_radius=256, window_radius_instances=350):
+    """Píxeles junto al borde del ráster que no caen en el núcleo de ninguna ventana."""
+    return max(r - internal_radius(r) for r in (window_radius, window_radius_instances))
+
+
+def band_halo(window_radius=256, window_radius_instances=350):
+    """
+    Halo de una banda o tesela para que cada píxel de su núcleo caiga en el
+    núcleo de una ventana de instancias cuya ventana completa tiene debajo
+    máscara semántica ya predicha: ventana de instancias + su núcleo + el
+    borde que la segmentación no predice (350 + 262 + 64 = 676 por defecto).
+    """
+    semantic_margin = window_radius - internal_radius(window_radius)
+    return max(window_radius_instances + internal_radius(window_radius_instances) + semantic_margin,
+               window_radius + internal_radius(window_radius))
+
+
+def require_roi_windows(roi, window_radius=256, window_radius_instances=350):
+    """Falla si el AOI no selecciona ventanas en alguna de las dos etapas (ver roi.require_windows)."""
+    for radius in (window_radius, window_radius_instances):
+        roi_mod.require_windows(roi, radius, internal_radius(radius))
+
+
+def load_sessions(intra_op_num_threads=0):
+    """
+    Carga una sola vez las dos sesiones ONNX para reutilizarlas en varios rásteres.
+    Devuelve {'semantic': ..., 'instances': ...}.
+    """
+    for path in (MODEL_SEMANTIC, MODEL_INSTANCES):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"El modelo ONNX no se encuentra en: {path}")
+    return {
+        'semantic': apply_model.create_session(MODEL_SEMANTIC, intra_op_num_threads),
+        'instances': apply_model_dwt.create_session(MODEL_INSTANCES, intra_op_num_threads),
+    }
 
 # NUEVO: Función de diagnóstico de imagen
 def diagnostic_image_analysis(img_path):
     """Análisis detallado de la imagen para diagnóstico"""
-    dataset = gdal.Open(img_path)
+    dataset = gdal_io.open_dataset(img_path)
     if not dataset:
         return None, None
     
@@ -75,15 +129,12 @@ def diagnostic_image_analysis(img_path):
     
     dataset = None
     
-    print("=== DIAGNÓSTICO DE IMAGEN ===")
-    print(f"Archivo: {os.path.basename(img_path)}")
-    print(f"Tamaño: {info['size']}")
-    print(f"Bandas: {info['bands']}")
-    print(f"Tipo de datos: {info['data_type']}")
-    print("Estadísticas por banda:")
+    logger.debug("=== DIAGNÓSTICO DE IMAGEN ===")
+    logger.debug("Archivo: %s, tamaño: %s, bandas: %d, tipo de datos: %s",
+                 os.path.basename(img_path), info['size'], info['bands'], info['data_type'])
     for stats in band_stats:
-        print(f"  Banda {stats['band']}: min={stats['min']:.2f}, max={stats['max']:.2f}, "
-              f"mean={stats['mean']:.2f}, std={stats['std']:.2f}, nodata={stats['nodata_pixels']}")
+        logger.debug("  Banda %d: min=%.2f, max=%.2f, mean=%.2f, std=%.2f, nodata=%d", stats['band'],
+                     stats['min'], stats['max'], stats['mean'], stats['std'], stats['nodata_pixels'])
     
     return info, band_stats
 
@@ -99,7 +150,7 @@ def improved_preprocessing(image_data, original_dtype, nodata_value, scaling='no
     # Convertir a float32 para procesamiento
     image_float = image_data.astype(np.float32)
     
-    print(f"Preprocesamiento: tipo_dato={original_dtype}, scaling={scaling}")
+    logger.debug("Preprocesamiento: tipo_dato=%s, scaling=%s", original_dtype, scaling)
     
     if scaling == 'normalize':
         # PREPROCESAMIENTO MEJORADO BASADO EN EL RANGO DINÁMICO
@@ -115,7 +166,7 @@ def improved_preprocessing(image_data, original_dtype, nodata_value, scaling='no
                 if p99 - p1 < 10:  # Rango muy pequeño
                     p1, p99 = np.percentile(valid_pixels, [0.5, 99.5])
                 
-                print(f"  Banda {b+1}: percentiles 1-99% = [{p1:.2f}, {p99:.2f}]")
+                logger.debug("  Banda %d: percentiles 1-99%% = [%.2f, %.2f]", b + 1, p1, p99)
                 
                 # Aplicar estiramiento de contraste mejorado
                 band_stretched = np.zeros_like(band_data)
@@ -139,7 +190,8 @@ def improved_preprocessing(image_data, original_dtype, nodata_value, scaling='no
         for b in range(image_float.shape[2]):
             image_float[nodata_mask, b] = -1
             
-        print(f"  Rango final: min={image_float.min():.3f}, max={image_float.max():.3f}")
+        if debug_enabled():
+            logger.debug("  Rango final: min=%.3f, max=%.3f", image_float.min(), image_float.max())
         
     elif scaling == 'mean_std':
         # Escalado mean-std tradicional
@@ -179,24 +231,52 @@ def postprocess_mask(mask, min_region_size=30):
                     
         return cleaned_mask
     except ImportError:
-        print("ADVERTENCIA: skimage no disponible, saltando postprocesamiento")
+        logger.warning("skimage no disponible, saltando postprocesamiento")
         return mask
 
 ### Main Plugin Function ###
-def apply_palmeras(INPUT_RASTER, OUTPUT_RASTER):
+def apply_palmeras(INPUT_RASTER, OUTPUT_RASTER, INPUT_ROI=None, sessions=None, resume=True,
+                   cache_dir=None, cache_max_mb=None, progress=None,
+                   window_radius=256, window_radius_instances=350, threads=0, gdal_threads=None,
+                   batch_size=None, max_memory_mb=None, norm_stats=None, memory_guard=None, concurrent_jobs=1):
+    """
+    Detección completa (segmentación semántica + instancias) de INPUT_RASTER.
+    Con resume=True cada etapa anota las ventanas terminadas en un diario junto
+    a las salidas; si la corrida se interrumpe, volver a ejecutarla con las
+    mismas entradas continúa desde la última ventana terminada.
+    Con cache_max_mb > 0 (o PALMERAS_TILE_CACHE_MB; desactivada por defecto)
+    las salidas del modelo por ventana se guardan en una caché en disco
+    (cache_dir), así repetir la detección sobre el mismo mosaico solo vuelve
+    a correr el postprocesamiento.
+    'progress(stage, done, total)' se llama entre lotes de ventanas y puede
+    lanzar progress.JobCancelled para detener la corrida.
+    Ajustes de ejecución: radios de ventana de cada etapa, hilos de ONNX
+    Runtime (0 = todos) y de GDAL, y ventanas por llamada al modelo semántico.
+    Con max_memory_mb el lote (si no se indica) y la caché de GDAL se ajustan
+    a ese presupuesto y el lote se reduce en marcha si el RSS se acerca al
+    límite; para rásteres que no caben, ver tiling.apply_palmeras_sharded.
+    Si corren 'concurrent_jobs' trabajos en hilos de este proceso, todos
+    reciben el presupuesto completo y el mismo memory_guard
+    (memory.MemoryGuard, ver batch.apply_palmeras_batch).
+    norm_stats (apply_model.normalization_stats) reemplaza los percentiles de
+    normalización del propio ráster: el modo particionado pasa los del
+    ráster completo a cada banda.
+    """
     ### Model settings
-    window_radius = 256
     output_folder = os.path.dirname(OUTPUT_RASTER) if OUTPUT_RASTER != 'TEMPORARY_OUTPUT' else os.path.join(os.path.dirname(INPUT_RASTER), 'output')
     feature_file_list = [INPUT_RASTER]
-    internal_window_radius = int(round(window_radius * 0.75))
-    model_path = os.path.join(pluginPath, "model_deeplabv3_segmentation_v1.onnx")
-    model_path2 = os.path.join(pluginPath, "model_dwt_instance_segmenetation_v1.onnx")
+    internal_window_radius = internal_radius(window_radius)
+    internal_window_radius_instances = internal_radius(window_radius_instances)
+    model_path = MODEL_SEMANTIC
+    model_path2 = MODEL_INSTANCES
+    if not sessions and threads:
+        sessions = load_sessions(intra_op_num_threads=threads)
+    sessions = sessions or {}
     
-    print("=== CONFIGURACIÓN DE MODELOS ===")
-    print(f"Modelo segmentación: {model_path}")
-    print(f"Modelo instancias: {model_path2}")
-    print(f"Window radius: {window_radius}")
-    print(f"Internal window radius: {internal_window_radius}")
+    logger.info("=== CONFIGURACIÓN DE MODELOS ===")
+    logger.info("Modelo segmentación: %s", model_path)
+    logger.info("Modelo instancias: %s", model_path2)
+    logger.info("Window radius: %d (interno %d)", window_radius, internal_window_radius)
 
     ### Verificar si los modelos existen
     if not os.path.exists(model_path):
@@ -207,55 +287,113 @@ def apply_palmeras(INPUT_RASTER, OUTPUT_RASTER):
     ### Create output folder if it doesn't exist
     os.makedirs(output_folder, exist_ok=True)
 
-    # NUEVO: Ejecutar diagnóstico de imagen
-    print("=== EJECUTANDO DIAGNÓSTICO DE IMAGEN ===")
-    info, band_stats = diagnostic_image_analysis(INPUT_RASTER)
-    
-    ### Semantic segmentation con configuración mejorada
-    name_saved = apply_model.apply_semantic_segmentation_onnx(
-        input_file_list=feature_file_list,
-        output_folder=output_folder,
-        model_path=model_path,
-        window_radius=window_radius,
-        internal_window_radius=internal_window_radius,
-        make_tif=True,
-        scaling='normalize'  # Usar normalización mejorada
-    )
+    # Caché de bloques, decodificación multihilo y caché VSI para todo el job
+    gdal_cache_mb = None
+    if max_memory_mb:
+        reference = gdal_io.open_dataset(INPUT_RASTER)
+        budget = memory.plan_budget(reference.RasterXSize, reference.RasterYSize, max_memory_mb,
+                                    window_radius=window_radius, window_radius_instances=window_radius_instances,
+                                    max_workers=1, jobs=concurrent_jobs)
+        if budget['n_bands'] > 1:
+            logger.warning("El ráster completo no cabe en %d MB; use el modo particionado (%d bandas)",
+                           max_memory_mb, budget['n_bands'])
+        batch_size = batch_size or budget['batch_size']
+        gdal_cache_mb = budget['gdal_cache_mb']
+        memory_guard = memory_guard or memory.MemoryGuard(max_memory_mb)
+    gdal_io.configure_gdal(cache_mb=gdal_cache_mb, num_threads=gdal_threads)
 
-    ### Procesamiento de instancias
-    window_radius_instances = 350  
-    internal_window_radius_instances = int(round(window_radius_instances * 0.75))
-    name_mask_clas = os.path.join(output_folder, name_saved)
-    mask = [name_mask_clas]
-    roi = []
-
-    print("=== PROCESANDO INSTANCIAS ===")
-    print(f"Window radius instancias: {window_radius_instances}")
-    print(f"Internal window radius instancias: {internal_window_radius_instances}")
-
-    name_saved_final, mau, eut, oeno = apply_model_dwt.apply_instance_onnx(
-        feature_file_list,
-        mask,
-        roi,
-        output_folder,
-        model_path2,
-        window_radius_instances,
-        internal_window_radius_instances,
-        make_tif=True,
-        make_png=False
-    )
+    # Cachés de predicciones por ventana (una por modelo y preprocesamiento)
+    cache_semantic = tile_cache.create_cache(model_path, {'stage': 'semantic', 'scaling': 'normalize'},
+                                             cache_dir=cache_dir, max_mb=cache_max_mb)
+    cache_instances = tile_cache.create_cache(model_path2, {'stage': 'instances'},
+                                              cache_dir=cache_dir, max_mb=cache_max_mb)
+
+    # Todo lo que sigue queda medido por etapa (perf.stage en cada módulo)
+    with perf.recording(os.path.basename(INPUT_RASTER)) as recorder:
+        # Diagnóstico de imagen: lee las bandas completas, solo en DEBUG
+        if debug_enabled():
+            progress_mod.step(progress, 'diagnostic')
+            diagnostic_image_analysis(INPUT_RASTER)
+
+        # Área de interés opcional: se rasteriza una vez y la usan ambas etapas
+        roi = None
+        if INPUT_ROI:
+            logger.info("=== PREPARANDO ÁREA DE INTERÉS ===")
+            progress_mod.step(progress, 'roi')
+            with perf.stage('roi'):
+                roi = roi_mod.rasterize_roi(INPUT_ROI, gdal_io.open_dataset(INPUT_RASTER), progress=progress)
+            # Un AOI pegado al borde no selecciona ventanas: mejor fallar que devolver cero palmeras
+            require_roi_windows(roi, window_radius, window_radius_instances)
     
-    # Manejar rutas de salida
-    out_imag = os.path.join(output_folder, name_saved_final)
-    os.rename(out_imag, OUTPUT_RASTER)
-    OUTPUT_RASTER_CLAS = os.path.join(OUTPUT_RASTER.split('.')[0] + '_clas.tif')
-    os.rename(name_mask_clas, OUTPUT_RASTER_CLAS)
+        ### Semantic segmentation con configuración mejorada
+        name_saved = apply_model.apply_semantic_segmentation_onnx(
+            input_file_list=feature_file_list,
+            output_folder=output_folder,
+            model_path=model_path,
+            window_radius=window_radius,
+            internal_window_radius=internal_window_radius,
+            make_tif=True,
+            scaling='normalize',  # Usar normalización mejorada
+            roi=roi,
+            session=sessions.get('semantic'),
+            resume=resume,
+            cache=cache_semantic,
+            progress=progress,
+            batch_size=batch_size,
+            memory_guard=memory_guard,
+            norm_stats=norm_stats
+        )
+
+        ### Procesamiento de instancias
+        name_mask_clas = os.path.join(output_folder, name_saved)
+        mask = [name_mask_clas]
+
+        logger.info("=== PROCESANDO INSTANCIAS ===")
+        logger.info("Window radius instancias: %d (interno %d)", window_radius_instances, internal_window_radius_instances)
+
+        name_saved_final, mau, eut, oeno = apply_model_dwt.apply_instance_onnx(
+            feature_file_list,
+            mask,
+            roi,
+            output_folder,
+            model_path2,
+            window_radius_instances,
+            internal_window_radius_instances,
+            make_tif=True,
+            make_png=False,
+            session=sessions.get('instances'),
+            resume=resume,
+            cache=cache_instances,
+            progress=progress
+        )
     
-    print("=== RESULTADOS FINALES ===")
-    print(f"Ráster de instancias: {OUTPUT_RASTER}")
-    print(f"Ráster de clasificación: {OUTPUT_RASTER_CLAS}")
-    print(f"Mauritia flexuosa: {mau} palmeras")
-    print(f"Euterpe precatoria: {eut} palmeras") 
-    print(f"Oenocarpus bataua: {oeno} palmeras")
+        # Cerrar los handles compartidos antes de renombrar (Windows bloquea archivos abiertos)
+        gdal_io.close_datasets()
+
+        # Manejar rutas de salida
+        out_imag = os.path.join(output_folder, name_saved_final)
+        os.rename(out_imag, OUTPUT_RASTER)
+        OUTPUT_RASTER_CLAS = os.path.splitext(OUTPUT_RASTER)[0] + '_clas.tif'
+        os.rename(name_mask_clas, OUTPUT_RASTER_CLAS)
+
+        # Job completo: los diarios ya no son necesarios
+        checkpoint.remove_checkpoint(os.path.splitext(name_mask_clas)[0])
+        checkpoint.remove_checkpoint(os.path.splitext(out_imag)[0])
+
+        # Tiempos por etapa junto a las salidas (<salida>_perf.json)
+        perf_report = recorder.report()
+        perf.write_report(perf_report, perf.report_path(OUTPUT_RASTER))
+
+    logger.info("=== RESULTADOS FINALES ===")
+    logger.info("Ráster de instancias: %s", OUTPUT_RASTER)
+    logger.info("Ráster de clasificación: %s", OUTPUT_RASTER_CLAS)
+    logger.info("Mauritia flexuosa: %d palmeras", mau)
+    logger.info("Euterpe precatoria: %d palmeras", eut)
+    logger.info("Oenocarpus bataua: %d palmeras", oeno)
+    for label, cache in (('segmentación', cache_semantic), ('instancias', cache_instances)):
+        if cache:
+            logger.info("Caché de ventanas (%s): %d aciertos, %d fallos", label, cache.hits, cache.misses)
+    for line in perf.summary_lines(perf_report):
+        logger.info(line)
     
     return OUTPUT_RASTER, OUTPUT_RASTER_CLAS, mau, eut, oeno
\ No newline at end of file
@@ -0,0 +1,193 @@
+##### Tiempos por etapa: reloj, CPU, píxeles/s, ventanas/s y pico de memoria ####
+#
+# apply_palmeras abre un registro con recording(); las etapas marcan sus
+# tramos con perf.stage('nombre', pixels=..., windows=...). Sin registro
+# activo stage() no hace nada, así las funciones se pueden llamar sueltas.
+# Solo usa la biblioteca estándar: el plugin lo importa desde QGIS para
+# agregar sus propias etapas al reporte.
+#
+# CPU y memoria se miden para el proceso entero: si varios trabajos corren en
+# hilos del mismo proceso (batch con workers > 1) cada reporte incluye lo de
+# los otros y lo dice en 'concurrent_jobs'.
+
+import contextvars
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+from .memory import peak_rss_mb, rss_mb
+
+REPORT_SUFFIX = '_perf.json'
+
+_current = contextvars.ContextVar('palmeras_perf', default=None)
+_concurrent = contextvars.ContextVar('palmeras_perf_concurrent', default=1)
+_NULL = nullcontext()
+
+
+def report_path(output_raster):
+    return os.path.splitext(output_raster)[0] + REPORT_SUFFIX
+
+
+class PerfRecorder:
+    """
+    Acumula por etapa: llamadas, tiempo de reloj, tiempo de CPU del proceso
+    (incluye los hilos de ONNX Runtime y GDAL, por eso puede superar al de
+    reloj) y píxeles/ventanas procesados. El RSS se muestrea al entrar y al
+    salir de cada etapa: peak_rss_mb es el mayor visto durante el trabajo, no
+    el pico de toda la vida del proceso (process_peak_rss_mb).
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.stages = {}
+        self.concurrent_jobs = _concurrent.get()
+        self.peak_rss_mb = None
+        self._wall0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+        self.sample()
+
+    def sample(self):
+        rss = rss_mb()
+        if rss is not None and (self.peak_rss_mb is None or rss > self.peak_rss_mb):
+            self.peak_rss_mb = rss
+
+    def _entry(self, name):
+        return self.stages.setdefault(name, {'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'pixels': 0, 'windows': 0})
+
+    def add(self, name, wall_s, cpu_s=0.0, pixels=0, windows=0, calls=1):
+        entry = self._entry(name)
+        entry['calls'] += calls
+        entry['wall_s'] += wall_s
+        entry['cpu_s'] += cpu_s
+        entry['pixels'] += int(pixels)
+        entry['windows'] += int(windows)
+
+    @contextmanager
+    def stage(self, name, pixels=0, windows=0):
+        self.sample()
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall0, time.process_time() - cpu0, pixels, windows)
+            self.sample()
+
+    def report(self):
+        self.sample()
+        stages = {name: _stage_report(entry) for name, entry in self.stages.items()}
+        return {
+            'job': self.job,
+            'wall_s': round(time.perf_counter() - self._wall0, 3),
+            'cpu_s': round(time.process_time() - self._cpu0, 3),
+            'peak_rss_mb': round(self.peak_rss_mb, 1) if self.peak_rss_mb is not None else None,
+            'process_peak_rss_mb': peak_rss_mb(),
+            'concurrent_jobs': self.concurrent_jobs,
+            'stages': stages,
+        }
+
+    def write(self, path):
+        write_report(self.report(), path)
+        return path
+
+
+def _stage_report(entry):
+    """Etapa con tiempos redondeados y sus tasas (píxeles/s, ventanas/s)."""
+    stage = dict(entry, wall_s=round(entry['wall_s'], 3), cpu_s=round(entry['cpu_s'], 3))
+    if entry['wall_s'] > 0:
+        if entry['pixels']:
+            stage['pixels_per_s'] = round(entry['pixels'] / entry['wall_s'], 1)
+        if entry['windows']:
+            stage['windows_per_s'] = round(entry['windows'] / entry['wall_s'], 2)
+    return stage
+
+
+def write_report(report, path):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, indent=1, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def read_report(path):
+    with open(path, encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+@contextmanager
+def recording(job):
+    """Activa un PerfRecorder para el contexto actual (hilo o tarea)."""
+    recorder = PerfRecorder(job)
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def concurrent(jobs):
+    """Marca los registros abiertos dentro como parte de 'jobs' trabajos simultáneos en este proceso."""
+    token = _concurrent.set(max(1, int(jobs)))
+    try:
+        yield
+    finally:
+        _concurrent.reset(token)
+
+
+@contextmanager
+def appending(output_raster, job):
+    """
+    Como recording(), para pasos posteriores a apply_palmeras: al salir suma
+    sus etapas al reporte ya escrito de 'output_raster' (si existe).
+    """
+    with recording(job) as recorder:
+        yield recorder
+    path = report_path(output_raster)
+    if os.path.exists(path):
+        write_report(merge_stages(read_report(path), recorder), path)
+
+
+def stage(name, pixels=0, windows=0):
+    recorder = _current.get()
+    return recorder.stage(name, pixels, windows) if recorder else _NULL
+
+
+def count(name, pixels=0, windows=0):
+    """Suma píxeles/ventanas a una etapa cuyo tamaño se conoce después de medirla."""
+    recorder = _current.get()
+    if recorder:
+        recorder.add(name, 0.0, pixels=pixels, windows=windows, calls=0)
+
+
+def merge_stages(report, recorder):
+    """Agrega al reporte las etapas de otro proceso (p. ej. las de QGIS)."""
+    extra = recorder.report()
+    stages = report['stages']
+    for name, st in extra['stages'].items():
+        if name in stages:
+            # La misma etapa en los dos procesos: se suman y se recalculan las tasas
+            st = _stage_report({key: stages[name][key] + st[key]
+                                for key in ('calls', 'wall_s', 'cpu_s', 'pixels', 'windows')})
+        stages[name] = st
+    report['wall_s'] = round(report['wall_s'] + extra['wall_s'], 3)
+    report.setdefault('processes', {})[extra['job']] = {'cpu_s': extra['cpu_s'],
+                                                        'peak_rss_mb': extra['peak_rss_mb']}
+    return report
+
+
+def summary_lines(report):
+    """Resumen legible: total y una línea por etapa, ordenadas por tiempo."""
+    total = report['wall_s'] or 1.0
+    lines = [f"Tiempo total: {report['wall_s']:.1f} s (CPU {report['cpu_s']:.1f} s), "
+             f"pico de memoria: {report['peak_rss_mb']} MB"]
+    if report.get('concurrent_jobs', 1) > 1:
+        lines[0] += f" (CPU y memoria del proceso, compartido por {report['concurrent_jobs']} trabajos)"
+    for name, st in sorted(report['stages'].items(), key=lambda kv: -kv[1]['wall_s']):
+        rate = ''
+        if 'windows_per_s' in st:
+            rate = f", {st['windows_per_s']:.1f} ventanas/s"
+        elif 'pixels_per_s' in st:
+            rate = f", {st['pixels_per_s'] / 1e6:.1f} Mpx/s"
+        lines.append(f"  {name}: {st['wall_s']:.1f} s ({100 * st['wall_s'] / total:.0f}%){rate}")
+    return lines
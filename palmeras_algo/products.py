@@ -0,0 +1,67 @@
+##### Productos de una corrida a partir de sus rásteres de salida ####
+#
+# Después de apply_palmeras (o de unir bandas/teselas): reporte por especie
+# y, si se piden, capas vectoriales, tablas por palmera, grilla de densidad e
+# índice espacial para consultas por polígono.
+# Todos comparten una sola lectura y etiquetado del ráster de instancias.
+# Lo usan el worker del plugin, el modo lote y la línea de comandos.
+
+import logging
+import os
+
+from . import density
+from . import instances
+from . import perf
+from . import progress as progress_mod
+from . import spatial_index
+from . import species_report
+from . import tables
+from . import vectorize
+
+logger = logging.getLogger(__name__)
+
+
+def flight_id(input_raster):
+    """Identificador del vuelo para las tablas: nombre del ortomosaico sin extensión."""
+    return os.path.splitext(os.path.basename(input_raster))[0]
+
+
+def write_products(output_raster, output_clas, counts, vector_format=None, polygons=True,
+                   table_format=None, flight=None, metrics=(), density_cell=None, index=False, progress=None):
+    """
+    Devuelve {'report', 'area_ha'} y, según lo pedido, 'vector' (capas, ver
+    vectorize.write_vectors), 'attributes' (_atributos.csv, con las capas) y
+    'table' (exportación de tables.write_table en table_format). Las capas y
+    tablas llevan además las métricas de forma de 'metrics' (instances.METRICS).
+    Con density_cell (metros), 'density' es la grilla de density.write_density
+    y con index, 'index' es el índice de spatial_index.write_index.
+    'progress' (ver progress.ProgressReporter) permite cancelar entre productos
+    y durante la poligonización.
+    """
+    result = {}
+    result['report'], result['area_ha'] = species_report.write_species_report(output_raster, output_clas, counts)
+    if not (vector_format or table_format or density_cell or index):
+        return result
+
+    with perf.appending(output_raster, 'products'):
+        progress_mod.step(progress, 'products')
+        labels, table, reference = instances.read_instances(output_raster, metrics or ())
+        if vector_format:
+            result['vector'] = vectorize.write_vectors(output_raster, labels, table, reference,
+                                                       vector_format, polygons=polygons, progress=progress)
+        del labels
+        progress_mod.step(progress, 'products')
+        with perf.stage('tables', windows=len(table['id'])):
+            if vector_format:
+                result['attributes'] = tables.write_attributes_csv(table, output_raster)
+            if table_format:
+                result['table'] = tables.write_table(table, output_raster, table_format, flight)
+        if density_cell:
+            progress_mod.step(progress, 'products')
+            with perf.stage('density', windows=len(table['id'])):
+                result['density'] = density.write_density(table, output_raster, reference, density_cell)
+        if index:
+            progress_mod.step(progress, 'products')
+            with perf.stage('spatial_index', windows=len(table['id'])):
+                result['index'] = spatial_index.write_index(table, output_raster)
+    return result
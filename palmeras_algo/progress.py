@@ -0,0 +1,86 @@
+##### Progreso por etapa y cancelación entre lotes ####
+
+import time
+
+
+class JobCancelled(Exception):
+    """La corrida fue cancelada desde QGIS."""
+
+
+class ProgressReporter:
+    """
+    Callback de progreso de las etapas: progress(stage, done, total, job=None).
+    Emite eventos {'event': 'progress', 'stage', 'done', 'total', 'rate'}
+    (rate = ventanas/s de la etapa) y, si se pidió cancelar, lanza
+    JobCancelled; las etapas lo llaman entre lotes, así el diario de ventanas
+    queda consistente y la corrida se puede reanudar.
+    """
+
+    def __init__(self, emit, is_cancelled=None):
+        self._emit = emit
+        self._is_cancelled = is_cancelled
+        self._start = {}
+
+    def __call__(self, stage, done, total, job=None):
+        if self._is_cancelled and self._is_cancelled():
+            raise JobCancelled(f"Corrida cancelada durante la etapa '{stage}'")
+        now = time.monotonic()
+        t0, done0 = self._start.setdefault((job, stage), (now, done))
+        elapsed = now - t0
+        event = {'event': 'progress', 'stage': stage, 'done': done, 'total': total,
+                 'rate': round((done - done0) / elapsed, 2) if elapsed > 0 else 0.0}
+        if job is not None:
+            event['job'] = job
+        self._emit(event)
+
+
+def step(progress, stage):
+    """
+    Punto de cancelación de un paso sin ventanas (diagnóstico, AOI,
+    postprocesamiento, productos): emite (stage, 0, 1) antes de empezarlo.
+    """
+    if progress:
+        progress(stage, 0, 1)
+
+
+class GdalCallback:
+    """
+    Callback de progreso para operaciones largas de GDAL (Rasterize,
+    Polygonize): reporta cada punto porcentual a 'progress' y, si se pidió
+    cancelar, devuelve 0 para que GDAL se detenga. run() relanza entonces
+    la JobCancelled.
+    """
+
+    def __init__(self, progress, stage, log=None):
+        self.progress = progress
+        self.stage = stage
+        self.log = log
+        self.cancelled = None
+        self._percent = -1
+
+    def __call__(self, complete, message, data):
+        percent = int(complete * 100)
+        if self.log:
+            self.log.update(percent)
+        if self.progress is None or percent == self._percent:
+            return 1
+        self._percent = percent
+        try:
+            self.progress(self.stage, percent, 100)
+        except JobCancelled as e:
+            self.cancelled = e
+            return 0
+        return 1
+
+    def run(self, function, *args, **kwargs):
+        """Llama function(*args, callback=self, **kwargs) y relanza la cancelación si la hubo."""
+        result = None
+        try:
+            result = function(*args, callback=self, **kwargs)
+        except RuntimeError:
+            # Con excepciones activadas GDAL informa la interrupción como RuntimeError
+            if self.cancelled is None:
+                raise
+        if self.cancelled is not None:
+            raise self.cancelled
+        return result
@@ -0,0 +1,101 @@
+##### Área de interés (AOI): máscara gruesa para planificar ventanas ####
+
+import logging
+import math
+import numpy as np
+from osgeo import gdal
+
+from .progress import GdalCallback
+
+# Tamaño de celda (en píxeles del ráster) de la máscara gruesa del AOI
+ROI_CELL_SIZE = 32
+
+logger = logging.getLogger(__name__)
+
+
+def rasterize_roi(roi_path, dataset, cell_size=ROI_CELL_SIZE, progress=None):
+    """
+    Rasteriza una sola vez los polígonos de 'roi_path' (en el SRC del ráster)
+    sobre una grilla gruesa alineada con 'dataset'. Devuelve un dict con la
+    máscara, el tamaño de celda y el bounding box del AOI en píxeles.
+    'progress' (ver progress.ProgressReporter) permite cancelar a mitad de
+    la rasterización.
+    """
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    gt = dataset.GetGeoTransform()
+    cols = int(math.ceil(width / float(cell_size)))
+    rows = int(math.ceil(height / float(cell_size)))
+
+    coarse = gdal.GetDriverByName('MEM').Create('', cols, rows, 1, gdal.GDT_Byte)
+    coarse.SetGeoTransform((gt[0], gt[1] * cell_size, gt[2] * cell_size,
+                            gt[3], gt[4] * cell_size, gt[5] * cell_size))
+    coarse.SetProjection(dataset.GetProjection())
+    GdalCallback(progress, 'roi').run(gdal.Rasterize, coarse, roi_path, burnValues=[1], allTouched=True)
+    mask = coarse.GetRasterBand(1).ReadAsArray() > 0
+    coarse = None
+
+    if not mask.any():
+        raise ValueError(f"El área de interés no intersecta el ráster: {roi_path}")
+
+    cell_rows = np.flatnonzero(mask.any(axis=1))
+    cell_cols = np.flatnonzero(mask.any(axis=0))
+    bbox = (int(cell_cols[0] * cell_size), int(cell_rows[0] * cell_size),
+            int(min((cell_cols[-1] + 1) * cell_size, width)),
+            int(min((cell_rows[-1] + 1) * cell_size, height)))
+
+    logger.info("AOI: %d/%d celdas de %dpx, bbox=%s", int(mask.sum()), mask.size, cell_size, bbox)
+    return {'mask': mask, 'cell': cell_size, 'bbox': bbox, 'size': (width, height)}
+
+
+def roi_window(roi, margin):
+    """Ventana de lectura (xoff, yoff, xsize, ysize) del AOI ampliada en 'margin' píxeles."""
+    x0, y0, x1, y1 = roi['bbox']
+    width, height = roi['size']
+    x0, y0 = max(x0 - margin, 0), max(y0 - margin, 0)
+    x1, y1 = min(x1 + margin, width), min(y1 + margin, height)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def region_intersects(roi, x0, y0, x1, y1):
+    """True si el rectángulo de píxeles [x0, x1) x [y0, y1) toca el AOI."""
+    if not roi:
+        return True
+    cell = roi['cell']
+    r0, c0 = max(y0, 0) // cell, max(x0, 0) // cell
+    r1, c1 = (y1 - 1) // cell + 1, (x1 - 1) // cell + 1
+    return bool(roi['mask'][r0:r1, c0:c1].any())
+
+
+def covers(roi, margin, x0=0, y0=0, x1=None, y1=None):
+    """
+    True si el AOI toca el rectángulo [x0, x1) x [y0, y1) (por defecto, todo
+    el ráster) fuera de los 'margin' píxeles junto al borde del ráster: esa
+    franja no cae en el núcleo de ninguna ventana y nunca se predice.
+    """
+    width, height = roi['size']
+    x1 = width if x1 is None else x1
+    y1 = height if y1 is None else y1
+    return region_intersects(roi, max(x0, margin), max(y0, margin),
+                             min(x1, width - margin), min(y1, height - margin))
+
+
+def require_windows(roi, window_radius, internal_window_radius):
+    """
+    Falla si el AOI no selecciona ninguna ventana de radio 'window_radius':
+    sin esta comprobación la corrida terminaría sin ventanas y con cero
+    palmeras, sin ningún aviso.
+    """
+    if not roi:
+        return
+    width, height = roi['size']
+    if min(width, height) < 2 * window_radius:
+        raise ValueError(f"El ráster ({width}x{height}) es menor que una ventana de {2 * window_radius} px")
+    margin = window_radius - internal_window_radius
+    if not covers(roi, margin):
+        raise ValueError(f"El área de interés solo toca los {margin} px junto al borde del ráster, "
+                         "que ninguna ventana cubre: no hay nada que procesar")
+
+
+def window_intersects(roi, row, col, radius):
+    """True si el cuadrado de radio 'radius' centrado en (row, col) toca el AOI."""
+    return region_intersects(roi, col - radius, row - radius, col + radius, row + radius)
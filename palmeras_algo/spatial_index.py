@@ -0,0 +1,282 @@
+##### Índice espacial de las detecciones (_indice.npz) ####
+#
+# Grilla regular sobre los centroides de la tabla de instancias: los puntos
+# se guardan ordenados por celda (fila por fila) con el desplazamiento donde
+# empieza cada celda, así que las celdas de una fila de la grilla son un
+# tramo contiguo de los arreglos, y cada celda tiene sus conteos y áreas por
+# especie ya sumados. Una consulta clasifica las celdas de la extensión del
+# polígono (classify_cells): las que cruza algún lado son de borde; las
+# demás están enteras dentro o fuera. Las de dentro suman sus totales sin
+# mirar los puntos y solo los puntos de las celdas de borde pasan por la
+# prueba punto-en-polígono: el costo sigue al perímetro del polígono, no a
+# su área ni al total de detecciones, y sin volver a procesar imágenes.
+#
+# El tamaño de celda se elige para que haya unas TARGET_PER_CELL palmeras por
+# celda en promedio. El índice queda en las unidades del ráster de salida:
+# los polígonos se deben reproyectar a su SRC antes de consultar.
+
+import functools
+import logging
+import math
+import os
+
+import numpy as np
+
+from . import instances
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '_indice.npz'
+TARGET_PER_CELL = 16
+# Orden de las especies en conteos y áreas (el de instances.SPECIES)
+CODES = tuple(instances.SPECIES)
+
+
+def index_path(output_raster):
+    return os.path.splitext(output_raster)[0] + INDEX_SUFFIX
+
+
+def points_in_rings(x, y, rings):
+    """
+    Máscara de los puntos (x, y) dentro de los anillos (arreglos n x 2) por
+    la regla par-impar: sirve para polígonos con huecos y multipolígonos.
+    """
+    inside = np.zeros(len(x), dtype=bool)
+    for ring in rings:
+        x1, y1 = ring[:-1, 0], ring[:-1, 1]
+        x2, y2 = ring[1:, 0], ring[1:, 1]
+        # Un bucle por lado, vectorizado sobre los puntos
+        for ax, ay, bx, by in zip(x1.tolist(), y1.tolist(), x2.tolist(), y2.tolist()):
+            crosses = (ay > y) != (by > y)
+            if not crosses.any():
+                continue
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_cross = ax + (y - ay) * (bx - ax) / (by - ay)
+            inside ^= crosses & (x < x_cross)
+    return inside
+
+
+def classify_cells(rings, origin, cell_size, rows, cols):
+    """
+    Clasifica las celdas de las filas rows = (r0, r1) y columnas cols = (c0, c1)
+    (inclusive) de una grilla con esquina 'origin' respecto del polígono de
+    'rings'. Devuelve (borde, dentro), máscaras filas x columnas: una celda
+    de borde la toca algún lado (con un margen, así nunca falta una); las
+    demás están enteras dentro o fuera, según la paridad de su centro.
+    Una pasada por fila, vectorizada sobre los lados.
+    """
+    (r0, r1), (c0, c1) = rows, cols
+    n_cols = c1 - c0 + 1
+    edges = np.concatenate([np.hstack([ring[:-1], ring[1:]]) for ring in rings])
+    ax, ay, bx, by = edges.T
+    dx, dy = bx - ax, by - ay
+    y_low, y_high = np.minimum(ay, by), np.maximum(ay, by)
+    flat = dy == 0
+    eps = cell_size * 1e-6
+    centers = origin[0] + (np.arange(c0, c1 + 1) + 0.5) * cell_size
+    boundary = np.zeros((r1 - r0 + 1, n_cols), dtype=bool)
+    inside = np.zeros_like(boundary)
+    for i, r in enumerate(range(r0, r1 + 1)):
+        # Tramo de cada lado dentro de la franja de la fila y columnas que abarca
+        band0 = origin[1] + r * cell_size - eps
+        band1 = band0 + cell_size + 2 * eps
+        touch = (y_high >= band0) & (y_low <= band1)
+        if touch.any():
+            lo = np.maximum(y_low[touch], band0)
+            hi = np.minimum(y_high[touch], band1)
+            e_ax, e_ay, e_dx, e_dy = ax[touch], ay[touch], dx[touch], dy[touch]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                x_lo = np.where(flat[touch], e_ax, e_ax + (lo - e_ay) * e_dx / e_dy)
+                x_hi = np.where(flat[touch], e_ax + e_dx, e_ax + (hi - e_ay) * e_dx / e_dy)
+            first = np.floor((np.minimum(x_lo, x_hi) - eps - origin[0]) / cell_size).astype(np.int64) - c0
+            last = np.floor((np.maximum(x_lo, x_hi) + eps - origin[0]) / cell_size).astype(np.int64) - c0
+            keep = (last >= 0) & (first < n_cols)
+            marks = np.zeros(n_cols + 1, dtype=np.int64)
+            np.add.at(marks, np.clip(first[keep], 0, n_cols), 1)
+            np.add.at(marks, np.clip(last[keep] + 1, 0, n_cols), -1)
+            boundary[i] = np.cumsum(marks[:-1]) > 0
+        # Paridad de los centros: cruces de los lados con la horizontal del centro a su derecha
+        y_center = origin[1] + (r + 0.5) * cell_size
+        crosses = (ay > y_center) != (by > y_center)
+        x_cross = np.sort(ax[crosses] + (y_center - ay[crosses]) * dx[crosses] / dy[crosses])
+        inside[i] = (len(x_cross) - np.searchsorted(x_cross, centers, side='right')) % 2 == 1
+    return boundary, inside
+
+
+class SpatialIndex:
+    """
+    Centroides, especie y área de copa de cada palmera, ordenados por celda
+    de la grilla. 'offsets[c]' es la posición del primer punto de la celda c;
+    'cell_counts' y 'cell_areas' (celdas x especies) se suman al crearlo.
+    """
+
+    def __init__(self, x, y, species, area_m2, ids, origin, cell_size, shape, offsets):
+        self.x = x
+        self.y = y
+        self.species = species
+        self.area_m2 = area_m2
+        self.ids = ids
+        self.origin = origin
+        self.cell_size = cell_size
+        self.shape = shape
+        self.offsets = offsets
+        n_cells = len(offsets) - 1
+        cell = np.repeat(np.arange(n_cells), np.diff(offsets)) * len(CODES) + species
+        self.cell_counts = np.bincount(cell, minlength=n_cells * len(CODES)).reshape(n_cells, len(CODES))
+        self.cell_areas = np.bincount(cell, weights=area_m2,
+                                      minlength=n_cells * len(CODES)).reshape(n_cells, len(CODES))
+
+    @classmethod
+    def build(cls, table):
+        """Índice de una tabla de instances.instance_table."""
+        x, y = table['x'], table['y']
+        n = len(x)
+        if n:
+            x0, y0 = float(x.min()), float(y.min())
+            width, height = float(x.max()) - x0, float(y.max()) - y0
+        else:
+            x0 = y0 = width = height = 0.0
+        cell_size = math.sqrt(width * height * TARGET_PER_CELL / max(n, 1)) or max(width, height, 1.0)
+        n_rows, n_cols = int(height // cell_size) + 1, int(width // cell_size) + 1
+        cells = cls._cells(x, y, (x0, y0), cell_size, n_cols)
+        order = np.argsort(cells, kind='stable')
+        offsets = np.zeros(n_rows * n_cols + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=n_rows * n_cols), out=offsets[1:])
+        species = np.searchsorted(CODES, table['clase']).astype(np.int8)
+        return cls(x[order], y[order], species[order], table['area_m2'][order].astype(np.float64),
+                   table['id'][order], (x0, y0), cell_size, (n_rows, n_cols), offsets)
+
+    @staticmethod
+    def _cells(x, y, origin, cell_size, n_cols):
+        col = ((x - origin[0]) // cell_size).astype(np.int64)
+        row = ((y - origin[1]) // cell_size).astype(np.int64)
+        return row * n_cols + col
+
+    def save(self, path):
+        np.savez(path, x=self.x, y=self.y, species=self.species, area_m2=self.area_m2, ids=self.ids,
+                 origin=np.array(self.origin), cell_size=np.array(self.cell_size),
+                 shape=np.array(self.shape), offsets=self.offsets)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['x'], data['y'], data['species'], data['area_m2'], data['ids'],
+                       tuple(data['origin'].tolist()), float(data['cell_size']),
+                       tuple(data['shape'].tolist()), data['offsets'])
+
+    def cell_range(self, xmin, ymin, xmax, ymax):
+        """Filas (r0, r1) y columnas (c0, c1) de las celdas que tocan la extensión dada, o None."""
+        n_rows, n_cols = self.shape
+        c0 = max(int((xmin - self.origin[0]) // self.cell_size), 0)
+        c1 = min(int((xmax - self.origin[0]) // self.cell_size), n_cols - 1)
+        r0 = max(int((ymin - self.origin[1]) // self.cell_size), 0)
+        r1 = min(int((ymax - self.origin[1]) // self.cell_size), n_rows - 1)
+        if c0 > c1 or r0 > r1:
+            return None
+        return (r0, r1), (c0, c1)
+
+    def candidates(self, xmin, ymin, xmax, ymax):
+        """Posiciones de los puntos en las celdas que tocan la extensión dada."""
+        cells = self.cell_range(xmin, ymin, xmax, ymax)
+        if cells is None:
+            return np.zeros(0, dtype=np.int64)
+        (r0, r1), (c0, c1) = cells
+        n_cols = self.shape[1]
+        # Las celdas c0..c1 de una fila son un solo tramo de los arreglos
+        ranges = [(self.offsets[r * n_cols + c0], self.offsets[r * n_cols + c1 + 1]) for r in range(r0, r1 + 1)]
+        return np.concatenate([np.arange(start, end) for start, end in ranges])
+
+    def points_in_cells(self, cells):
+        """Posiciones de los puntos de las celdas 'cells' (índices planos)."""
+        starts = self.offsets[cells]
+        lengths = self.offsets[cells + 1] - starts
+        ends = np.cumsum(lengths)
+        if not len(ends) or not ends[-1]:
+            return np.zeros(0, dtype=np.int64)
+        return np.arange(ends[-1]) + np.repeat(starts - (ends - lengths), lengths)
+
+    def query(self, rings):
+        """
+        Palmeras dentro del polígono formado por 'rings'. Devuelve (conteos,
+        áreas de copa en m2), cada uno en el orden de CODES.
+        """
+        counts = np.zeros(len(CODES), dtype=np.int64)
+        areas = np.zeros(len(CODES))
+        if not rings:
+            return counts, areas
+        points = np.concatenate(rings)
+        (xmin, ymin), (xmax, ymax) = points.min(axis=0), points.max(axis=0)
+        cells = self.cell_range(xmin, ymin, xmax, ymax)
+        if cells is None:
+            return counts, areas
+        boundary, inside = classify_cells(rings, self.origin, self.cell_size, *cells)
+        (r0, r1), (c0, c1) = cells
+        grid = (np.arange(r0, r1 + 1)[:, None] * self.shape[1] + np.arange(c0, c1 + 1)).ravel()
+        # Celdas enteras dentro: sus totales, sin mirar los puntos
+        inner = grid[(inside & ~boundary).ravel()]
+        counts += self.cell_counts[inner].sum(axis=0)
+        areas += self.cell_areas[inner].sum(axis=0)
+        # Celdas de borde: punto por punto
+        candidates = self.points_in_cells(grid[boundary.ravel()])
+        if len(candidates):
+            hits = candidates[points_in_rings(self.x[candidates], self.y[candidates], rings)]
+            counts += np.bincount(self.species[hits], minlength=len(CODES))
+            areas += np.bincount(self.species[hits], weights=self.area_m2[hits], minlength=len(CODES))
+        return counts, areas
+
+
+def write_index(table, output_raster):
+    """Escribe el índice de la tabla de instancias junto a 'output_raster'. Devuelve la ruta."""
+    path = SpatialIndex.build(table).save(index_path(output_raster))
+    logger.info("Índice espacial: %s", path)
+    return path
+
+
+@functools.lru_cache(maxsize=4)
+def _load_cached(path, mtime_ns):
+    return SpatialIndex.load(path)
+
+
+def open_index(output_raster):
+    """
+    Índice de una corrida. Queda en memoria mientras el archivo no cambie, así
+    que las consultas repetidas en el worker no lo vuelven a leer.
+    """
+    path = index_path(output_raster)
+    if not os.path.exists(path):
+        raise IOError(f"No existe el índice espacial {path}: vuelva a correr la detección con el índice activado")
+    return _load_cached(path, os.stat(path).st_mtime_ns)
+
+
+def _rings(geometry):
+    """Anillos (arreglos n x 2) de una geometría OGR de polígonos."""
+    if geometry.GetGeometryCount() == 0:
+        points = geometry.GetPoints() or []
+        return [np.array(points, dtype=np.float64)[:, :2]] if len(points) > 3 else []
+    rings = []
+    for i in range(geometry.GetGeometryCount()):
+        rings += _rings(geometry.GetGeometryRef(i))
+    return rings
+
+
+def query_layer(output_raster, polygons):
+    """
+    Conteos y áreas de copa por especie dentro de cada polígono de la capa
+    'polygons' (ya en el SRC del ráster). Devuelve una lista de
+    {'fid', 'counts', 'area_m2'} en el orden de la capa.
+    """
+    from osgeo import ogr
+    index = open_index(output_raster)
+    datasource = ogr.Open(polygons)
+    if datasource is None:
+        raise IOError(f"No se pudo abrir {polygons}")
+    layer = datasource.GetLayer(0)
+    results = []
+    for feature in layer:
+        geometry = feature.GetGeometryRef()
+        rings = _rings(geometry.GetLinearGeometry()) if geometry is not None else []
+        counts, areas = index.query(rings)
+        results.append({'fid': feature.GetFID(), 'counts': counts.tolist(), 'area_m2': areas.tolist()})
+    datasource = None
+    return results
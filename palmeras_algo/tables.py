@@ -0,0 +1,98 @@
+##### Tabla de atributos por palmera: CSV del plugin y exportación columnar ####
+#
+# Se escriben de una vez desde las columnas de instances.instance_table, sin
+# recorrer capas vectoriales:
+#   _atributos.csv      columnas de siempre (ID, CLASE, ESPECIE, ÁREA(m2)...)
+#   _instancias.parquet columnas tipadas para pandas/DuckDB (pyarrow)
+#   _instancias.csv     lo mismo en CSV, si se pide o si falta pyarrow
+# flight_id identifica el vuelo (por defecto, el nombre del ortomosaico) para
+# poder juntar las tablas de muchos vuelos. Las métricas de forma pedidas
+# (instances.METRICS) van al final, en ambas tablas.
+
+import csv
+import logging
+import os
+
+import numpy as np
+
+from . import instances
+
+logger = logging.getLogger(__name__)
+
+ATTRIBUTES_SUFFIX = '_atributos.csv'
+TABLE_SUFFIX = '_instancias'
+TABLE_FORMATS = ('parquet', 'csv')
+ATTRIBUTE_FIELDS = ['ID', 'CLASE', 'ESPECIE', 'ÁREA(m2)', 'UTM(ESTE)', 'UTM(NORTE)']
+
+
+def attributes_path(output_raster):
+    return os.path.splitext(output_raster)[0] + ATTRIBUTES_SUFFIX
+
+
+def species_column(classes):
+    return [instances.SPECIES.get(code) for code in classes.tolist()]
+
+
+def columns(table, flight_id=None):
+    """Columnas tipadas de la exportación, en orden (nombre -> arreglo o lista)."""
+    n = len(table['id'])
+    cols = {
+        'flight_id': [flight_id] * n,
+        'id': table['id'].astype(np.int64),
+        'clase': table['clase'].astype(np.int16),
+        'especie': species_column(table['clase']),
+        'area_m2': table['area_m2'].astype(np.float64),
+        'easting': table['x'].astype(np.float64),
+        'northing': table['y'].astype(np.float64),
+    }
+    for column in instances.metric_columns(table):
+        cols[column] = table[column].astype(np.float64)
+    return cols
+
+
+def _write_csv(path, header, cols):
+    with open(path, 'w', newline='', encoding='utf-8') as fh:
+        writer = csv.writer(fh)
+        writer.writerow(header)
+        writer.writerows(zip(*[c.tolist() if isinstance(c, np.ndarray) else c for c in cols]))
+    return path
+
+
+def write_attributes_csv(table, output_raster):
+    """_atributos.csv con las columnas que escribía el plugin desde QGIS."""
+    metrics = instances.metric_columns(table)
+    cols = [table['id'], table['clase'], species_column(table['clase']),
+            table['area_m2'], table['x'], table['y']] + [table[column] for column in metrics]
+    header = ATTRIBUTE_FIELDS + [instances.METRIC_FIELDS[column] for column in metrics]
+    return _write_csv(attributes_path(output_raster), header, cols)
+
+
+def write_parquet(path, cols):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    arrays = {}
+    for name, values in cols.items():
+        if isinstance(values, np.ndarray):
+            arrays[name] = pa.array(values)
+        else:
+            # Texto repetido (vuelo, especie): diccionario, ocupa casi nada
+            arrays[name] = pa.array(values, type=pa.string()).dictionary_encode()
+    pq.write_table(pa.table(arrays), path, compression='zstd')
+    return path
+
+
+def write_table(table, output_raster, fmt='parquet', flight_id=None):
+    """
+    Exporta la tabla de instancias junto a 'output_raster' en 'fmt'
+    (parquet o csv). Sin pyarrow, parquet se escribe como CSV. Devuelve la ruta.
+    """
+    if fmt not in TABLE_FORMATS:
+        raise ValueError(f"Formato de tabla desconocido: {fmt} (use {', '.join(TABLE_FORMATS)})")
+    cols = columns(table, flight_id)
+    stem = os.path.splitext(output_raster)[0] + TABLE_SUFFIX
+    if fmt == 'parquet':
+        try:
+            return write_parquet(stem + '.parquet', cols)
+        except ImportError:
+            logger.warning("pyarrow no está instalado: la tabla se escribe en CSV")
+    return _write_csv(stem + '.csv', list(cols), list(cols.values()))
@@ -0,0 +1,164 @@
+##### Caché en disco de predicciones por ventana (direccionada por contenido) ####
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import numpy as np
+
+# Desactivada por defecto: se activa con PALMERAS_TILE_CACHE_MB o cache_max_mb
+DEFAULT_MAX_MB = 0
+SIZE_FILE = 'size.json'
+
+_model_hashes = {}
+_lock = threading.Lock()
+
+
+def default_cache_dir():
+    """Carpeta por defecto: PALMERAS_TILE_CACHE o la caché de usuario del sistema."""
+    env = os.environ.get('PALMERAS_TILE_CACHE')
+    if env:
+        return env
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') \
+        or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'palmscnn', 'tiles')
+
+
+def default_max_mb():
+    """Tamaño máximo por defecto (PALMERAS_TILE_CACHE_MB; 0, el valor por defecto, la desactiva)."""
+    return int(os.environ.get('PALMERAS_TILE_CACHE_MB', DEFAULT_MAX_MB))
+
+
+def model_sha256(model_path):
+    """SHA-256 del modelo, calculado una vez por proceso (y por versión del archivo)."""
+    st = os.stat(model_path)
+    stamp = (os.path.abspath(model_path), st.st_size, st.st_mtime)
+    with _lock:
+        if stamp not in _model_hashes:
+            h = hashlib.sha256()
+            with open(model_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    h.update(chunk)
+            _model_hashes[stamp] = h.hexdigest()
+        return _model_hashes[stamp]
+
+
+class TileCache:
+    """
+    Salidas del modelo por ventana guardadas como .npy bajo la clave
+    sha256(modelo, parámetros de preprocesamiento, píxeles de la ventana).
+    Tamaño acotado con desalojo LRU (se usa la fecha de modificación como
+    último acceso; un acierto la actualiza).
+
+    El tamaño ocupado se lleva en SIZE_FILE para no recorrer la carpeta cada
+    vez que se crea una caché. Varios procesos pueden perder alguna
+    actualización del contador entre sí; el desalojo recorre la carpeta y
+    lo vuelve a dejar exacto.
+    """
+
+    def __init__(self, model_path, params, cache_dir=None, max_mb=None):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = int((default_max_mb() if max_mb is None else max_mb) * 1024 * 1024)
+        prefix = hashlib.sha256(model_sha256(model_path).encode())
+        prefix.update(json.dumps(params, sort_keys=True).encode())
+        self._prefix = prefix
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._size = self._read_size()
+        if self._size is None:
+            self._write_size(sum(size for _, size, _ in self._entries()))
+        self.hits = 0
+        self.misses = 0
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npy'):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def _size_path(self):
+        return os.path.join(self.cache_dir, SIZE_FILE)
+
+    def _read_size(self):
+        try:
+            with open(self._size_path(), encoding='utf-8') as f:
+                return int(json.load(f)['bytes'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_size(self, size):
+        self._size = max(int(size), 0)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'bytes': self._size}, f)
+        os.replace(tmp, self._size_path())
+
+    def _add_size(self, delta):
+        # Se parte del valor en disco para sumar lo que agregaron otros procesos
+        current = self._read_size()
+        self._write_size((self._size if current is None else current) + delta)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npy')
+
+    def key(self, *arrays):
+        h = self._prefix.copy()
+        for a in arrays:
+            a = np.ascontiguousarray(a)
+            h.update(f"{a.dtype.str}{a.shape}".encode())
+            h.update(a.data)
+        return h.hexdigest()
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            value = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, array):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, array)
+        try:
+            old_size = os.path.getsize(path)  # sobrescritura: no se cuenta dos veces
+        except OSError:
+            old_size = 0
+        os.replace(tmp, path)  # atómico: otro proceso nunca ve un .npy a medias
+        self._add_size(os.path.getsize(path) - old_size)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """Borra las entradas menos usadas hasta quedar en el 90% del máximo."""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        size = sum(entry_size for _, entry_size, _ in entries)
+        target = self.max_bytes * 0.9
+        for path, entry_size, _ in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                size -= entry_size
+            except OSError:
+                pass
+        self._write_size(size)
+
+
+def create_cache(model_path, params, cache_dir=None, max_mb=None):
+    """TileCache lista para usar, o None si la caché está desactivada (max_mb=0, por defecto)."""
+    max_mb = default_max_mb() if max_mb is None else max_mb
+    if max_mb <= 0:
+        return None
+    return TileCache(model_path, params, cache_dir=cache_dir, max_mb=max_mb)
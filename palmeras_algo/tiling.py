@@ -0,0 +1,311 @@
+##### Modo particionado: un ráster grande en bandas horizontales, una por proceso ####
+
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+
+import numpy as np
+from osgeo import gdal
+from skimage.measure import label
+
+from . import apply_model
+from . import checkpoint
+from . import gdal_io
+from . import memory
+from . import palmeras_deteccion
+from . import perf
+from . import roi as roi_mod
+from .apply_model_dwt import CLASS_TO_CITYSCAPES
+from .log import configure_logging
+
+# Halo para los radios de ventana por defecto (ver palmeras_deteccion.band_halo):
+# cada fila del núcleo de una banda cae en una ventana completa, con máscara
+# semántica debajo. La grilla de ventanas arranca en el borde de cada banda,
+# así que las predicciones pueden diferir un poco de las del ráster completo.
+DEFAULT_HALO = palmeras_deteccion.band_halo()
+# Cada cuánto (s) se revisan las bandas en curso y la cancelación
+POLL_SECONDS = 1.0
+
+logger = logging.getLogger(__name__)
+
+_band_sessions = None
+
+
+def split_axis(length, n_parts, halo=DEFAULT_HALO):
+    """
+    Divide 'length' píxeles en tramos [(a0, a1, r0, r1)]: [a0, a1) es el núcleo
+    que aporta cada tramo al resultado y [r0, r1) lo que lee (núcleo + halo).
+    Cada núcleo tiene al menos 'halo' píxeles.
+    """
+    n_parts = max(1, min(int(n_parts), length // max(1, halo)))
+    edges = np.linspace(0, length, n_parts + 1).round().astype(int)
+    return [(int(a0), int(a1), max(0, int(a0) - halo), min(length, int(a1) + halo))
+            for a0, a1 in zip(edges[:-1], edges[1:])]
+
+
+def plan_bands(height, n_bands, halo=DEFAULT_HALO):
+    """Bandas horizontales [(y0, y1, r0, r1)] que cubren 'height' filas."""
+    return split_axis(height, n_bands, halo)
+
+
+def init_band_worker(threads, cache_mb):
+    # Cada proceso con su parte de los núcleos y de la caché de GDAL
+    configure_logging()
+    gdal.SetConfigOption('GDAL_CACHEMAX', str(cache_mb))
+    gdal.SetConfigOption('GDAL_NUM_THREADS', str(threads))
+
+
+def _run_band(band):
+    """Corre el pipeline completo sobre una banda (en un proceso hijo)."""
+    global _band_sessions
+    if _band_sessions is None:
+        _band_sessions = palmeras_deteccion.load_sessions(intra_op_num_threads=band['threads'])
+    out_raster, out_raster_clas, _, _, _ = palmeras_deteccion.apply_palmeras(
+        band['input'], band['output'],
+        INPUT_ROI=band['roi'],
+        sessions=_band_sessions,
+        resume=band['resume'],
+        **band['options']
+    )
+    return out_raster, out_raster_clas
+
+
+class UnionFind:
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, x):
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        """Une los conjuntos de a y b; True si eran distintos."""
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return False
+        self.parent[ra] = rb
+        return True
+
+
+def seam_pairs(upper, lower):
+    """Pares (etiqueta de arriba, etiqueta de abajo) vecinos-8 a través de una costura."""
+    pairs = set()
+    n = len(upper)
+    for shift in (-1, 0, 1):
+        a = upper[max(0, shift):n + min(0, shift)]
+        b = lower[max(0, -shift):n + min(0, -shift)]
+        m = (a > 0) & (b > 0)
+        pairs.update(zip(a[m].tolist(), b[m].tolist()))
+    return pairs
+
+
+def create_like(reference, path, gdal_type, nodata):
+    gdal_io.release_dataset(path)
+    dataset = gdal.GetDriverByName('GTiff').Create(path, reference.RasterXSize, reference.RasterYSize, 1, gdal_type,
+                                                   options=['TILED=YES', 'BIGTIFF=IF_SAFER'])
+    dataset.SetGeoTransform(reference.GetGeoTransform())
+    dataset.SetProjection(reference.GetProjection())
+    dataset.GetRasterBand(1).SetNoDataValue(nodata)
+    return dataset
+
+
+def stitch_bands(dataset, bands, results, output_raster, output_clas):
+    """
+    Escribe los núcleos de las bandas terminadas ('results', None en las que
+    quedaron fuera del AOI) en los rásteres de instancias y de clases del
+    tamaño de 'dataset'. Las bandas sin resultado se rellenan con 0, el mismo
+    fondo que apply_palmeras deja fuera del AOI. Devuelve el SeamCounter.
+    """
+    width = dataset.RasterXSize
+    out_ds = create_like(dataset, output_raster, gdal.GDT_Float32, -9999)
+    clas_ds = create_like(dataset, output_clas, gdal.GDT_Byte, 0)
+    counter = SeamCounter()
+    prev_active = False
+    for i, (y0, y1, r0, r1) in enumerate(bands):
+        if results[i] is None:
+            out_ds.GetRasterBand(1).WriteArray(np.zeros((y1 - y0, width), dtype=np.float32), 0, y0)
+            prev_active = False
+            continue
+        band_ds = gdal.Open(results[i][0])
+        instances = band_ds.GetRasterBand(1).ReadAsArray(0, y0 - r0, width, y1 - y0)
+        clas = gdal.Open(results[i][1]).GetRasterBand(1).ReadAsArray(0, y0 - r0, width, y1 - y0)
+        band_ds = None
+        out_ds.GetRasterBand(1).WriteArray(instances, 0, y0)
+        clas_ds.GetRasterBand(1).WriteArray(clas, 0, y0)
+        counter.add(instances, adjacent=prev_active)
+        prev_active = True
+    out_ds.GetRasterBand(1).ComputeStatistics(False)
+    out_ds = clas_ds = None
+    return counter
+
+
+class SeamCounter:
+    """
+    Cuenta instancias (componentes 8-conexas por clase) de un ráster armado
+    por franjas, sin tenerlo completo en memoria: cada franja se etiqueta por
+    separado y las componentes que se tocan a través de una costura se unen.
+    """
+
+    def __init__(self):
+        self.counts = {name: 0 for name in CLASS_TO_CITYSCAPES}
+        self._uf = UnionFind()
+        self._prev = None
+        self._strip = 0
+
+    def add(self, instances, adjacent=True):
+        """Agrega la siguiente franja; adjacent=False si no continúa a la anterior."""
+        bottom = {}
+        for name, code in CLASS_TO_CITYSCAPES.items():
+            labels, n = label(instances == code, connectivity=2, return_num=True)
+            self.counts[name] += n
+            if adjacent and self._prev is not None:
+                for a, b in seam_pairs(self._prev[name], labels[0]):
+                    if self._uf.union((self._strip - 1, name, a), (self._strip, name, b)):
+                        self.counts[name] -= 1
+            bottom[name] = labels[-1]
+        self._prev = bottom
+        self._strip += 1
+
+
+def apply_palmeras_sharded(INPUT_RASTER, OUTPUT_RASTER, INPUT_ROI=None, n_bands=None, max_workers=None,
+                           halo=None, resume=True, progress=None, max_memory_mb=None, **options):
+    """
+    apply_palmeras sobre 'n_bands' bandas horizontales con halo, cada una en un
+    proceso con su propia sesión ONNX y su parte de los núcleos. Los núcleos de
+    las bandas se cosen en los rásteres de salida y las instancias se cuentan
+    uniendo las que cruzan las costuras. 'options' se pasan a apply_palmeras
+    en cada banda; 'threads' (hilos de ONNX Runtime por banda) reemplaza el
+    reparto de los núcleos entre los procesos.
+    Todas las bandas se normalizan con los percentiles del ráster completo
+    (apply_model.normalization_stats) y el halo (por defecto band_halo de los
+    radios de ventana) les da el contexto completo de cada ventana; solo la
+    grilla de ventanas, que arranca en cada banda, difiere de apply_palmeras.
+    Con max_memory_mb, las bandas, los procesos y el lote que no se indiquen
+    se eligen para que la corrida quepa en ese presupuesto (memory.plan_budget).
+    """
+    cpus = os.cpu_count() or 1
+    threads = options.pop('threads', 0)
+    dataset = gdal_io.open_dataset(INPUT_RASTER)
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    radii = options.get('window_radius', 256), options.get('window_radius_instances', 350)
+    halo = halo or palmeras_deteccion.band_halo(*radii)
+    cache_mb = gdal_io.DEFAULT_CACHE_MB
+    if max_memory_mb:
+        budget = memory.plan_budget(width, height, max_memory_mb,
+                                    window_radius=radii[0], window_radius_instances=radii[1],
+                                    halo=halo, max_workers=max_workers)
+        n_bands = n_bands or budget['n_bands']
+        max_workers = budget['max_workers']
+        cache_mb = budget['gdal_cache_mb']
+        options['batch_size'] = options.get('batch_size') or budget['batch_size']
+    max_workers = max(1, int(max_workers or max(1, cpus // 4)))
+    bands = plan_bands(height, n_bands or max_workers, halo)
+    if len(bands) == 1:
+        return palmeras_deteccion.apply_palmeras(INPUT_RASTER, OUTPUT_RASTER, INPUT_ROI=INPUT_ROI,
+                                                 resume=resume, progress=progress, threads=threads,
+                                                 max_memory_mb=max_memory_mb, **options)
+    max_workers = min(max_workers, len(bands))
+    threads = threads or max(1, cpus // max_workers)
+    cache_mb = max(16 if max_memory_mb else 64, cache_mb // max_workers)
+    if max_memory_mb:
+        # Cada banda vigila su parte del presupuesto
+        options['max_memory_mb'] = max_memory_mb // max_workers
+    logger.info("=== PARTICIONADO: %d bandas, %d procesos x %d hilos ===", len(bands), max_workers, threads)
+
+    # Bandas que no tocan el AOI (fuera del borde que ninguna ventana cubre) no se procesan
+    roi = roi_mod.rasterize_roi(INPUT_ROI, dataset, progress=progress) if INPUT_ROI else None
+    palmeras_deteccion.require_roi_windows(roi, *radii)
+    margin = palmeras_deteccion.window_margin(*radii)
+    active = [not roi or roi_mod.covers(roi, margin, 0, y0, width, y1) for y0, y1, _, _ in bands]
+
+    # Percentiles de normalización del ráster completo (o del recorte del AOI,
+    # como en apply_palmeras), iguales para todas las bandas
+    if not options.get('norm_stats'):
+        read_window = roi_mod.roi_window(roi, radii[0]) if roi else None
+        options['norm_stats'] = apply_model.normalization_stats(INPUT_RASTER, window=read_window)
+
+    out_dir = os.path.dirname(OUTPUT_RASTER) or '.'
+    bands_dir = os.path.join(out_dir, os.path.splitext(os.path.basename(OUTPUT_RASTER))[0] + '_bands')
+    signature = checkpoint.job_signature('bands', [INPUT_RASTER], palmeras_deteccion.MODEL_INSTANCES,
+                                         roi=roi, bands=bands, halo=halo, norm_stats=options['norm_stats'])
+    manifest = os.path.join(bands_dir, 'bands.json')
+    previous = None
+    if resume and os.path.exists(manifest):
+        with open(manifest) as fh:
+            previous = json.load(fh)
+    if previous != signature:
+        shutil.rmtree(bands_dir, ignore_errors=True)
+    os.makedirs(bands_dir, exist_ok=True)
+    with open(manifest, 'w') as fh:
+        json.dump(signature, fh)
+
+    jobs = {}
+    results = [None] * len(bands)
+    for i, (y0, y1, r0, r1) in enumerate(bands):
+        if not active[i]:
+            continue
+        band_input = os.path.join(bands_dir, f'band_{i:03d}.vrt')
+        band_output = os.path.join(bands_dir, f'band_{i:03d}.tif')
+        band_clas = os.path.splitext(band_output)[0] + '_clas.tif'
+        if os.path.exists(band_output) and os.path.exists(band_clas):
+            results[i] = (band_output, band_clas)  # terminada en una corrida anterior
+            continue
+        gdal.Translate(band_input, INPUT_RASTER, format='VRT', srcWin=[0, r0, width, r1 - r0])
+        jobs[i] = {'input': band_input, 'output': band_output, 'roi': INPUT_ROI,
+                   'threads': threads, 'resume': resume, 'options': options}
+
+    recorder = perf.PerfRecorder(os.path.basename(INPUT_RASTER))
+    done = len(bands) - len(jobs)
+    if progress:
+        progress('bands', done, len(bands))
+    if jobs:
+        with recorder.stage('bands', windows=len(jobs)):
+            pool = multiprocessing.get_context('spawn').Pool(max_workers, initializer=init_band_worker,
+                                                             initargs=(threads, cache_mb))
+            try:
+                pending = {i: pool.apply_async(_run_band, (job,)) for i, job in jobs.items()}
+                while pending:
+                    for i in [i for i, result in pending.items() if result.ready()]:
+                        results[i] = pending.pop(i).get()
+                        done += 1
+                        logger.info("=== PARTICIONADO: banda %d lista (%d/%d) ===", i, done, len(bands))
+                    # También mientras las bandas corren: así se ve la cancelación
+                    if progress:
+                        progress('bands', done, len(bands))
+                    if pending:
+                        next(iter(pending.values())).wait(POLL_SECONDS)
+                pool.close()
+            except BaseException:
+                # Cancelación o error: las bandas en curso se detienen; sus diarios permiten reanudarlas
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+    # Coser los núcleos y contar instancias a través de las costuras
+    OUTPUT_RASTER_CLAS = os.path.splitext(OUTPUT_RASTER)[0] + '_clas.tif'
+    with recorder.stage('stitch', pixels=width * height):
+        counter = stitch_bands(dataset, bands, results, OUTPUT_RASTER, OUTPUT_RASTER_CLAS)
+
+    # Etapas de las bandas sumadas entre procesos (sus reportes están en bands_dir)
+    for result in results:
+        band_report = perf.report_path(result[0]) if result else None
+        if band_report and os.path.exists(band_report):
+            for name, st in perf.read_report(band_report)['stages'].items():
+                recorder.add('bands.' + name, st['wall_s'], st['cpu_s'], st['pixels'], st['windows'], st['calls'])
+    perf.write_report(recorder.report(), perf.report_path(OUTPUT_RASTER))
+
+    gdal_io.close_datasets()
+    shutil.rmtree(bands_dir, ignore_errors=True)
+
+    mau, eut, oeno = (counter.counts[k] for k in ('mauritia', 'euterpe', 'oenocarpus'))
+    logger.info("=== RESULTADOS FINALES (particionado) ===")
+    logger.info("Mauritia flexuosa: %d palmeras", mau)
+    logger.info("Euterpe precatoria: %d palmeras", eut)
+    logger.info("Oenocarpus bataua: %d palmeras", oeno)
+    return OUTPUT_RASTER, OUTPUT_RASTER_CLAS, mau, eut, oeno
@@ -0,0 +1,205 @@
+##### Capas vectoriales de salida: copas y centroides ####
+#
+# Las palmeras salen de la tabla de instancias (instances.py): cada una con
+# su id, clase, área y centro de masa calculados del ráster etiquetado. Los
+# centroides se escriben directamente de esa tabla; los polígonos, con
+# gdal.Polygonize sobre el ráster de etiquetas usando el mismo ráster como
+# máscara: solo se vectorizan las palmeras (ni fondo ni nodata, que antes
+# había que reparar y borrar en QGIS) y cada polígono trae su id, con el que
+# toma los atributos de la tabla sin calcular nada sobre la geometría. Las
+# métricas de forma que traiga la tabla (instances.METRICS) se agregan como
+# campos después de los de siempre.
+#
+# Cada capa se escribe dentro de una transacción. Formatos:
+#   SHP   _poly.shp y _centroides.shp (los de siempre, con sus nombres de campo)
+#   GPKG  un solo _vector.gpkg con las capas poligonos, centroides y atributos
+#   FGB   _poly.fgb y _centroides.fgb
+# GeoPackage y FlatGeobuf se escriben con índice espacial.
+
+import logging
+import os
+
+from osgeo import gdal, ogr, osr
+
+from . import instances
+from . import perf
+from .log import ProgressLog
+from .progress import GdalCallback
+
+logger = logging.getLogger(__name__)
+
+FIELD = 'ID'
+# formato -> (driver OGR, extensión, opciones de creación de capa)
+FORMATS = {
+    'SHP': ('ESRI Shapefile', '.shp', ['ENCODING=UTF-8']),
+    'GPKG': ('GPKG', '.gpkg', ['SPATIAL_INDEX=YES']),
+    'FGB': ('FlatGeobuf', '.fgb', ['SPATIAL_INDEX=YES']),
+}
+DEFAULT_FORMAT = 'SHP'
+GPKG_SUFFIX = '_vector.gpkg'
+# Mismos campos que agregaba el plugin en QGIS: ID es el número de copa y
+# CLASE el código del ráster de instancias. Los nombres son ASCII y sin
+# paréntesis, así se usan en SQL (GeoPackage, DuckDB...) sin comillas
+FIELDS = [
+    ('ID', ogr.OFTInteger),
+    ('CLASE', ogr.OFTInteger),
+    ('ESPECIE', ogr.OFTString),
+    ('AREA_M2', ogr.OFTReal),
+    ('UTM_ESTE', ogr.OFTReal),
+    ('UTM_NORTE', ogr.OFTReal),
+]
+# El shapefile conserva los nombres que escribía el plugin (estilos y
+# modelos de QGIS existentes los usan)
+LEGACY_FORMATS = ('SHP',)
+LEGACY_FIELDS = {'AREA_M2': 'ÁREA(m2)', 'UTM_ESTE': 'UTM(ESTE)', 'UTM_NORTE': 'UTM(NORTE)'}
+
+
+def output_paths(output_raster, fmt=DEFAULT_FORMAT):
+    """
+    Rutas de las capas de copas y centroides. Con GPKG son capas del mismo
+    archivo, en la forma 'archivo.gpkg|layername=capa' que abre QGIS.
+    """
+    stem = os.path.splitext(output_raster)[0]
+    if fmt == 'GPKG':
+        package = stem + GPKG_SUFFIX
+        return {'polygons': package + '|layername=poligonos',
+                'centroids': package + '|layername=centroides',
+                'table': package + '|layername=atributos',
+                'package': package}
+    extension = FORMATS[fmt][1]
+    return {'polygons': stem + '_poly' + extension,
+            'centroids': stem + '_centroides' + extension}
+
+
+def polygonize(labels, reference, progress=None):
+    """
+    Vectoriza el ráster de etiquetas en una capa en memoria: un polígono
+    por palmera con su id en FIELD. Devuelve (dataset, capa); el dataset
+    debe seguir vivo mientras se use la capa. Con 'progress' la
+    poligonización informa su avance y se puede cancelar.
+    """
+    height, width = labels.shape
+    label_ds = gdal.GetDriverByName('MEM').Create('', width, height, 1, gdal.GDT_Int32)
+    label_ds.SetGeoTransform(reference.GetGeoTransform())
+    label_band = label_ds.GetRasterBand(1)
+    label_band.WriteArray(labels)
+
+    with perf.stage('polygonize', pixels=labels.size):
+        memory_ds = ogr.GetDriverByName('Memory').CreateDataSource('')
+        layer = memory_ds.CreateLayer('copas', geom_type=ogr.wkbPolygon)
+        layer.CreateField(ogr.FieldDefn(FIELD, ogr.OFTInteger))
+
+        callback = GdalCallback(progress, 'polygonize', log=ProgressLog('Poligonización', 100))
+        # La banda de etiquetas es su propia máscara: 0 (fondo y nodata) no se vectoriza
+        callback.run(gdal.Polygonize, label_band, label_band, layer, 0, ['8CONNECTED=8'])
+    label_band = None
+    label_ds = None
+    return memory_ds, layer
+
+
+def layer_fields(table, fmt=DEFAULT_FORMAT):
+    """FIELDS más un campo real por cada columna de métricas de 'table', con los nombres de 'fmt'."""
+    fields = FIELDS + [(instances.METRIC_FIELDS[column], ogr.OFTReal) for column in instances.metric_columns(table)]
+    if fmt in LEGACY_FORMATS:
+        fields = [(LEGACY_FIELDS.get(name, name), kind) for name, kind in fields]
+    return fields
+
+
+def _create_layer(datasource, name, srs, geom_type, options, fields):
+    layer = datasource.CreateLayer(name, srs=srs, geom_type=geom_type, options=options)
+    for field_name, field_type in fields:
+        layer.CreateField(ogr.FieldDefn(field_name, field_type))
+    return layer
+
+
+def _open_output(driver, path):
+    if os.path.exists(path):
+        driver.DeleteDataSource(path)
+    return driver.CreateDataSource(path)
+
+
+def _add_feature(layer, values, geometry=None):
+    feature = ogr.Feature(layer.GetLayerDefn())
+    for i, value in enumerate(values):
+        if value is not None:
+            feature.SetField(i, value)
+    if geometry is not None:
+        feature.SetGeometry(geometry)
+    layer.CreateFeature(feature)
+
+
+def write_vectors(output_raster, labels, table, reference, fmt=DEFAULT_FORMAT, polygons=True, progress=None):
+    """
+    Escribe junto a 'output_raster' las capas de centroides y (con polygons)
+    copas, y en GPKG la tabla de atributos, a partir de las etiquetas y la
+    tabla de instances.read_instances. Devuelve output_paths() ('polygons'
+    es None sin polígonos). 'progress' se pasa a polygonize.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato vectorial desconocido: {fmt} (use {', '.join(FORMATS)})")
+    driver_name, _, options = FORMATS[fmt]
+    driver = ogr.GetDriverByName(driver_name)
+    paths = output_paths(output_raster, fmt)
+    if not polygons:
+        paths['polygons'] = None
+
+    projection = reference.GetProjection()
+    srs = osr.SpatialReference(wkt=projection) if projection else None
+    if polygons:
+        memory_ds, source = polygonize(labels, reference, progress)
+    fields = layer_fields(table, fmt)
+    # Filas (id, clase, especie, área, este, norte, métricas...) en el orden de los campos
+    rows = list(zip(table['id'].tolist(), table['clase'].tolist(),
+                    [instances.SPECIES.get(code) for code in table['clase'].tolist()],
+                    table['area_m2'].tolist(), table['x'].tolist(), table['y'].tolist(),
+                    *[table[column].tolist() for column in instances.metric_columns(table)]))
+
+    with perf.stage('vector_write', windows=len(rows)):
+        layers = {}
+        if fmt == 'GPKG':
+            package = _open_output(driver, paths['package'])
+            datasources = [package]
+            if polygons:
+                layers['polygons'] = _create_layer(package, 'poligonos', srs, ogr.wkbPolygon, options, fields)
+            layers['centroids'] = _create_layer(package, 'centroides', srs, ogr.wkbPoint, options, fields)
+            layers['table'] = _create_layer(package, 'atributos', None, ogr.wkbNone, [], fields)
+            # Una sola transacción para todas las capas del paquete
+            package.StartTransaction()
+        else:
+            datasources = []
+            for key, geom_type in (('polygons', ogr.wkbPolygon), ('centroids', ogr.wkbPoint)):
+                if paths[key] is None:
+                    continue
+                datasource = _open_output(driver, paths[key])
+                datasources.append(datasource)
+                name = os.path.splitext(os.path.basename(paths[key]))[0]
+                layers[key] = _create_layer(datasource, name, srs, geom_type, options, fields)
+                layers[key].StartTransaction()
+
+        for values in rows:
+            point = ogr.Geometry(ogr.wkbPoint)
+            point.AddPoint_2D(values[4], values[5])
+            _add_feature(layers['centroids'], values, point)
+            if 'table' in layers:
+                _add_feature(layers['table'], values)
+        if polygons:
+            log = ProgressLog('Polígonos', source.GetFeatureCount())
+            source.ResetReading()
+            for done, feature in enumerate(source, 1):
+                values = rows[feature.GetField(FIELD) - 1]
+                _add_feature(layers['polygons'], values, feature.GetGeometryRef())
+                log.update(done)
+
+        if fmt == 'GPKG':
+            package.CommitTransaction()
+        else:
+            for layer in layers.values():
+                layer.CommitTransaction()
+        layers = None
+        for datasource in datasources:
+            datasource.FlushCache()
+        datasources = datasource = package = None
+    source = memory_ds = None
+
+    logger.info("Capas vectoriales (%s): %d palmeras en %s", fmt, len(rows), paths.get('package') or paths['centroids'])
+    return paths
@@ -0,0 +1,173 @@
+##### Proceso persistente del venv: mantiene los modelos cargados entre corridas ####
+#
+# Protocolo: una petición JSON por línea en stdin
+#   {"id": 1, "method": "apply_palmeras", "params": {...}}
+# y una respuesta JSON por línea en stdout
+#   {"id": 1, "result": ...}  o  {"id": 1, "error": "...", "traceback": "..."}
+# Mientras corre un trabajo se emiten eventos de progreso
+#   {"event": "progress", "stage": ..., "done": ..., "total": ..., "rate": ...}
+# y {"method": "cancel", "params": {"id": 1}} lo detiene en el siguiente lote
+# (la respuesta lleva "cancelled": true).
+# Los logs del pipeline (nivel: PALMERAS_LOG_LEVEL) y cualquier print se
+# desvían a stderr para no mezclarse con el protocolo: stdout es solo el canal
+# de resultados.
+
+import json
+import logging
+import queue
+import sys
+import threading
+import traceback
+
+from . import batch
+from . import gdal_io
+from . import palmeras_deteccion
+from . import products
+from . import spatial_index
+from . import tiling
+from .log import configure_logging
+from .progress import JobCancelled, ProgressReporter
+
+logger = logging.getLogger(__name__)
+
+_sessions = None
+
+
+def _get_sessions():
+    """Carga las sesiones ONNX en la primera petición y las reutiliza después."""
+    global _sessions
+    if _sessions is None:
+        _sessions = palmeras_deteccion.load_sessions()
+    return _sessions
+
+
+def _apply_palmeras(params, progress):
+    out_raster, out_raster_clas, mau, eut, oeno = palmeras_deteccion.apply_palmeras(
+        params['INPUT_RASTER'], params['OUTPUT_RASTER'],
+        INPUT_ROI=params.get('INPUT_ROI'),
+        sessions=_get_sessions(),
+        max_memory_mb=params.get('max_memory_mb'),
+        progress=progress
+    )
+    return _with_outputs({'out': [out_raster, out_raster_clas], 'counts': [mau, eut, oeno]}, params, progress)
+
+
+def _products_options(params):
+    """
+    vector_format (SHP, GPKG, FGB), polygons, table_format (parquet, csv),
+    metrics (lista de instances.METRICS), density_cell (m) y spatial_index
+    (índice para consultas por polígono) de la petición.
+    """
+    return {'vector_format': params.get('vector_format'), 'polygons': params.get('polygons', True),
+            'table_format': params.get('table_format'), 'metrics': params.get('metrics') or (),
+            'density_cell': params.get('density_cell'), 'index': params.get('spatial_index', False)}
+
+
+def _with_outputs(result, params, progress):
+    """Agrega al resultado el reporte por especie y los productos pedidos (ver products.write_products)."""
+    result.update(products.write_products(result['out'][0], result['out'][1], result['counts'],
+                                          flight=products.flight_id(params['INPUT_RASTER']),
+                                          progress=progress, **_products_options(params)))
+    return result
+
+
+def _apply_palmeras_sharded(params, progress):
+    out_raster, out_raster_clas, mau, eut, oeno = tiling.apply_palmeras_sharded(
+        params['INPUT_RASTER'], params['OUTPUT_RASTER'],
+        INPUT_ROI=params.get('INPUT_ROI'),
+        n_bands=params.get('n_bands'),
+        max_workers=params.get('max_workers'),
+        max_memory_mb=params.get('max_memory_mb'),
+        progress=progress
+    )
+    return _with_outputs({'out': [out_raster, out_raster_clas], 'counts': [mau, eut, oeno]}, params, progress)
+
+
+def _apply_palmeras_batch(params, progress):
+    max_workers = int(params.get('max_workers', 1))
+    # En paralelo el lote crea sus propias sesiones con los hilos repartidos
+    sessions = _get_sessions() if max_workers == 1 else None
+    return batch.apply_palmeras_batch(params['jobs'], max_workers=max_workers, sessions=sessions,
+                                      progress=progress, products_options=_products_options(params))
+
+
+def _query_index(params, progress):
+    # El índice queda en memoria del worker entre consultas (spatial_index.open_index)
+    return spatial_index.query_layer(params['OUTPUT_RASTER'], params['polygons'])
+
+
+METHODS = {
+    'ping': lambda params, progress: 'pong',
+    'apply_palmeras': _apply_palmeras,
+    'apply_palmeras_sharded': _apply_palmeras_sharded,
+    'apply_palmeras_batch': _apply_palmeras_batch,
+    'query_index': _query_index,
+}
+
+
+def serve(stdin=None, stdout=None):
+    """
+    Atiende peticiones hasta 'shutdown' o fin de stdin. Un hilo lee stdin para
+    que 'cancel' llegue mientras el hilo principal ejecuta un trabajo.
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    sys.stdout = sys.stderr
+    configure_logging(stream=sys.stderr)
+    write_lock = threading.Lock()
+    requests = queue.Queue()
+    cancelled = set()
+
+    def reply(message):
+        with write_lock:
+            stdout.write(json.dumps(message) + '\n')
+            stdout.flush()
+
+    def read_requests():
+        for line in stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                reply({'id': None, 'error': f"Petición inválida: {e}"})
+                continue
+            if request.get('method') == 'cancel':
+                cancelled.add((request.get('params') or {}).get('id'))
+                continue
+            requests.put(request)
+        requests.put(None)
+
+    threading.Thread(target=read_requests, daemon=True).start()
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        req_id = request.get('id')
+        method = request.get('method')
+        if method == 'shutdown':
+            reply({'id': req_id, 'result': None})
+            break
+        progress = ProgressReporter(reply, is_cancelled=lambda: req_id in cancelled)
+        try:
+            if method not in METHODS:
+                raise ValueError(f"Método desconocido: {method}")
+            result = METHODS[method](request.get('params') or {}, progress)
+            reply({'id': req_id, 'result': result})
+        except JobCancelled as e:
+            logger.info("%s", e)
+            reply({'id': req_id, 'error': str(e), 'cancelled': True})
+        except Exception as e:
+            logger.exception("Error en %s", method)
+            reply({'id': req_id, 'error': f"{type(e).__name__}: {e}",
+                   'traceback': traceback.format_exc()})
+        finally:
+            # Sin handles abiertos entre trabajos (Windows bloquea archivos abiertos)
+            gdal_io.close_datasets()
+            cancelled.discard(req_id)
+
+
+if __name__ == '__main__':
+    serve()
@@ -10,7 +10,7 @@ de la consola ni de valores guardados en QSettings.
 - Solo se cierra cuando el usuario termina o cancela
 - Logs en vivo con EnvCore
 """
-import os, hashlib, urllib.request, shutil, zipfile
+import os
 
 from qgis.PyQt.QtWidgets import (
     QDialog, QWidget, QVBoxLayout, QLabel, QPushButton,
@@ -19,7 +19,15 @@ from qgis.PyQt.QtWidgets import (
 from qgis.PyQt.QtCore import Qt
 from ._env_core import EnvCore
 
-_env = EnvCore(plugin_name="deteccion_de_palmeras_env")
+_env = None
+
+
+def _get_env():
+    """EnvCore compartido, creado la primera vez que se necesita."""
+    global _env
+    if _env is None:
+        _env = EnvCore(plugin_name="deteccion_de_palmeras_env")
+    return _env
 
 
 class DependenciesDialog(QDialog):
@@ -57,9 +65,9 @@ class DependenciesDialog(QDialog):
         v.addWidget(self.log, 1)
 
         # Estado inicial
-        if _env.venv_exists():
+        if _get_env().venv_exists():
             self.btn_prep.setEnabled(False)
-            self.log.appendPlainText(f"✅ Environment detected: {_env.venv_python}")
+            self.log.appendPlainText(f"✅ Environment detected: {_get_env().venv_python}")
         else:
             self.log.appendPlainText("⚠️ Environment not found. Click ‘Prepare environment’ to create it.")
         
@@ -73,20 +81,20 @@ class DependenciesDialog(QDialog):
         self.log.appendPlainText(msg)
 
     def _on_prepare(self):
-        if _env.venv_exists():
+        if _get_env().venv_exists():
             QMessageBox.information(self, "Dependencies","The environment already exists.")
             self.btn_prep.setEnabled(False)
             return
 
-        cmds = _env.numpy2_stack_commands()
-        runner = _env.make_seq_runner(parent=self, log_slot=self._append)
+        cmds = _get_env().numpy2_stack_commands()
+        runner = _get_env().make_seq_runner(parent=self, log_slot=self._append)
 
         def finished(rc: int):
             if rc == 0:
                 self._append("✅ Environment set up correctly.")
                 # ↓↓↓ AHORA descarga/verifica modelos desde EnvCore, reutilizando el log del diálogo
                 try:
-                    _env.ensure_models(self._append)
+                    _get_env().ensure_models(self._append)
                 except Exception as e:
                     self._append(f"⚠️ Model step reported an error: {e}")
                 self.btn_prep.setEnabled(False)
@@ -100,7 +108,7 @@ class DependenciesDialog(QDialog):
         runner.start(cmds)
 
     def _on_close(self):
-        if _env.venv_exists():
+        if _get_env().venv_exists():
             self.ok_when_closed = True
         self.accept()
     
@@ -111,11 +119,11 @@ def ensure_dependencies(iface=None) -> bool:
     - Si no existe, muestra el diálogo modal automáticamente
       hasta que el usuario lo cree o cierre.
     """
-    if _env.venv_exists():
+    if _get_env().venv_exists():
         return True
 
     dlg = DependenciesDialog(iface)
     dlg.exec_()
 
-    return dlg.ok_when_closed or _env.venv_exists()
+    return dlg.ok_when_closed or _get_env().venv_exists()
 
@@ -0,0 +1,97 @@
+# coding=utf-8
+"""Tests for batch mode with the stand-in ONNX models (palmeras_algo.batch)."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from palmeras_algo import batch
+from palmeras_algo import gdal_io
+from palmeras_algo import palmeras_deteccion
+
+try:
+    import onnx  # noqa: F401 (benchmarks.models crea los modelos con onnx)
+    import onnxruntime  # noqa: F401
+except ImportError:
+    onnx = None
+
+# Radios chicos: los rásteres de prueba tienen pocas ventanas
+OPTIONS = {'window_radius': 64, 'window_radius_instances': 64, 'resume': False, 'cache_max_mb': 0}
+
+
+@unittest.skipIf(onnx is None, 'onnx y onnxruntime son necesarios para los modelos de prueba')
+class TestBatch(unittest.TestCase):
+    """Shared sessions, per-job errors and per-job products."""
+
+    @classmethod
+    def setUpClass(cls):
+        from benchmarks import models, synthetic
+        cls.folder = tempfile.mkdtemp()
+        semantic, instances = models.build_models(os.path.join(cls.folder, 'models'))
+        cls.patches = [mock.patch.object(palmeras_deteccion, 'MODEL_SEMANTIC', semantic),
+                       mock.patch.object(palmeras_deteccion, 'MODEL_INSTANCES', instances)]
+        for patch in cls.patches:
+            patch.start()
+        cls.inputs = [synthetic.make_raster(os.path.join(cls.folder, f'vuelo{i}.tif'), 256, 256, seed=i)
+                      for i in range(2)]
+
+    @classmethod
+    def tearDownClass(cls):
+        for patch in cls.patches:
+            patch.stop()
+        gdal_io.close_datasets()
+        shutil.rmtree(cls.folder)
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(dir=self.folder)
+
+    def tearDown(self):
+        gdal_io.close_datasets()
+
+    def jobs(self, inputs):
+        return [{'input': path, 'output': os.path.join(self.output_dir, f'job{i}', 'out.tif')}
+                for i, path in enumerate(inputs)]
+
+    def run_batch(self, jobs, **kwargs):
+        for job in jobs:
+            os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+        return batch.apply_palmeras_batch(jobs, **dict(OPTIONS, **kwargs))
+
+    def test_sessions_loaded_once_and_shared(self):
+        load = mock.patch.object(palmeras_deteccion, 'load_sessions', wraps=palmeras_deteccion.load_sessions)
+        apply = mock.patch.object(palmeras_deteccion, 'apply_palmeras', wraps=palmeras_deteccion.apply_palmeras)
+        with load as load_sessions, apply as apply_palmeras:
+            results = self.run_batch(self.jobs(self.inputs * 2), max_workers=2)
+        self.assertEqual(load_sessions.call_count, 1)
+        sessions = {id(call.kwargs['sessions']) for call in apply_palmeras.call_args_list}
+        self.assertEqual(len(apply_palmeras.call_args_list), 4)
+        self.assertEqual(len(sessions), 1)
+        self.assertEqual([result['error'] for result in results], [None] * 4)
+
+    def test_failing_job_does_not_stop_the_batch(self):
+        inputs = [self.inputs[0], os.path.join(self.folder, 'no_existe.tif'), self.inputs[1]]
+        with self.assertLogs(batch.logger, 'ERROR'):
+            results = self.run_batch(self.jobs(inputs), max_workers=2)
+        self.assertEqual([result['input'] for result in results], inputs)
+        self.assertIsNone(results[0]['error'])
+        self.assertIsNotNone(results[1]['error'])
+        self.assertIsNone(results[1]['counts'])
+        self.assertIsNone(results[2]['error'])
+        self.assertEqual(len(results[2]['counts']), 3)
+
+    def test_products_per_job(self):
+        jobs = self.jobs(self.inputs)
+        results = self.run_batch(jobs, products_options={'table_format': 'csv'})
+        for job, result in zip(jobs, results):
+            folder = os.path.dirname(job['output'])
+            paths = result['out'] + [result['report'], result['table']]
+            for path in paths:
+                self.assertEqual(os.path.dirname(os.path.abspath(path)), folder, path)
+                self.assertTrue(os.path.exists(path), path)
+        self.assertNotEqual(results[0]['table'], results[1]['table'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+# coding=utf-8
+"""Tests for resumable runs (palmeras_algo.checkpoint)."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from osgeo import gdal
+
+from palmeras_algo import apply_model_dwt
+from palmeras_algo import checkpoint
+from palmeras_algo import gdal_io
+
+SHAPE = (64, 96)
+
+
+class TestTileCheckpoint(unittest.TestCase):
+    """Journal replay and partial raster restore across runs."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.image = os.path.join(self.folder, 'image.tif')
+        self.model = os.path.join(self.folder, 'model.onnx')
+        for path in (self.image, self.model):
+            with open(path, 'wb') as fh:
+                fh.write(b'x')
+        self.base = os.path.join(self.folder, 'stage')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def signature(self, **params):
+        return checkpoint.job_signature('semantic', [self.image], self.model,
+                                        window_radius=256, **params)
+
+    def open(self, signature=None):
+        return checkpoint.TileCheckpoint(self.base, signature or self.signature(), SHAPE,
+                                         gdal.GDT_Byte, 0)
+
+    def interrupted_run(self):
+        """Commits two windows and stops without finish(), like a killed run."""
+        journal = self.open()
+        array = np.zeros(SHAPE, dtype=np.uint8)
+        array[0:32, 0:48] = 1
+        array[32:64, 0:48] = 2
+        journal.commit(array, [((0, 0), (0, 32, 0, 48)), ((1, 0), (32, 64, 0, 48))])
+        journal.close()
+        return array
+
+    def test_replay_and_restore(self):
+        expected = self.interrupted_run()
+        journal = self.open()
+        self.assertEqual(journal.done, {(0, 0), (1, 0)})
+        self.assertTrue(journal.is_done((1, 0)))
+        self.assertFalse(journal.is_done((0, 1)))
+        array = np.zeros(SHAPE, dtype=np.uint8)
+        journal.restore(array)
+        np.testing.assert_array_equal(array, expected)
+        journal.close()
+
+    def test_partial_synced_before_journal(self):
+        synced = []
+        real_fsync = os.fsync
+
+        def fsync(fd):
+            inode = os.fstat(fd).st_ino
+            for suffix in (checkpoint.PARTIAL_SUFFIX, checkpoint.JOURNAL_SUFFIX):
+                path = self.base + suffix
+                if os.path.exists(path) and os.stat(path).st_ino == inode:
+                    synced.append(suffix)
+            real_fsync(fd)
+
+        with mock.patch.object(checkpoint.os, 'fsync', fsync):
+            journal = checkpoint.TileCheckpoint(self.base, self.signature(), SHAPE, gdal.GDT_Byte, 0,
+                                                sync_seconds=0)
+            journal.commit(np.ones(SHAPE, dtype=np.uint8), [((0, 0), (0, 32, 0, 48))])
+            self.assertEqual(synced, [checkpoint.PARTIAL_SUFFIX, checkpoint.JOURNAL_SUFFIX])
+            journal.close()
+
+    def test_unsynced_windows_are_not_journaled(self):
+        journal = self.open()
+        journal.commit(np.ones(SHAPE, dtype=np.uint8), [((0, 0), (0, 32, 0, 48))])
+        # Corte antes de la sincronización: la ventana no figura en el diario
+        with open(self.base + checkpoint.JOURNAL_SUFFIX, encoding='utf-8') as fh:
+            self.assertNotIn('window', fh.read())
+        journal.close()
+        journal = self.open()
+        self.assertEqual(journal.done, {(0, 0)})
+        journal.close()
+
+    def test_truncated_last_line(self):
+        self.interrupted_run()
+        with open(self.base + checkpoint.JOURNAL_SUFFIX, 'a', encoding='utf-8') as fh:
+            fh.write('{"window": [0, ')
+        journal = self.open()
+        self.assertEqual(journal.done, {(0, 0), (1, 0)})
+        journal.close()
+
+    def test_signature_mismatch_starts_over(self):
+        self.interrupted_run()
+        journal = self.open(self.signature(scaling=2))
+        self.assertEqual(journal.done, set())
+        array = np.full(SHAPE, 7, dtype=np.uint8)
+        journal.restore(array)
+        self.assertTrue((array == 7).all())
+        journal.close()
+        # El diario viejo se reemplazó: la firma original tampoco lo reanuda
+        journal = self.open()
+        self.assertEqual(journal.done, set())
+        journal.close()
+
+    def test_missing_partial_starts_over(self):
+        self.interrupted_run()
+        os.remove(self.base + checkpoint.PARTIAL_SUFFIX)
+        journal = self.open()
+        self.assertEqual(journal.done, set())
+        journal.close()
+
+    def test_finish(self):
+        journal = self.open()
+        journal.finish({'output': 'mask.tif'})
+        self.assertFalse(os.path.exists(self.base + checkpoint.PARTIAL_SUFFIX))
+        output = os.path.join(self.folder, 'mask.tif')
+        journal = checkpoint.TileCheckpoint(self.base, self.signature(), SHAPE, gdal.GDT_Byte, 0,
+                                            output_path=output)
+        # Sin el producto final la etapa se vuelve a correr
+        self.assertIsNone(journal.completed)
+        journal.finish({'output': 'mask.tif'})
+        open(output, 'wb').close()
+        journal = checkpoint.TileCheckpoint(self.base, self.signature(), SHAPE, gdal.GDT_Byte, 0,
+                                            output_path=output)
+        self.assertEqual(journal.completed, {'output': 'mask.tif'})
+        journal.close()
+        checkpoint.remove_checkpoint(self.base)
+        self.assertFalse(os.path.exists(self.base + checkpoint.JOURNAL_SUFFIX))
+
+
+class FlakySession(object):
+    """Instance model stand-in that fails on the windows listed in 'fail'."""
+
+    def __init__(self, fail=()):
+        self.fail = list(fail)
+        self.calls = 0
+
+    def get_inputs(self):
+        return [mock.Mock(name=name) for name in ('image', 'mask')]
+
+    def run(self, outputs, feeds):
+        self.calls += 1
+        if self.calls in self.fail:
+            raise RuntimeError('falla simulada')
+        return [np.full((1,) + feeds[next(iter(feeds))].shape[1:3], 3, dtype=np.float32)]
+
+
+class TestInstanceResume(unittest.TestCase):
+    """Windows whose inference failed are not journaled and run again on resume."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.image = os.path.join(self.folder, 'image.tif')
+        self.mask = os.path.join(self.folder, 'mask.tif')
+        driver = gdal.GetDriverByName('GTiff')
+        image = driver.Create(self.image, SHAPE[1], SHAPE[0], 3, gdal.GDT_Float32)
+        for b in range(3):
+            image.GetRasterBand(b + 1).WriteArray(np.full(SHAPE, 100, dtype=np.float32))
+        image.FlushCache()
+        mask = driver.Create(self.mask, SHAPE[1], SHAPE[0], 1, gdal.GDT_Byte)
+        mask.GetRasterBand(1).WriteArray(np.ones(SHAPE, dtype=np.uint8))
+        mask.FlushCache()
+        image = mask = None
+
+    def tearDown(self):
+        gdal_io.close_datasets()
+        shutil.rmtree(self.folder)
+
+    def run_instances(self, session):
+        return apply_model_dwt.apply_instance_onnx([self.image], [self.mask], None, self.folder, self.image,
+                                                   16, 16, session=session, resume=True)
+
+    def test_failed_window_is_retried(self):
+        with self.assertLogs(apply_model_dwt.logger, 'ERROR'):
+            self.run_instances(FlakySession(fail=[2]))
+        journal_path = os.path.join(self.folder, 'image_predicted' + checkpoint.JOURNAL_SUFFIX)
+        with open(journal_path, encoding='utf-8') as fh:
+            records = [json.loads(line) for line in fh][1:]
+        # 2 filas x 3 columnas de ventanas; la segunda falló y la etapa no queda terminada
+        self.assertEqual(len(records), 5)
+        self.assertNotIn([48, 16], [record.get('window') for record in records])
+        self.assertFalse(any('complete' in record for record in records))
+        session = FlakySession()
+        self.run_instances(session)
+        self.assertEqual(session.calls, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
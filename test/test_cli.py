@@ -0,0 +1,69 @@
+# coding=utf-8
+"""Tests for the command line (palmeras_algo.__main__)."""
+
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from palmeras_algo import __main__ as cli
+from palmeras_algo import batch
+from palmeras_algo import palmeras_deteccion
+from palmeras_algo import products
+from palmeras_algo import tiling
+
+RESULT = ('out.tif', 'out_clas.tif', 1, 2, 3)
+WRITTEN = {'report': 'report.txt', 'area_ha': (0.1, 0.2, 0.3)}
+
+
+class TestCli(unittest.TestCase):
+    """Options reach the pipeline and flags without effect are rejected."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        patches = [mock.patch.object(tiling, 'apply_palmeras_sharded', return_value=RESULT),
+                   mock.patch.object(palmeras_deteccion, 'apply_palmeras', return_value=RESULT),
+                   mock.patch.object(products, 'write_products', return_value=WRITTEN),
+                   mock.patch.object(batch, 'apply_palmeras_batch', return_value=[])]
+        self.sharded, self.single, _, self.batch = [patch.start() for patch in patches]
+        for patch in patches:
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def run_cli(self, *argv):
+        with contextlib.redirect_stderr(io.StringIO()):
+            return cli.main(list(argv))
+
+    def test_threads_single_run(self):
+        self.run_cli('detect', 'in.tif', 'out.tif', '--threads', '3')
+        self.assertEqual(self.single.call_args.kwargs['threads'], 3)
+        self.sharded.assert_not_called()
+
+    def test_threads_with_processes(self):
+        self.run_cli('detect', 'in.tif', 'out.tif', '--processes', '4', '--threads', '2')
+        kwargs = self.sharded.call_args.kwargs
+        self.assertEqual((kwargs['max_workers'], kwargs['threads']), (4, 2))
+
+    def test_threads_with_workers(self):
+        output_dir = os.path.join(self.folder, 'out')
+        self.run_cli('batch', 'a.tif', 'b.tif', '--output-dir', output_dir, '--workers', '2', '--threads', '2')
+        kwargs = self.batch.call_args.kwargs
+        self.assertEqual((kwargs['max_workers'], kwargs['threads']), (2, 2))
+        self.assertNotIn('sessions', kwargs)
+
+    def test_flags_without_effect(self):
+        for argv in (['--no-polygons'], ['--metrics', 'diameter'], ['--threads', '-1']):
+            with self.assertRaises(SystemExit, msg=argv):
+                self.run_cli('detect', 'in.tif', 'out.tif', *argv)
+        self.single.assert_not_called()
+        self.run_cli('detect', 'in.tif', 'out.tif', '--vector', 'GPKG', '--no-polygons', '--metrics', 'diameter')
+        self.assertTrue(self.single.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
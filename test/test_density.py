@@ -0,0 +1,52 @@
+# coding=utf-8
+"""Tests for the palm density grid (palmeras_algo.density)."""
+
+import unittest
+
+import numpy as np
+from osgeo import osr
+
+from palmeras_algo import density
+
+GEOTRANSFORM = (500000.0, 0.5, 0.0, 9000000.0, 0.0, -0.5)
+
+
+def srs_wkt(epsg):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return srs.ExportToWkt()
+
+
+class TestDensityGrid(unittest.TestCase):
+    """Palms per hectare on a regular grid."""
+
+    def setUp(self):
+        # Dos Mauritia en la primera celda de 100 m, una Euterpe en la última
+        self.table = {'x': np.array([500010.0, 500090.0, 500150.0]),
+                      'y': np.array([8999990.0, 8999950.0, 8999850.0]),
+                      'clase': np.array([15, 15, 25])}
+
+    def test_counts_per_hectare(self):
+        grid, grid_gt = density.density_grid(self.table, GEOTRANSFORM, 400, 400, 100, projection=srs_wkt(32718))
+        self.assertEqual(grid.shape, (4, 2, 2))
+        np.testing.assert_array_equal(grid[0], [[2, 0], [0, 0]])
+        np.testing.assert_array_equal(grid[1], [[0, 0], [0, 1]])
+        np.testing.assert_array_equal(grid[-1], [[2, 0], [0, 1]])
+        self.assertEqual(grid_gt, (500000.0, 100.0, 0.0, 9000000.0, 0.0, -100.0))
+
+    def test_rejects_rotated_raster(self):
+        with self.assertRaises(ValueError):
+            density.density_grid(self.table, (500000.0, 0.5, 0.1, 9000000.0, 0.0, -0.5), 400, 400, 100)
+
+    def test_rejects_geographic_srs(self):
+        with self.assertRaises(ValueError):
+            density.density_grid(self.table, (-73.0, 1e-5, 0.0, -4.0, 0.0, -1e-5), 400, 400, 100,
+                                 projection=srs_wkt(4326))
+
+    def test_invalid_cell(self):
+        with self.assertRaises(ValueError):
+            density.density_grid(self.table, GEOTRANSFORM, 400, 400, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
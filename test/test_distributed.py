@@ -0,0 +1,130 @@
+# coding=utf-8
+"""Tests for the multi-machine tile mode (palmeras_algo.distributed)."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+from osgeo import gdal
+from skimage.measure import label
+
+from palmeras_algo import distributed
+from palmeras_algo import gdal_io
+from palmeras_algo import palmeras_deteccion
+from palmeras_algo.apply_model_dwt import CLASS_TO_CITYSCAPES
+
+CODE_TO_CLASS = {15: 1, 25: 2, 35: 3}
+
+
+def whole_counts(instances):
+    return {name: label(instances == code, connectivity=2, return_num=True)[1]
+            for name, code in CLASS_TO_CITYSCAPES.items()}
+
+
+def count_tiles(instances, rows, cols):
+    """TileCounter over the grid given by the row and column cuts."""
+    counter = distributed.TileCounter()
+    for i, (y0, y1) in enumerate(zip(rows[:-1], rows[1:])):
+        for j, (x0, x1) in enumerate(zip(cols[:-1], cols[1:])):
+            counter.add([i, j], instances[y0:y1, x0:x1])
+    return counter.counts()
+
+
+def write_raster(path, array, nodata=None, gdal_type=gdal.GDT_Float32):
+    dataset = gdal.GetDriverByName('GTiff').Create(path, array.shape[1], array.shape[0], 1, gdal_type)
+    dataset.SetGeoTransform((500000.0, 0.5, 0.0, 9000000.0, 0.0, -0.5))
+    if nodata is not None:
+        dataset.GetRasterBand(1).SetNoDataValue(nodata)
+    dataset.GetRasterBand(1).WriteArray(array)
+    dataset.FlushCache()
+
+
+class TestTileCounter(unittest.TestCase):
+    """Instances touching tile edges and corners are counted once."""
+
+    def test_edges_and_corners(self):
+        instances = np.full((20, 20), -9999, dtype=np.float32)
+        instances[9, 9] = instances[10, 10] = 15      # esquina, en diagonal
+        instances[9, 10] = instances[10, 9] = 25      # esquina, en la otra diagonal
+        instances[2:5, 9:11] = 35                     # cruza el borde vertical
+        instances[9:11, 15] = 35                      # cruza el borde horizontal
+        counts = count_tiles(instances, [0, 10, 20], [0, 10, 20])
+        self.assertEqual(counts, {'mauritia': 1, 'euterpe': 1, 'oenocarpus': 2})
+        self.assertEqual(counts, whole_counts(instances))
+
+    def test_random_grid(self):
+        rng = np.random.default_rng(5)
+        codes = np.array([-9999, 15, 25, 35], dtype=np.float32)
+        instances = codes[rng.choice(4, size=(90, 120), p=[0.55, 0.15, 0.15, 0.15])]
+        counts = count_tiles(instances, [0, 30, 31, 70, 90], [0, 40, 41, 80, 120])
+        self.assertEqual(counts, whole_counts(instances))
+
+
+class TestPipeline(unittest.TestCase):
+    """plan -> run-tile -> merge on a small raster."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.store = os.path.join(self.folder, 'store')
+        rng = np.random.default_rng(2)
+        codes = np.array([-9999, 15, 25, 35], dtype=np.float32)
+        # Copas de 3x3 para que crucen bordes y esquinas de las teselas
+        blocks = codes[rng.choice(4, size=(80, 70), p=[0.7, 0.1, 0.1, 0.1])]
+        self.instances = np.kron(blocks, np.ones((3, 3), dtype=np.float32))
+        self.input = os.path.join(self.folder, 'input.tif')
+        write_raster(self.input, self.instances, nodata=-9999)
+        self.calls = []
+
+    def tearDown(self):
+        gdal_io.close_datasets()
+        shutil.rmtree(self.folder)
+
+    def fake_apply_palmeras(self, tile_input, output, INPUT_ROI=None, sessions=None, resume=True, norm_stats=None):
+        """Stand-in for the models: the 'instances' are the input pixels themselves."""
+        self.calls.append(norm_stats)
+        tile = gdal.Open(tile_input).GetRasterBand(1).ReadAsArray()
+        write_raster(output, tile, nodata=-9999)
+        clas = np.zeros(tile.shape, dtype=np.uint8)
+        for code, value in CODE_TO_CLASS.items():
+            clas[tile == code] = value
+        output_clas = os.path.splitext(output)[0] + '_clas.tif'
+        write_raster(output_clas, clas, gdal_type=gdal.GDT_Byte)
+        counts = whole_counts(tile)
+        return output, output_clas, counts['mauritia'], counts['euterpe'], counts['oenocarpus']
+
+    def test_plan_run_merge(self):
+        distributed.plan(self.input, self.store, tile_size=70, halo=20)
+        manifest = distributed._load_manifest(self.store)
+        self.assertEqual(manifest['grid'], [3, 3])
+        self.assertEqual(len(distributed.pending_tiles(self.store)), 9)
+
+        with mock.patch.object(palmeras_deteccion, 'apply_palmeras', self.fake_apply_palmeras):
+            for tile_id in distributed.pending_tiles(self.store):
+                distributed.run_tile(self.store, tile_id)
+            # Idempotente: una tesela terminada no se vuelve a correr
+            distributed.run_tile(self.store, manifest['tiles'][0]['id'])
+        self.assertEqual(len(self.calls), 9)
+        self.assertEqual(distributed.pending_tiles(self.store), [])
+        # Todas las teselas se normalizan con los mismos percentiles, los del plan
+        self.assertIsNotNone(manifest['norm_stats'])
+        self.assertTrue(all(stats == manifest['norm_stats'] for stats in self.calls))
+
+        output = os.path.join(self.folder, 'merged.tif')
+        _, output_clas, mau, eut, oeno = distributed.merge(self.store, output)
+        merged = gdal.Open(output).GetRasterBand(1).ReadAsArray()
+        np.testing.assert_array_equal(merged, self.instances)
+        expected = whole_counts(self.instances)
+        self.assertEqual((mau, eut, oeno), (expected['mauritia'], expected['euterpe'], expected['oenocarpus']))
+        self.assertTrue(os.path.exists(output_clas))
+
+    def test_merge_requires_all_tiles(self):
+        distributed.plan(self.input, self.store, tile_size=70, halo=20)
+        with self.assertRaises(RuntimeError):
+            distributed.merge(self.store, os.path.join(self.folder, 'merged.tif'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# coding=utf-8
+"""Tests for the per-thread dataset registry and GDAL settings (palmeras_algo.gdal_io)."""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+from osgeo import gdal
+
+from palmeras_algo import gdal_io
+
+OPTIONS = ('GDAL_CACHEMAX', 'GDAL_NUM_THREADS', 'GDAL_DISABLE_READDIR_ON_OPEN', 'VSI_CACHE', 'VSI_CACHE_SIZE')
+
+
+class TestDatasets(unittest.TestCase):
+    """Handles are reused within a thread and closed on request."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'image.tif')
+        dataset = gdal.GetDriverByName('GTiff').Create(self.path, 8, 4, 1, gdal.GDT_Byte)
+        dataset.GetRasterBand(1).WriteArray(np.ones((4, 8), dtype=np.uint8))
+        dataset.FlushCache()
+        dataset = None
+
+    def tearDown(self):
+        gdal_io.close_datasets()
+        shutil.rmtree(self.folder)
+
+    def open_in_thread(self):
+        opened = []
+        thread = threading.Thread(target=lambda: opened.append(gdal_io.open_dataset(self.path)))
+        thread.start()
+        thread.join()
+        return opened[0]
+
+    def test_same_handle_in_thread(self):
+        dataset = gdal_io.open_dataset(self.path)
+        self.assertIs(gdal_io.open_dataset(os.path.join(self.folder, '.', 'image.tif')), dataset)
+        self.assertIsNot(gdal_io.open_dataset(self.path, update=True), dataset)
+
+    def test_other_thread_gets_its_own_handle(self):
+        dataset = gdal_io.open_dataset(self.path)
+        other = self.open_in_thread()
+        self.assertIsNotNone(other)
+        self.assertIsNot(other, dataset)
+        self.assertIs(gdal_io.open_dataset(self.path), dataset)
+
+    def test_release_dataset(self):
+        dataset = gdal_io.open_dataset(self.path)
+        gdal_io.open_dataset(self.path, update=True)
+        gdal_io.release_dataset(self.path)
+        self.assertIsNot(gdal_io.open_dataset(self.path), dataset)
+
+    def test_close_datasets(self):
+        dataset = gdal_io.open_dataset(self.path)
+        gdal_io.close_datasets()
+        self.assertIsNot(gdal_io.open_dataset(self.path), dataset)
+
+
+class TestConfigureGdal(unittest.TestCase):
+    """Defaults never override what the user already set."""
+
+    def setUp(self):
+        saved = {key: gdal.GetConfigOption(key) for key in OPTIONS}
+        for key in OPTIONS:
+            gdal.SetConfigOption(key, None)
+        self.addCleanup(lambda: [gdal.SetConfigOption(key, value) for key, value in saved.items()])
+
+    def test_defaults(self):
+        with mock.patch.object(gdal, 'SetCacheMax') as set_cache_max:
+            gdal_io.configure_gdal()
+        set_cache_max.assert_called_once_with(gdal_io.DEFAULT_CACHE_MB * 1024 * 1024)
+        self.assertEqual(gdal.GetConfigOption('GDAL_NUM_THREADS'), gdal_io.DEFAULT_NUM_THREADS)
+        self.assertEqual(gdal.GetConfigOption('GDAL_DISABLE_READDIR_ON_OPEN'), 'TRUE')
+
+    def test_user_options_are_kept(self):
+        gdal.SetConfigOption('GDAL_CACHEMAX', '2048')
+        gdal.SetConfigOption('GDAL_NUM_THREADS', '2')
+        gdal.SetConfigOption('GDAL_DISABLE_READDIR_ON_OPEN', 'EMPTY_DIR')
+        with mock.patch.object(gdal, 'SetCacheMax') as set_cache_max:
+            gdal_io.configure_gdal()
+        set_cache_max.assert_not_called()
+        self.assertEqual(gdal.GetConfigOption('GDAL_NUM_THREADS'), '2')
+        self.assertEqual(gdal.GetConfigOption('GDAL_DISABLE_READDIR_ON_OPEN'), 'EMPTY_DIR')
+
+    def test_explicit_arguments_win(self):
+        gdal.SetConfigOption('GDAL_NUM_THREADS', '2')
+        with mock.patch.object(gdal, 'SetCacheMax') as set_cache_max:
+            gdal_io.configure_gdal(cache_mb=256, num_threads=4, vsi_cache_mb=8)
+        set_cache_max.assert_called_once_with(256 * 1024 * 1024)
+        self.assertEqual(gdal.GetConfigOption('GDAL_NUM_THREADS'), '4')
+        self.assertEqual(gdal.GetConfigOption('VSI_CACHE_SIZE'), str(8 * 1024 * 1024))
+
+
+class TestBatchThreads(unittest.TestCase):
+    """Batch jobs close the handles their pool thread opened."""
+
+    def test_run_job_closes_thread_handles(self):
+        from palmeras_algo import batch, palmeras_deteccion
+
+        opened = {}
+
+        def apply_palmeras(path, output, **kwargs):
+            opened['dataset'] = gdal_io.open_dataset(path)
+            opened['registry'] = gdal_io._registry()
+            raise RuntimeError('falla simulada')
+
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'image.tif')
+        gdal.GetDriverByName('GTiff').Create(path, 4, 4, 1, gdal.GDT_Byte).FlushCache()
+        with mock.patch.object(palmeras_deteccion, 'apply_palmeras', apply_palmeras), \
+                self.assertLogs(batch.logger, 'ERROR'):
+            results = batch.apply_palmeras_batch([{'input': path, 'output': path}] * 2, max_workers=2,
+                                                 sessions={})
+        self.assertTrue(all(result['error'] for result in results))
+        self.assertIsNotNone(opened['dataset'])
+        self.assertEqual(opened['registry'], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
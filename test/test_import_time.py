@@ -0,0 +1,60 @@
+# coding=utf-8
+"""Import-time budget: loading the plugin must cost close to nothing."""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+PLUGIN_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# Seconds allowed for importing the plugin on top of an already loaded QGIS
+IMPORT_BUDGET = 0.25
+
+# Modules that must only be imported when an algorithm runs or the
+# dependencies dialog opens
+DEFERRED_MODULES = [
+    'processing',
+    'urllib.request',
+    'zipfile',
+    'subprocess',
+    'numpy',
+    'osgeo',
+]
+
+CHILD = """
+import importlib, json, sys, time
+sys.path.insert(0, {parent!r})
+import qgis.core, qgis.PyQt.QtCore, qgis.PyQt.QtGui, qgis.PyQt.QtWidgets
+before = set(sys.modules)
+t0 = time.perf_counter()
+importlib.import_module({name!r} + '.deteccion_de_palmeras')
+importlib.import_module({name!r} + '._env_core').EnvCore(plugin_name='test')
+elapsed = time.perf_counter() - t0
+print(json.dumps({{'elapsed': elapsed, 'new': sorted(set(sys.modules) - before)}}))
+"""
+
+
+class TestImportTime(unittest.TestCase):
+    """Test that importing the plugin stays cheap."""
+
+    def _import_plugin(self):
+        code = CHILD.format(parent=os.path.dirname(PLUGIN_DIR),
+                            name=os.path.basename(PLUGIN_DIR))
+        out = subprocess.check_output([sys.executable, '-c', code])
+        return json.loads(out.decode().strip().splitlines()[-1])
+
+    def test_no_heavy_imports(self):
+        """Nothing heavy is imported until the plugin is actually used."""
+        new = self._import_plugin()['new']
+        for module in DEFERRED_MODULES:
+            self.assertNotIn(module, new)
+
+    def test_import_budget(self):
+        """Importing the plugin and creating EnvCore fits the time budget."""
+        self.assertLess(self._import_plugin()['elapsed'], IMPORT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+# coding=utf-8
+"""Tests for the per-palm instance table (palmeras_algo.instances)."""
+
+import unittest
+
+import numpy as np
+
+from palmeras_algo import instances
+from palmeras_algo.apply_model_dwt import CLASS_TO_CITYSCAPES
+
+MAURITIA, EUTERPE, OENOCARPUS = (CLASS_TO_CITYSCAPES[name] for name in ('mauritia', 'euterpe', 'oenocarpus'))
+# Origen UTM, píxeles de 0.5 m, norte arriba
+GEOTRANSFORM = (500000.0, 0.5, 0.0, 9000000.0, 0.0, -0.5)
+
+
+def crowns():
+    """Instance raster with five crowns; two of them touch diagonally but differ in class."""
+    data = np.full((12, 16), -9999, dtype=np.float32)
+    data[1:4, 1:4] = MAURITIA           # 9 px, centro en (2.5, 2.5)
+    data[1:3, 10:14] = MAURITIA         # 8 px
+    data[4:6, 4:6] = EUTERPE            # toca en diagonal a la primera
+    data[8, 2] = OENOCARPUS             # 1 px
+    data[7:11, 9:11] = OENOCARPUS       # 8 px
+    data[9:11, 11] = OENOCARPUS         # misma copa (vecina por el lado)
+    return data
+
+
+class TestLabelInstances(unittest.TestCase):
+    """Ids and classes of the labeled raster."""
+
+    def setUp(self):
+        self.data = crowns()
+        self.labels, self.classes = instances.label_instances(self.data)
+
+    def test_ids_are_consecutive(self):
+        ids = np.unique(self.labels[self.labels > 0])
+        np.testing.assert_array_equal(ids, np.arange(1, len(self.classes)))
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(self.classes[0], 0)
+        self.assertTrue((self.labels[self.data == -9999] == 0).all())
+
+    def test_classes_follow_pixels(self):
+        inside = self.labels > 0
+        np.testing.assert_array_equal(self.classes[self.labels[inside]], self.data[inside])
+
+    def test_empty(self):
+        labels, classes = instances.label_instances(np.full((4, 4), -9999, dtype=np.float32))
+        self.assertFalse(labels.any())
+        np.testing.assert_array_equal(classes, [0])
+        table = instances.instance_table(labels, classes, GEOTRANSFORM, metrics=tuple(instances.METRICS))
+        self.assertTrue(all(len(column) == 0 for column in table.values()))
+
+
+class TestInstanceTable(unittest.TestCase):
+    """Pixel counts, areas and centroids per palm."""
+
+    def setUp(self):
+        self.data = crowns()
+        self.labels, self.classes = instances.label_instances(self.data)
+        self.table = instances.instance_table(self.labels, self.classes, GEOTRANSFORM)
+
+    def test_rows_align_with_label_ids(self):
+        # vectorize toma los atributos de cada polígono con rows[id - 1]
+        np.testing.assert_array_equal(self.table['id'], np.arange(1, len(self.classes)))
+        for row, crown_id in enumerate(self.table['id']):
+            mask = self.labels == crown_id
+            self.assertEqual(self.table['pixels'][row], mask.sum())
+            self.assertTrue((self.data[mask] == self.table['clase'][row]).all())
+
+    def test_pixel_counts_and_area(self):
+        by_class = {code: sorted(self.table['pixels'][self.table['clase'] == code].tolist())
+                    for code in (MAURITIA, EUTERPE, OENOCARPUS)}
+        self.assertEqual(by_class, {MAURITIA: [8, 9], EUTERPE: [4], OENOCARPUS: [1, 10]})
+        np.testing.assert_allclose(self.table['area_m2'], self.table['pixels'] * 0.25)
+
+    def test_centroids_in_map_coordinates(self):
+        row = self.labels[2, 2] - 1
+        # Centro del píxel (2, 2): 2.5 píxeles desde la esquina del ráster
+        self.assertAlmostEqual(self.table['x'][row], 500000.0 + 2.5 * 0.5)
+        self.assertAlmostEqual(self.table['y'][row], 9000000.0 - 2.5 * 0.5)
+        single = self.labels[8, 2] - 1
+        self.assertAlmostEqual(self.table['x'][single], 500000.0 + 2.5 * 0.5)
+        self.assertAlmostEqual(self.table['y'][single], 9000000.0 - 8.5 * 0.5)
+        for row, crown_id in enumerate(self.table['id']):
+            rows, cols = np.nonzero(self.labels == crown_id)
+            self.assertAlmostEqual(self.table['x'][row], 500000.0 + (cols.mean() + 0.5) * 0.5)
+            self.assertAlmostEqual(self.table['y'][row], 9000000.0 - (rows.mean() + 0.5) * 0.5)
+
+    def test_unknown_metric(self):
+        with self.assertRaises(ValueError):
+            instances.instance_table(self.labels, self.classes, GEOTRANSFORM, metrics=('volume',))
+
+
+class TestShapeMetrics(unittest.TestCase):
+    """Perimeter, compactness and bounding box from pixel edges."""
+
+    def table(self, data, geotransform=GEOTRANSFORM):
+        labels, classes = instances.label_instances(data)
+        return instances.instance_table(labels, classes, geotransform, metrics=tuple(instances.METRICS))
+
+    def test_square(self):
+        data = np.full((10, 10), -9999, dtype=np.float32)
+        data[2:6, 3:7] = MAURITIA
+        table = self.table(data)
+        self.assertAlmostEqual(table['perimeter_m'][0], 16 * 0.5)
+        self.assertAlmostEqual(table['compactness'][0], np.pi / 4)
+        self.assertAlmostEqual(table['diameter_m'][0], 2 * np.sqrt(4.0 / np.pi))
+        bbox = [table[k][0] for k in ('xmin', 'ymin', 'xmax', 'ymax')]
+        np.testing.assert_allclose(bbox, [500001.5, 8999997.0, 500003.5, 8999999.0])
+
+    def test_hole(self):
+        data = np.full((10, 10), -9999, dtype=np.float32)
+        data[1:8, 1:8] = EUTERPE
+        data[3:5, 3:6] = -9999
+        table = self.table(data)
+        # Anillo exterior 7x7 más el del agujero 2x3, como geom.length() en QGIS
+        self.assertAlmostEqual(table['perimeter_m'][0], (28 + 10) * 0.5)
+        self.assertAlmostEqual(table['area_m2'][0], (49 - 6) * 0.25)
+        # El agujero no cambia la extensión
+        bbox = [table[k][0] for k in ('xmin', 'ymin', 'xmax', 'ymax')]
+        np.testing.assert_allclose(bbox, [500000.5, 8999996.0, 500004.0, 8999999.5])
+
+    def test_crown_touching_border(self):
+        data = np.full((6, 8), -9999, dtype=np.float32)
+        data[0:3, 5:8] = OENOCARPUS     # esquina superior derecha del ráster
+        data[4:6, 0] = MAURITIA          # borde izquierdo e inferior
+        labels, classes = instances.label_instances(data)
+        vertical, horizontal = instances.edge_counts(labels, len(classes))
+        corner, edge = labels[0, 7], labels[5, 0]
+        # El borde del ráster cuenta como fondo
+        self.assertEqual((vertical[corner], horizontal[corner]), (6, 6))
+        self.assertEqual((vertical[edge], horizontal[edge]), (4, 2))
+        table = self.table(data)
+        row = corner - 1
+        self.assertAlmostEqual(table['perimeter_m'][row], 12 * 0.5)
+        bbox = [table[k][row] for k in ('xmin', 'ymin', 'xmax', 'ymax')]
+        np.testing.assert_allclose(bbox, [500002.5, 8999998.5, 500004.0, 9000000.0])
+
+    def test_rectangular_pixels(self):
+        data = np.full((5, 5), -9999, dtype=np.float32)
+        data[1:3, 1:4] = MAURITIA       # 2 filas x 3 columnas
+        table = self.table(data, geotransform=(0.0, 2.0, 0.0, 100.0, 0.0, -1.0))
+        # 4 aristas verticales de 1 m (alto del píxel) y 6 horizontales de 2 m
+        self.assertAlmostEqual(table['perimeter_m'][0], 4 * 1.0 + 6 * 2.0)
+        np.testing.assert_allclose([table[k][0] for k in ('xmin', 'ymin', 'xmax', 'ymax')], [2.0, 97.0, 8.0, 99.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# coding=utf-8
+"""Tests for the memory budget (palmeras_algo.memory)."""
+
+import unittest
+from unittest import mock
+
+from palmeras_algo import memory
+
+SHARED_MB = memory.BASE_MB + memory.SESSIONS_MB
+
+
+def job_mb(budget):
+    """MB of one job of a plan with one process, without what the process shares."""
+    return budget['estimate_mb'] - budget['gdal_cache_mb'] - SHARED_MB
+
+
+class TestPlanBudget(unittest.TestCase):
+    """Workers, bands and batch size for a budget."""
+
+    def test_fits_budget(self):
+        for max_memory_mb in (2000, 4000, 16000):
+            budget = memory.plan_budget(4000, 4000, max_memory_mb, halo=676, max_workers=4)
+            self.assertLessEqual(budget['estimate_mb'], max_memory_mb)
+            self.assertGreaterEqual(budget['batch_size'], 1)
+
+    def test_small_budget_falls_back(self):
+        budget = memory.plan_budget(20000, 20000, 500, halo=676, max_workers=4)
+        self.assertEqual((budget['max_workers'], budget['batch_size']), (1, 1))
+        self.assertGreater(budget['n_bands'], 1)
+
+    def test_threaded_jobs_share_sessions(self):
+        alone = memory.plan_budget(3000, 3000, 6000, halo=676, max_workers=1)
+        shared = memory.plan_budget(3000, 3000, 6000, halo=676, max_workers=1, jobs=3)
+        # Intérprete, sesiones y caché de GDAL se cuentan una vez para los tres trabajos
+        self.assertLessEqual(3 * job_mb(shared) + SHARED_MB + shared['gdal_cache_mb'], 6000)
+        self.assertGreater(3 * job_mb(shared) + 3 * SHARED_MB + shared['gdal_cache_mb'], 6000)
+        self.assertLess(shared['batch_size'], alone['batch_size'])
+
+    def test_halo_from_radii(self):
+        budget = memory.plan_budget(3000, 60000, 3000, max_workers=1)
+        self.assertGreater(budget['n_bands'], 1)
+        self.assertLessEqual(budget['n_bands'], 60000 // 676)
+
+
+class TestMemoryGuard(unittest.TestCase):
+    """Batch backoff when RSS approaches the limit."""
+
+    def test_backoff(self):
+        guard = memory.MemoryGuard(1000)
+        with mock.patch.object(memory, 'rss_mb', return_value=500):
+            self.assertEqual(guard.batch(8), 8)
+        with mock.patch.object(memory, 'rss_mb', return_value=950):
+            self.assertEqual(guard.batch(8), 4)
+            self.assertEqual(guard.batch(8), 2)
+            self.assertEqual(guard.batch(8), 1)
+            self.assertEqual(guard.batch(8), 1)
+        # Bajo el límite no vuelve a crecer
+        with mock.patch.object(memory, 'rss_mb', return_value=500):
+            self.assertEqual(guard.batch(8), 1)
+
+    def test_shared_between_jobs(self):
+        guard = memory.MemoryGuard(1000)
+        with mock.patch.object(memory, 'rss_mb', return_value=950):
+            self.assertEqual(guard.batch(16), 8)
+        # Otro trabajo con otro lote también se reduce
+        with mock.patch.object(memory, 'rss_mb', return_value=500):
+            self.assertEqual(guard.batch(4), 2)
+            self.assertEqual(guard.batch(16), 8)
+
+    def test_unknown_rss(self):
+        guard = memory.MemoryGuard(1000)
+        with mock.patch.object(memory, 'rss_mb', return_value=None):
+            self.assertEqual(guard.batch(8), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# coding=utf-8
+"""Tests for the per-stage performance report (palmeras_algo.perf)."""
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from palmeras_algo import perf
+
+
+class TestPerfRecorder(unittest.TestCase):
+    """Memory is sampled during the job and shared processes are labelled."""
+
+    def test_peak_is_sampled_during_the_job(self):
+        samples = iter([100.0, 100.0, 180.0, 120.0])
+        with mock.patch.object(perf, 'rss_mb', lambda: next(samples)), \
+                mock.patch.object(perf, 'peak_rss_mb', return_value=5000.0):
+            with perf.recording('job') as recorder:
+                with perf.stage('semantic_inference'):
+                    pass
+                report = recorder.report()
+        # El pico de toda la vida del proceso (5000 MB) no se atribuye al trabajo
+        self.assertEqual(report['peak_rss_mb'], 180.0)
+        self.assertEqual(report['process_peak_rss_mb'], 5000.0)
+        self.assertEqual(report['concurrent_jobs'], 1)
+        self.assertEqual(report['stages']['semantic_inference']['calls'], 1)
+
+    def test_no_measurement(self):
+        with mock.patch.object(perf, 'rss_mb', return_value=None):
+            self.assertIsNone(perf.PerfRecorder('job').report()['peak_rss_mb'])
+
+    def test_concurrent_jobs(self):
+        def job(name):
+            with perf.concurrent(2), perf.recording(name) as recorder:
+                return recorder.report()
+
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            reports = list(pool.map(job, ['a', 'b']))
+        self.assertEqual([r['concurrent_jobs'] for r in reports], [2, 2])
+        self.assertIn('compartido por 2 trabajos', perf.summary_lines(reports[0])[0])
+        self.assertEqual(perf.PerfRecorder('c').concurrent_jobs, 1)
+
+
+class TestMergeStages(unittest.TestCase):
+    """Stages recorded in two processes are added up, not replaced."""
+
+    def test_same_stage_is_summed(self):
+        worker = perf.PerfRecorder('venv')
+        worker.add('products', 2.0, 1.0, pixels=4000, windows=10)
+        worker.add('stitch', 1.0)
+        qgis = perf.PerfRecorder('qgis')
+        qgis.add('products', 3.0, 0.5, pixels=6000, windows=30, calls=2)
+        qgis.add('load_layers', 0.5)
+        report = perf.merge_stages(worker.report(), qgis)
+        products = report['stages']['products']
+        self.assertEqual((products['calls'], products['wall_s'], products['cpu_s']), (3, 5.0, 1.5))
+        self.assertEqual((products['pixels'], products['windows']), (10000, 40))
+        self.assertEqual((products['pixels_per_s'], products['windows_per_s']), (2000.0, 8.0))
+        self.assertEqual(sorted(report['stages']), ['load_layers', 'products', 'stitch'])
+        self.assertIn('qgis', report['processes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+# coding=utf-8
+"""Tests for progress events and cancellation points (palmeras_algo.progress)."""
+
+import unittest
+
+from palmeras_algo.progress import GdalCallback, JobCancelled, ProgressReporter, step
+from _env_core import stage_percent, stage_text
+
+
+class TestCancellation(unittest.TestCase):
+    """Cancellation outside the window loops."""
+
+    def setUp(self):
+        self.events = []
+        self.cancel = False
+        self.progress = ProgressReporter(self.events.append, is_cancelled=lambda: self.cancel)
+
+    def test_step(self):
+        step(None, 'roi')
+        step(self.progress, 'roi')
+        self.assertEqual(self.events[-1]['stage'], 'roi')
+        self.cancel = True
+        with self.assertRaises(JobCancelled):
+            step(self.progress, 'products')
+
+    def test_gdal_callback_reports_each_percent(self):
+        callback = GdalCallback(self.progress, 'polygonize')
+        for complete in (0.0, 0.001, 0.5, 0.501, 1.0):
+            self.assertEqual(callback(complete, '', None), 1)
+        self.assertEqual([e['done'] for e in self.events], [0, 50, 100])
+
+    def test_gdal_callback_stops_gdal(self):
+        def polygonize(callback=None):
+            for complete in (0.0, 0.5, 1.0):
+                if not callback(complete, '', None):
+                    raise RuntimeError('User terminated')
+                self.cancel = True
+            return 'done'
+
+        callback = GdalCallback(self.progress, 'polygonize')
+        with self.assertRaises(JobCancelled):
+            callback.run(polygonize)
+        self.cancel = False
+        self.assertEqual(GdalCallback(None, 'polygonize').run(polygonize), 'done')
+
+    def test_gdal_errors_are_not_hidden(self):
+        def failing(callback=None):
+            raise RuntimeError('broken')
+        with self.assertRaises(RuntimeError):
+            GdalCallback(self.progress, 'roi').run(failing)
+
+
+class TestStageText(unittest.TestCase):
+    """Progress bar position and text in the plugin."""
+
+    def test_percent(self):
+        self.assertEqual(stage_percent({'stage': 'semantic', 'done': 5, 'total': 10}), 20.0)
+        self.assertEqual(stage_percent({'stage': 'instances', 'done': 10, 'total': 10}), 100.0)
+        self.assertEqual(stage_percent({'stage': 'roi', 'done': 0, 'total': 1}), 0.0)
+        self.assertEqual(stage_percent({'stage': 'semantic_postprocess', 'done': 0, 'total': 1}), 40.0)
+        self.assertEqual(stage_percent({'stage': 'polygonize', 'done': 10, 'total': 100}), 100.0)
+
+    def test_text(self):
+        self.assertEqual(stage_text({'stage': 'bands', 'done': 1, 'total': 4, 'rate': 0.25}), 'bands: 1/4 bandas (0.2/s)')
+        self.assertEqual(stage_text({'stage': 'polygonize', 'done': 42, 'total': 100, 'rate': 0}), 'polygonize: 42%')
+        self.assertEqual(stage_text({'stage': 'labeling', 'done': 0, 'total': 1, 'rate': 0}), 'labeling')
+
+
+if __name__ == '__main__':
+    unittest.main()
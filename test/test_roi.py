@@ -0,0 +1,66 @@
+# coding=utf-8
+"""Tests for the area of interest coarse mask (palmeras_algo.roi)."""
+
+import unittest
+
+import numpy as np
+
+from palmeras_algo import roi as roi_mod
+
+CELL = 32
+
+
+def make_roi(width, height, cells):
+    """AOI dict like roi.rasterize_roi with the given (row, col) cells set."""
+    mask = np.zeros((-(-height // CELL), -(-width // CELL)), dtype=bool)
+    for row, col in cells:
+        mask[row, col] = True
+    rows, cols = np.nonzero(mask)
+    bbox = (int(cols.min()) * CELL, int(rows.min()) * CELL,
+            min((int(cols.max()) + 1) * CELL, width), min((int(rows.max()) + 1) * CELL, height))
+    return {'mask': mask, 'cell': CELL, 'bbox': bbox, 'size': (width, height)}
+
+
+class TestRoi(unittest.TestCase):
+    """Test window selection against the AOI mask."""
+
+    def test_window_intersects(self):
+        roi = make_roi(1024, 1024, [(10, 10)])
+        self.assertTrue(roi_mod.window_intersects(roi, 336, 336, 20))
+        self.assertFalse(roi_mod.window_intersects(roi, 100, 100, 20))
+        self.assertTrue(roi_mod.window_intersects(None, 100, 100, 20))
+
+    def test_interior_aoi_selects_windows(self):
+        roi = make_roi(2048, 2048, [(30, 30)])
+        roi_mod.require_windows(roi, 256, 192)
+
+    def test_edge_aoi_selects_no_windows(self):
+        # Only the first 32 px row: inside the 64 px margin no window core reaches
+        roi = make_roi(2048, 2048, [(0, 10), (0, 11)])
+        self.assertFalse(roi_mod.covers(roi, 64))
+        with self.assertRaises(ValueError):
+            roi_mod.require_windows(roi, 256, 192)
+
+    def test_edge_aoi_covered_by_window_cores(self):
+        # Same AOI, one cell further in: the windows of the first row reach it
+        roi = make_roi(2048, 2048, [(2, 10)])
+        self.assertTrue(roi_mod.covers(roi, 64))
+        roi_mod.require_windows(roi, 256, 192)
+
+    def test_raster_smaller_than_window(self):
+        roi = make_roi(300, 300, [(4, 4)])
+        with self.assertRaises(ValueError):
+            roi_mod.require_windows(roi, 256, 192)
+
+    def test_covers_region(self):
+        roi = make_roi(2048, 2048, [(0, 10), (40, 10)])
+        # Band of the first 512 rows: its AOI only lies in the edge margin
+        self.assertFalse(roi_mod.covers(roi, 64, 0, 0, 2048, 512))
+        self.assertTrue(roi_mod.covers(roi, 64, 0, 1024, 2048, 1536))
+
+    def test_no_roi(self):
+        roi_mod.require_windows(None, 256, 192)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# coding=utf-8
+"""Tests for the per-polygon query index (palmeras_algo.spatial_index)."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from palmeras_algo import spatial_index
+from palmeras_algo.spatial_index import CODES, SpatialIndex, points_in_rings
+
+
+def make_table(x, y, seed=0):
+    rng = np.random.default_rng(seed)
+    n = len(x)
+    return {'id': np.arange(1, n + 1), 'x': np.asarray(x, dtype=np.float64), 'y': np.asarray(y, dtype=np.float64),
+            'clase': np.array(CODES)[rng.integers(0, len(CODES), n)], 'area_m2': rng.uniform(1, 30, n)}
+
+
+def ring(points):
+    """Closed ring (n x 2) from its vertices."""
+    points = np.asarray(points, dtype=np.float64)
+    return np.vstack([points, points[:1]])
+
+
+def circle(cx, cy, r, n=48):
+    t = np.linspace(0, 2 * np.pi, n, endpoint=False)
+    return ring(np.column_stack([cx + r * np.cos(t), cy + r * np.sin(t)]))
+
+
+def brute_force(table, rings):
+    """Counts and areas per species testing every point."""
+    hits = points_in_rings(table['x'], table['y'], rings)
+    species = np.searchsorted(CODES, table['clase'][hits])
+    return (np.bincount(species, minlength=len(CODES)),
+            np.bincount(species, weights=table['area_m2'][hits], minlength=len(CODES)))
+
+
+class TestQuery(unittest.TestCase):
+    """Cell classification gives the same result as testing every point."""
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.table = make_table(500000 + rng.uniform(0, 1000, 5000), 9000000 + rng.uniform(0, 800, 5000))
+        self.index = SpatialIndex.build(self.table)
+
+    def check(self, rings, table=None, index=None):
+        table = self.table if table is None else table
+        index = self.index if index is None else index
+        counts, areas = index.query(rings)
+        expected_counts, expected_areas = brute_force(table, rings)
+        np.testing.assert_array_equal(counts, expected_counts)
+        np.testing.assert_allclose(areas, expected_areas)
+        return counts
+
+    def test_polygons(self):
+        x0, y0 = 500000, 9000000
+        shapes = {
+            'square': [ring([(x0 + 100, y0 + 100), (x0 + 600, y0 + 100), (x0 + 600, y0 + 500), (x0 + 100, y0 + 500)])],
+            'circle': [circle(x0 + 500, y0 + 400, 300)],
+            'concave': [ring([(x0, y0), (x0 + 900, y0 + 50), (x0 + 200, y0 + 300), (x0 + 950, y0 + 700),
+                              (x0 + 50, y0 + 780)])],
+            'hole': [circle(x0 + 500, y0 + 400, 350), circle(x0 + 480, y0 + 420, 150)],
+            'multipolygon': [circle(x0 + 200, y0 + 200, 120), circle(x0 + 750, y0 + 600, 180)],
+            'beyond_grid': [ring([(x0 - 500, y0 - 500), (x0 + 2000, y0 - 500), (x0 + 2000, y0 + 2000),
+                                  (x0 - 500, y0 + 2000)])],
+            'outside': [circle(x0 + 5000, y0 + 5000, 100)],
+        }
+        for name, rings in shapes.items():
+            with self.subTest(name):
+                counts = self.check(rings)
+                self.assertEqual(counts.sum() == 0, name == 'outside')
+        self.assertEqual(self.check(shapes['beyond_grid']).sum(), 5000)
+
+    def test_edges_on_cell_lines(self):
+        # Lados sobre las líneas de la grilla y puntos sobre los lados
+        origin, size = self.index.origin, self.index.cell_size
+        xa, xb = origin[0] + 3 * size, origin[0] + 9 * size
+        ya, yb = origin[1] + 2 * size, origin[1] + 7 * size
+        table = make_table(np.r_[self.table['x'], xa + 1e-9, xb - 1e-9, (xa + xb) / 2],
+                           np.r_[self.table['y'], (ya + yb) / 2, (ya + yb) / 2, yb - 1e-9], seed=1)
+        index = SpatialIndex.build(table)
+        self.check([ring([(xa, ya), (xb, ya), (xb, yb), (xa, yb)])], table, index)
+
+    def test_inner_cells_skip_point_tests(self):
+        x0, y0 = 500000, 9000000
+        rings = [ring([(x0 + 50, y0 + 50), (x0 + 950, y0 + 50), (x0 + 950, y0 + 750), (x0 + 50, y0 + 750)])]
+        tested = []
+        with mock.patch.object(spatial_index, 'points_in_rings',
+                               side_effect=lambda x, y, r: tested.append(len(x)) or points_in_rings(x, y, r)):
+            counts, _ = self.index.query(rings)
+        self.assertEqual(counts.sum(), brute_force(self.table, rings)[0].sum())
+        # Solo los puntos de las celdas del borde pasan por la prueba
+        self.assertLess(sum(tested), counts.sum() / 2)
+
+    def test_empty_table(self):
+        table = make_table([], [])
+        index = SpatialIndex.build(table)
+        counts, areas = index.query([circle(0, 0, 10)])
+        self.assertEqual(counts.tolist(), [0] * len(CODES))
+        self.assertEqual(areas.tolist(), [0.0] * len(CODES))
+        self.assertEqual(index.query([])[0].tolist(), [0] * len(CODES))
+
+    def test_single_point(self):
+        table = make_table([500010.0], [9000020.0])
+        index = SpatialIndex.build(table)
+        self.assertEqual(self.check([circle(500010, 9000020, 5)], table, index).sum(), 1)
+        self.assertEqual(self.check([circle(500030, 9000020, 5)], table, index).sum(), 0)
+        # El punto en el hueco no cuenta
+        self.assertEqual(self.check([circle(500010, 9000020, 10), circle(500010, 9000020, 5)],
+                                    table, index).sum(), 0)
+
+
+class TestStorage(unittest.TestCase):
+    """The index round-trips through its .npz file."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_save_and_load(self):
+        rng = np.random.default_rng(3)
+        table = make_table(rng.uniform(0, 300, 400), rng.uniform(0, 200, 400))
+        output = os.path.join(self.folder, 'out.tif')
+        spatial_index.write_index(table, output)
+        index = spatial_index.open_index(output)
+        rings = [circle(150, 100, 80)]
+        np.testing.assert_array_equal(index.query(rings)[0], SpatialIndex.build(table).query(rings)[0])
+        np.testing.assert_array_equal(index.cell_counts.sum(axis=0), np.bincount(
+            np.searchsorted(CODES, table['clase']), minlength=len(CODES)))
+
+
+if __name__ == '__main__':
+    unittest.main()
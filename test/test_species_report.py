@@ -0,0 +1,63 @@
+# coding=utf-8
+"""Tests for the species area report (palmeras_algo.species_report)."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from osgeo import gdal
+
+from palmeras_algo import gdal_io
+from palmeras_algo import species_report
+
+
+class TestSpeciesReport(unittest.TestCase):
+    """Areas come from the class raster pixels, not from crown polygons."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.clas = os.path.join(self.folder, 'out_clas.tif')
+        clas = np.zeros((1500, 40), dtype=np.uint8)
+        clas[0:10, 0:10] = 1          # 100 px
+        clas[20:22, 0:20] = 2         # 40 px
+        clas[1400:1403, 5] = 3        # 3 px, en el segundo bloque de filas
+        # Píxeles de clase sueltos, que ninguna copa (polígono de instancia) cubriría
+        clas[1499, 39] = 1
+        dataset = gdal.GetDriverByName('GTiff').Create(self.clas, 40, 1500, 1, gdal.GDT_Byte)
+        dataset.SetGeoTransform((500000.0, 0.5, 0.0, 9000000.0, 0.0, -0.5))
+        dataset.GetRasterBand(1).WriteArray(clas)
+        dataset.FlushCache()
+        dataset = None
+
+    def tearDown(self):
+        gdal_io.close_datasets()
+        shutil.rmtree(self.folder)
+
+    def test_class_pixels(self):
+        pixels, _ = species_report.class_pixels(self.clas)
+        self.assertEqual(list(pixels[1:]), [101, 40, 3])
+
+    def test_areas(self):
+        areas = species_report.class_areas(self.clas)
+        np.testing.assert_allclose(areas, [101 * 0.25 / 10000, 40 * 0.25 / 10000, 3 * 0.25 / 10000])
+
+    def test_rotated_geotransform(self):
+        # Píxel de 0.5 m girado 30°: los términos diagonales solos darían 0.1875 m²
+        c, s = 0.5 * np.cos(np.pi / 6), 0.5 * np.sin(np.pi / 6)
+        areas = species_report.areas_ha(np.array([0, 100, 40, 3]), (500000.0, c, -s, 9000000.0, -s, -c))
+        np.testing.assert_allclose(areas, [100 * 0.25 / 10000, 40 * 0.25 / 10000, 3 * 0.25 / 10000])
+
+    def test_csv(self):
+        output = os.path.join(self.folder, 'out.tif')
+        path, areas = species_report.write_species_report(output, self.clas, [1, 2, 3])
+        with open(path) as fh:
+            lines = fh.read().splitlines()
+        self.assertEqual(lines[0], ','.join(species_report.HEADER))
+        self.assertEqual([line.split(',')[:2] for line in lines[1:]],
+                         [['Euterpe precautoria', '2'], ['Mauritia flexuosa', '1'], ['Oenocarpus bataua', '3']])
+
+
+if __name__ == '__main__':
+    unittest.main()
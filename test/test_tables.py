@@ -0,0 +1,94 @@
+# coding=utf-8
+"""Tests for the per-palm attribute and columnar tables (palmeras_algo.tables)."""
+
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from palmeras_algo import tables
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+
+def palm_table():
+    """Three palms with the diameter metric, in id order."""
+    return {
+        'id': np.array([1, 2, 3], dtype=np.int32),
+        'clase': np.array([15, 35, 15], dtype=np.float32),
+        'pixels': np.array([9, 8, 1]),
+        'area_m2': np.array([2.25, 2.0, 0.25]),
+        'x': np.array([500001.25, 500005.0, 500001.25]),
+        'y': np.array([8999998.75, 8999995.0, 8999995.75]),
+        'diameter_m': np.array([1.69, 1.6, 0.56]),
+    }
+
+
+class TestTables(unittest.TestCase):
+    """Column types, CSV fallback and the plugin attribute CSV."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.output = os.path.join(self.folder, 'vuelo_predicted.tif')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def read_csv(self, path):
+        with open(path, newline='', encoding='utf-8') as fh:
+            return list(csv.reader(fh))
+
+    @unittest.skipIf(pyarrow is None, 'pyarrow no está instalado')
+    def test_parquet_schema(self):
+        path = tables.write_table(palm_table(), self.output, 'parquet', flight_id='vuelo')
+        self.assertTrue(path.endswith(tables.TABLE_SUFFIX + '.parquet'))
+        schema = pq.read_schema(path)
+        self.assertEqual(schema.names, ['flight_id', 'id', 'clase', 'especie', 'area_m2',
+                                        'easting', 'northing', 'diameter_m'])
+        expected = {'id': pyarrow.int64(), 'clase': pyarrow.int16(), 'area_m2': pyarrow.float64(),
+                    'easting': pyarrow.float64(), 'northing': pyarrow.float64(),
+                    'diameter_m': pyarrow.float64()}
+        for name, type_ in expected.items():
+            self.assertEqual(schema.field(name).type, type_, name)
+        for name in ('flight_id', 'especie'):
+            type_ = schema.field(name).type
+            self.assertTrue(pyarrow.types.is_dictionary(type_), name)
+            self.assertEqual(type_.value_type, pyarrow.string())
+        table = pq.read_table(path).to_pydict()
+        self.assertEqual(table['especie'], ['Mauritia flexuosa', 'Oenocarpus bataua', 'Mauritia flexuosa'])
+        self.assertEqual(table['flight_id'], ['vuelo'] * 3)
+
+    def test_csv_fallback_without_pyarrow(self):
+        with mock.patch.dict(sys.modules, {'pyarrow': None, 'pyarrow.parquet': None}), \
+                self.assertLogs(tables.logger, 'WARNING'):
+            path = tables.write_table(palm_table(), self.output, 'parquet', flight_id='vuelo')
+        self.assertTrue(path.endswith(tables.TABLE_SUFFIX + '.csv'))
+        rows = self.read_csv(path)
+        self.assertEqual(rows[0], list(tables.columns(palm_table())))
+        self.assertEqual(rows[1][:4], ['vuelo', '1', '15', 'Mauritia flexuosa'])
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            tables.write_table(palm_table(), self.output, 'xlsx')
+
+    def test_attributes_csv(self):
+        path = tables.write_attributes_csv(palm_table(), self.output)
+        self.assertEqual(path, os.path.join(self.folder, 'vuelo_predicted' + tables.ATTRIBUTES_SUFFIX))
+        rows = self.read_csv(path)
+        self.assertEqual(rows[0], tables.ATTRIBUTE_FIELDS + ['DIAM_M'])
+        self.assertEqual([row[0] for row in rows[1:]], ['1', '2', '3'])
+        self.assertEqual(rows[2][2], 'Oenocarpus bataua')
+        self.assertEqual([float(value) for value in rows[2][3:]], [2.0, 500005.0, 8999995.0, 1.6])
+
+
+if __name__ == '__main__':
+    unittest.main()
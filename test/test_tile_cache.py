@@ -0,0 +1,95 @@
+# coding=utf-8
+"""Tests for the per-window prediction cache (palmeras_algo.tile_cache)."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from palmeras_algo import tile_cache
+
+
+class TestTileCache(unittest.TestCase):
+    """Size accounting and LRU eviction."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.model = os.path.join(self.folder, 'model.onnx')
+        with open(self.model, 'wb') as fh:
+            fh.write(b'model')
+        self.cache_dir = os.path.join(self.folder, 'tiles')
+        self.entry = np.zeros(1000, dtype=np.float32)
+        self.entry_bytes = None
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def cache(self, entries=10.0):
+        """Cache sized for 'entries' arrays like self.entry."""
+        if self.entry_bytes is None:
+            probe = tile_cache.TileCache(self.model, {}, cache_dir=os.path.join(self.folder, 'probe'), max_mb=1)
+            probe.put('probe', self.entry)
+            self.entry_bytes = os.path.getsize(probe._path('probe'))
+        return tile_cache.TileCache(self.model, {'stage': 'test'}, cache_dir=self.cache_dir,
+                                    max_mb=entries * self.entry_bytes / (1024 * 1024))
+
+    def put(self, cache, key, age):
+        """Stores an entry last used 'age' seconds ago."""
+        cache.put(key, self.entry)
+        stamp = 1e9 - age
+        os.utime(cache._path(key), (stamp, stamp))
+
+    def test_disabled_by_default(self):
+        os.environ.pop('PALMERAS_TILE_CACHE_MB', None)
+        self.assertIsNone(tile_cache.create_cache(self.model, {}, cache_dir=self.cache_dir))
+        self.assertIsNotNone(tile_cache.create_cache(self.model, {}, cache_dir=self.cache_dir, max_mb=1))
+
+    def test_round_trip(self):
+        cache = self.cache()
+        key = cache.key(np.arange(12).reshape(3, 4))
+        self.assertIsNone(cache.get(key))
+        cache.put(key, self.entry + 1)
+        np.testing.assert_array_equal(cache.get(key), self.entry + 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        # Otros píxeles u otros parámetros dan otra clave
+        self.assertNotEqual(key, cache.key(np.arange(12).reshape(4, 3)))
+        other = tile_cache.TileCache(self.model, {'stage': 'other'}, cache_dir=self.cache_dir, max_mb=1)
+        self.assertNotEqual(key, other.key(np.arange(12).reshape(3, 4)))
+
+    def test_overwrite_is_counted_once(self):
+        cache = self.cache()
+        cache.put('a', self.entry)
+        cache.put('a', self.entry)
+        self.assertEqual(cache._size, self.entry_bytes)
+
+    def test_size_is_persisted(self):
+        cache = self.cache()
+        cache.put('a', self.entry)
+        cache.put('b', self.entry)
+        # Una caché nueva lee el contador en vez de recorrer la carpeta
+        with mock.patch.object(tile_cache.TileCache, '_entries', side_effect=AssertionError('walked')):
+            reopened = self.cache()
+        self.assertEqual(reopened._size, 2 * self.entry_bytes)
+
+    def test_lru_eviction(self):
+        cache = self.cache(entries=3.5)
+        self.put(cache, 'oldest', 30)
+        self.put(cache, 'used', 20)
+        self.put(cache, 'newer', 10)
+        # Un acierto cuenta como uso reciente
+        self.assertIsNotNone(cache.get('used'))
+        self.put(cache, 'newest', 0)
+        cache.put('last', self.entry)
+        remaining = {key for key in ('oldest', 'used', 'newer', 'newest', 'last')
+                     if os.path.exists(cache._path(key))}
+        # Se desaloja hasta el 90% del máximo (3 entradas), empezando por las más viejas
+        self.assertEqual(remaining, {'used', 'last', 'newest'})
+        self.assertEqual(cache._size, 3 * self.entry_bytes)
+        self.assertEqual(cache._read_size(), 3 * self.entry_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,183 @@
+# coding=utf-8
+"""Tests for the banded mode (palmeras_algo.tiling)."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from osgeo import gdal
+from skimage.measure import label
+
+from palmeras_algo import apply_model
+from palmeras_algo import gdal_io
+from palmeras_algo import palmeras_deteccion
+from palmeras_algo import tiling
+from palmeras_algo.apply_model_dwt import CLASS_TO_CITYSCAPES
+
+
+def random_instances(shape, seed=0, n_blobs=60):
+    """Float32 instance raster with random blobs of the three species codes."""
+    rng = np.random.default_rng(seed)
+    instances = np.full(shape, -9999, dtype=np.float32)
+    codes = list(CLASS_TO_CITYSCAPES.values())
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    for _ in range(n_blobs):
+        cy, cx = rng.integers(0, shape[0]), rng.integers(0, shape[1])
+        r = rng.integers(2, 9)
+        instances[(yy - cy) ** 2 + (xx - cx) ** 2 <= r * r] = codes[rng.integers(0, len(codes))]
+    return instances
+
+
+def whole_counts(instances):
+    return {name: label(instances == code, connectivity=2, return_num=True)[1]
+            for name, code in CLASS_TO_CITYSCAPES.items()}
+
+
+class TestPlan(unittest.TestCase):
+    """Band planning."""
+
+    def test_split_axis(self):
+        parts = tiling.split_axis(1000, 3, 100)
+        self.assertEqual([(a0, a1) for a0, a1, _, _ in parts], [(0, 333), (333, 667), (667, 1000)])
+        self.assertEqual([(r0, r1) for _, _, r0, r1 in parts], [(0, 433), (233, 767), (567, 1000)])
+
+    def test_split_axis_keeps_cores_above_halo(self):
+        parts = tiling.split_axis(1000, 10, 300)
+        self.assertEqual(len(parts), 3)
+        self.assertTrue(all(a1 - a0 >= 300 for a0, a1, _, _ in parts))
+        self.assertEqual(tiling.split_axis(100, 4, 300), [(0, 100, 0, 100)])
+
+    def test_plan_bands_covers_height(self):
+        bands = tiling.plan_bands(5000, 4)
+        self.assertEqual(bands[0][0], 0)
+        self.assertEqual(bands[-1][1], 5000)
+        for (_, y1, _, _), (y0, _, r0, _) in zip(bands, bands[1:]):
+            self.assertEqual(y1, y0)
+            self.assertEqual(y0 - r0, tiling.DEFAULT_HALO)
+
+    def test_halo_follows_window_radii(self):
+        self.assertEqual(tiling.DEFAULT_HALO, 350 + 262 + 64)
+        self.assertGreater(palmeras_deteccion.band_halo(256, 500), tiling.DEFAULT_HALO)
+        self.assertGreaterEqual(palmeras_deteccion.band_halo(400, 100), 400 + 300)
+
+
+class TestSeams(unittest.TestCase):
+    """Counting instances across band seams."""
+
+    def test_union_find(self):
+        uf = tiling.UnionFind()
+        self.assertTrue(uf.union(1, 2))
+        self.assertTrue(uf.union(3, 2))
+        self.assertFalse(uf.union(1, 3))
+        self.assertEqual(uf.find(1), uf.find(3))
+        self.assertNotEqual(uf.find(1), uf.find(4))
+
+    def test_seam_pairs_are_8_connected(self):
+        upper = np.array([0, 1, 0, 0, 2])
+        lower = np.array([0, 0, 5, 0, 0])
+        self.assertEqual(tiling.seam_pairs(upper, lower), {(1, 5)})
+
+    def test_seam_counter_matches_whole_raster(self):
+        instances = random_instances((240, 180))
+        for cuts in ([0, 240], [0, 80, 160, 240], [0, 7, 8, 100, 239, 240]):
+            counter = tiling.SeamCounter()
+            for y0, y1 in zip(cuts[:-1], cuts[1:]):
+                counter.add(instances[y0:y1])
+            self.assertEqual(counter.counts, whole_counts(instances), cuts)
+
+    def test_seam_counter_skipped_band(self):
+        instances = random_instances((200, 150), seed=3)
+        instances[100:120] = -9999
+        counter = tiling.SeamCounter()
+        counter.add(instances[:100])
+        counter.add(instances[120:], adjacent=False)
+        self.assertEqual(counter.counts, whole_counts(instances))
+
+
+class TestBandNormalization(unittest.TestCase):
+    """Bands share the normalization of the whole raster."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'image.tif')
+        rng = np.random.default_rng(1)
+        self.image = rng.integers(1, 255, (300, 200, 3)).astype(np.float32)
+        # Brillo distinto arriba y abajo: los percentiles de cada banda no coinciden
+        self.image[150:] *= 0.3
+        self.image[:20, :30] = 0
+        dataset = gdal.GetDriverByName('GTiff').Create(self.path, 200, 300, 3, gdal.GDT_Float32)
+        for b in range(3):
+            dataset.GetRasterBand(b + 1).WriteArray(self.image[..., b])
+        dataset.FlushCache()
+        dataset = None
+
+    def tearDown(self):
+        gdal_io.close_datasets()
+        shutil.rmtree(self.folder)
+
+    def test_stats_of_full_raster(self):
+        stats = apply_model.normalization_stats(self.path)
+        self.assertEqual(stats, apply_model.band_stats(self.image))
+        whole = apply_model.normalize_image_improved(self.image)
+        band = apply_model.normalize_image_improved(self.image[100:250], stats=stats)
+        np.testing.assert_array_equal(band, whole[100:250])
+        self.assertFalse(np.array_equal(apply_model.normalize_image_improved(self.image[100:250]), band))
+
+    def test_stats_of_window(self):
+        window = (10, 50, 120, 200)
+        stats = apply_model.normalization_stats(self.path, window=window)
+        self.assertEqual(stats, apply_model.band_stats(self.image[50:250, 10:130]))
+
+    def test_large_rasters_are_subsampled(self):
+        stats = apply_model.normalization_stats(self.path, max_pixels=10000)
+        self.assertEqual(len(stats), 3)
+        for (p1, p99, _), (q1, q99, _) in zip(stats, apply_model.band_stats(self.image)):
+            self.assertAlmostEqual(p1, q1, delta=10)
+            self.assertAlmostEqual(p99, q99, delta=10)
+
+
+class TestStitch(unittest.TestCase):
+    """Band cores are stitched and bands outside the AOI get the 0 background."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.reference = gdal.GetDriverByName('GTiff').Create(os.path.join(self.folder, 'image.tif'),
+                                                              20, 30, 1, gdal.GDT_Byte)
+
+    def tearDown(self):
+        self.reference = None
+        gdal_io.close_datasets()
+        shutil.rmtree(self.folder)
+
+    def band(self, i, r0, r1, value):
+        paths = []
+        for suffix, gdal_type in (('', gdal.GDT_Float32), ('_clas', gdal.GDT_Byte)):
+            path = os.path.join(self.folder, f'band_{i}{suffix}.tif')
+            dataset = gdal.GetDriverByName('GTiff').Create(path, 20, r1 - r0, 1, gdal_type)
+            dataset.GetRasterBand(1).WriteArray(np.full((r1 - r0, 20), value))
+            dataset.FlushCache()
+            dataset = None
+            paths.append(path)
+        return tuple(paths)
+
+    def test_inactive_band_is_background(self):
+        bands = [(0, 10, 0, 14), (10, 20, 6, 24), (20, 30, 16, 30)]
+        mauritia = CLASS_TO_CITYSCAPES['mauritia']
+        results = [self.band(0, 0, 14, mauritia), None, self.band(2, 16, 30, mauritia)]
+        output = os.path.join(self.folder, 'out.tif')
+        clas = os.path.join(self.folder, 'out_clas.tif')
+        counter = tiling.stitch_bands(self.reference, bands, results, output, clas)
+        gdal_io.close_datasets()
+        instances = gdal.Open(output).GetRasterBand(1).ReadAsArray()
+        self.assertTrue((instances[:10] == mauritia).all())
+        self.assertTrue((instances[10:20] == 0).all())
+        self.assertTrue((instances[20:] == mauritia).all())
+        self.assertTrue((gdal.Open(clas).GetRasterBand(1).ReadAsArray()[10:20] == 0).all())
+        # La banda vacía separa las dos copas
+        self.assertEqual(counter.counts['mauritia'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
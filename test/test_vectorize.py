@@ -0,0 +1,33 @@
+# coding=utf-8
+"""Tests for the vector outputs (palmeras_algo.vectorize)."""
+
+import unittest
+
+import numpy as np
+
+from palmeras_algo import vectorize
+
+
+class TestFields(unittest.TestCase):
+    """Field names per vector format."""
+
+    def setUp(self):
+        self.table = {'id': np.array([1]), 'diameter_m': np.array([2.0])}
+
+    def names(self, fmt):
+        return [name for name, _ in vectorize.layer_fields(self.table, fmt)]
+
+    def test_ascii_names(self):
+        for fmt in ('GPKG', 'FGB'):
+            names = self.names(fmt)
+            self.assertEqual(names, ['ID', 'CLASE', 'ESPECIE', 'AREA_M2', 'UTM_ESTE', 'UTM_NORTE', 'DIAM_M'])
+            self.assertTrue(all(name.isascii() and name.replace('_', '').isalnum() for name in names))
+
+    def test_shapefile_keeps_legacy_names(self):
+        names = self.names('SHP')
+        self.assertEqual(names[3:6], ['ÁREA(m2)', 'UTM(ESTE)', 'UTM(NORTE)'])
+        self.assertTrue(all(len(name.encode('utf-8')) <= 10 for name in names))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+# coding=utf-8
+"""Tests for the JSON-lines protocol of the venv worker (palmeras_algo.worker and _env_core)."""
+
+import io
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+import _env_core
+from palmeras_algo import worker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Worker con un método lento que informa progreso, para probar la cancelación
+SLOW_WORKER = """
+import time
+from palmeras_algo import worker
+
+def wait(params, progress):
+    for i in range(600):
+        progress('instances', i, 600)
+        time.sleep(0.05)
+
+worker.METHODS['wait'] = wait
+worker.serve()
+"""
+
+
+def worker_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    return env
+
+
+class LineFeed(object):
+    """stdin for serve(): lines are handed over one by one from the test."""
+
+    def __init__(self):
+        self.lines = queue.Queue()
+
+    def send(self, message):
+        self.lines.put(json.dumps(message) + '\n')
+
+    def close(self):
+        self.lines.put(None)
+
+    def __iter__(self):
+        return iter(self.lines.get, None)
+
+
+class TestServe(unittest.TestCase):
+    """Requests and replies of serve() in this process."""
+
+    def setUp(self):
+        # serve() desvía print a stderr: se restaura al terminar
+        self.addCleanup(setattr, sys, 'stdout', sys.stdout)
+        self.stdin = LineFeed()
+        self.stdout = io.StringIO()
+
+    def serve(self):
+        thread = threading.Thread(target=worker.serve, args=(self.stdin, self.stdout), daemon=True)
+        thread.start()
+        return thread
+
+    def replies(self):
+        return [json.loads(line) for line in self.stdout.getvalue().splitlines()]
+
+    def run_requests(self, *requests):
+        for request in requests:
+            self.stdin.send(request)
+        self.stdin.close()
+        self.serve().join(10)
+        return [reply for reply in self.replies() if 'event' not in reply]
+
+    def test_ping(self):
+        replies = self.run_requests({'id': 1, 'method': 'ping'}, {'id': 2, 'method': 'shutdown'})
+        self.assertEqual(replies, [{'id': 1, 'result': 'pong'}, {'id': 2, 'result': None}])
+
+    def test_error_reply_keeps_serving(self):
+        def fail(params, progress):
+            raise ValueError('ráster ilegible')
+
+        with mock.patch.dict(worker.METHODS, {'fail': fail}), \
+                self.assertLogs(worker.logger, 'ERROR'):
+            replies = self.run_requests({'id': 1, 'method': 'fail'}, {'id': 2, 'method': 'nope'},
+                                        {'id': 3, 'method': 'ping'})
+        self.assertEqual(replies[0]['error'], 'ValueError: ráster ilegible')
+        self.assertIn('Traceback', replies[0]['traceback'])
+        self.assertIn('nope', replies[1]['error'])
+        self.assertEqual(replies[2], {'id': 3, 'result': 'pong'})
+
+    def test_invalid_line(self):
+        self.stdin.lines.put('{no es json\n')
+        replies = self.run_requests({'id': 1, 'method': 'ping'})
+        self.assertIsNone(replies[0]['id'])
+        self.assertIn('error', replies[0])
+        self.assertEqual(replies[1], {'id': 1, 'result': 'pong'})
+
+    def test_cancel(self):
+        started = threading.Event()
+
+        def wait(params, progress):
+            started.set()
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline:
+                progress('instances', 0, 1)
+                time.sleep(0.01)
+            return 'timeout'
+
+        with mock.patch.dict(worker.METHODS, {'wait': wait}):
+            self.stdin.send({'id': 7, 'method': 'wait'})
+            thread = self.serve()
+            self.assertTrue(started.wait(5))
+            self.stdin.send({'method': 'cancel', 'params': {'id': 7}})
+            self.stdin.send({'id': 8, 'method': 'wait'})
+            self.stdin.send({'method': 'cancel', 'params': {'id': 8}})
+            self.stdin.close()
+            thread.join(10)
+        replies = [reply for reply in self.replies() if 'event' not in reply]
+        self.assertEqual([(reply['id'], reply.get('cancelled')) for reply in replies], [(7, True), (8, True)])
+        self.assertTrue(any(reply.get('event') == 'progress' for reply in self.replies()))
+
+
+class TestInferenceWorker(unittest.TestCase):
+    """The QGIS-side client talking to a real worker process."""
+
+    def start(self, argv):
+        client = _env_core._InferenceWorker(argv, worker_env())
+        self.addCleanup(client.close)
+        return client
+
+    def test_round_trip_and_error(self):
+        client = self.start([sys.executable, '-u', '-m', 'palmeras_algo.worker'])
+        self.assertEqual(client.call('ping'), 'pong')
+        with self.assertRaises(_env_core.WorkerError) as raised:
+            client.call('nope')
+        self.assertNotIsInstance(raised.exception, _env_core.WorkerCancelled)
+        self.assertIn('nope', str(raised.exception))
+        self.assertEqual(client.call('ping'), 'pong')
+
+    def test_cancel(self):
+        client = self.start([sys.executable, '-u', '-c', SLOW_WORKER])
+        events = []
+        with self.assertRaises(_env_core.WorkerCancelled):
+            client.call('wait', on_event=events.append, is_cancelled=lambda: bool(events))
+        self.assertEqual(events[0]['stage'], 'instances')
+        # El proceso sigue vivo y atiende la siguiente petición
+        self.assertTrue(client.alive())
+        self.assertEqual(client.call('ping'), 'pong')
+
+    def test_restart_after_death(self):
+        core = _env_core.EnvCore(plugin_name='test')
+        core.venv_python = sys.executable
+        patches = [mock.patch.object(core, 'build_env', worker_env),
+                   mock.patch.object(core, 'dll_snippet', return_value='import os')]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(_env_core.shutdown_worker)
+
+        first = core.worker(python_path=worker_env()['PYTHONPATH'])
+        self.assertIs(core.worker(python_path=worker_env()['PYTHONPATH']), first)
+        self.assertEqual(first.call('ping'), 'pong')
+        first._proc.kill()
+        first._proc.wait(5)
+        with self.assertRaises(_env_core.WorkerError):
+            first.call('ping')
+
+        second = core.worker(python_path=worker_env()['PYTHONPATH'])
+        self.assertIsNot(second, first)
+        self.assertEqual(second.call('ping'), 'pong')
+
+
+if __name__ == '__main__':
+    unittest.main()